@@ -1,18 +1,26 @@
 """API Gateway - единая точка входа для всех сервисов."""
+import asyncio
 import os
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 # Импорт роутеров сервисов
 from services.project_admin.api import router as project_admin_router
 from services.requirement_processor.api import router as requirement_processor_router
-from services.knowledge_base.api import router as knowledge_base_router
+from services.knowledge_base.api import router as knowledge_base_router, graph_rag
 from services.prompt_store.api import router as prompt_store_router
 from services.requirement_storage.api import router as requirement_storage_router
 from services.requirement_storage.supabase_api import router as requirement_storage_supabase_router
 from services.spec_generator.api import router as spec_generator_router
 from shared.supabase_config import SupabaseClient
+from shared.llm_client import llm_registry
+from shared.llm_cache import llm_cache
+from shared.llm_telemetry import llm_telemetry
+from shared.precompute import analysis_precompute
+from shared.sync_manager import sync_manager
+from services.knowledge_base.graph_rag import neo4j_settings
 from shared.logging_config import get_logger, setup_logging
 from shared.exceptions import (
     app_exception_handler,
@@ -35,9 +43,23 @@ async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения."""
     # Startup
     logger.info("Starting API Gateway...")
+    await graph_rag.connect()
+    graph_sync = None
+    if neo4j_settings.graph_sync_interval > 0 and sync_manager.supabase and sync_manager.graph.available:
+        graph_sync = asyncio.create_task(sync_manager.run_incremental_schedule())
+    outbox_worker = None
+    if neo4j_settings.graph_outbox_enabled and sync_manager.supabase and sync_manager.graph.available:
+        # Без миграции очереди синхронизация с графом молча остановилась бы - сервис не стартует
+        sync_manager.check_outbox()
+        outbox_worker = asyncio.create_task(sync_manager.run_outbox_worker())
     yield
     # Shutdown
     logger.info("Shutting down API Gateway...")
+    for task in (graph_sync, outbox_worker):
+        if task is not None:
+            task.cancel()
+    await graph_rag.close()
+    await llm_registry.aclose()
 
 
 app = FastAPI(
@@ -107,6 +129,30 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/health/llm")
+async def llm_health():
+    """Состояние общих LLM клиентов: загрузка, очереди ограничителей, кэш, телеметрия и предрасчет."""
+    return {
+        **llm_registry.stats(),
+        "cache": llm_cache.stats(),
+        "telemetry": llm_telemetry.stats(),
+        "precompute": analysis_precompute.stats(),
+    }
+
+
+@app.get("/health/graph")
+async def graph_health():
+    """Состояние асинхронного подключения к Neo4j и загрузка пула соединений."""
+    return graph_rag.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Метрики вызовов LLM и пула соединений Neo4j в формате Prometheus."""
+    body = llm_telemetry.prometheus() + graph_rag.metrics.prometheus()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -49,6 +49,32 @@ export const knowledgeAPI = {
 // Specifications API
 export const specificationsAPI = {
   generate: (data) => api.post('/specs/generate', data),
+  // Потоковая генерация (SSE): onEvent(event, data) вызывается для start/token/result/error
+  generateStream: async (data, onEvent) => {
+    const response = await fetch('/api/specs/generate/stream', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(data),
+    })
+    if (!response.ok) {
+      throw new Error(`Stream request failed: ${response.status}`)
+    }
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      const frames = buffer.split('\n\n')
+      buffer = frames.pop()
+      for (const frame of frames) {
+        const event = frame.match(/^event: (.*)$/m)?.[1] || 'message'
+        const payload = frame.match(/^data: (.*)$/m)?.[1]
+        if (payload) onEvent(event, JSON.parse(payload))
+      }
+    }
+  },
   listTemplates: () => api.get('/specs/templates'),
   getTemplate: (type) => api.get(`/specs/templates/${type}`),
   listRequirementSpecs: (requirementId) => api.get(`/specs/requirements/${requirementId}/specs`),
@@ -0,0 +1,68 @@
+-- Миграция для очереди синхронизации требований с Neo4j (transactional outbox)
+-- Выполнить в SQL Editor Supabase
+
+-- Очередь изменений: запись появляется в той же транзакции, что и изменение требования
+CREATE TABLE IF NOT EXISTS graph_sync_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    requirement_id UUID NOT NULL,
+    project_id UUID,
+    operation TEXT NOT NULL,  -- upsert, delete
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    claimed_at TIMESTAMPTZ,
+    claimed_by TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_graph_sync_outbox_pending ON graph_sync_outbox(id) WHERE claimed_at IS NULL;
+
+-- Триггер: изменения требований попадают в очередь атомарно с самой записью
+CREATE OR REPLACE FUNCTION enqueue_graph_sync()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO graph_sync_outbox (requirement_id, project_id, operation)
+        VALUES (OLD.id, OLD.project_id, 'delete');
+        RETURN OLD;
+    END IF;
+    INSERT INTO graph_sync_outbox (requirement_id, project_id, operation)
+    VALUES (NEW.id, NEW.project_id, 'upsert');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS requirements_graph_sync ON requirements;
+CREATE TRIGGER requirements_graph_sync
+AFTER INSERT OR UPDATE OR DELETE ON requirements
+FOR EACH ROW
+EXECUTE FUNCTION enqueue_graph_sync();
+
+-- Забрать пачку записей очереди (несколько обработчиков не получают одни и те же записи;
+-- записи, не подтвержденные за stale_after, выдаются повторно; после max_attempts ошибок записи остаются для разбора)
+CREATE OR REPLACE FUNCTION claim_graph_sync_outbox(
+    batch_size INTEGER,
+    worker TEXT,
+    max_attempts INTEGER DEFAULT 10,
+    stale_after INTERVAL DEFAULT INTERVAL '5 minutes'
+)
+RETURNS SETOF graph_sync_outbox AS $$
+    UPDATE graph_sync_outbox
+    SET claimed_at = NOW(), claimed_by = worker
+    WHERE id IN (
+        SELECT id FROM graph_sync_outbox
+        WHERE (claimed_at IS NULL OR claimed_at < NOW() - stale_after)
+          AND attempts < max_attempts
+        ORDER BY id
+        LIMIT batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING *;
+$$ LANGUAGE sql;
+
+-- Вернуть записи в очередь после ошибки синхронизации
+CREATE OR REPLACE FUNCTION release_graph_sync_outbox(ids BIGINT[], error TEXT)
+RETURNS VOID AS $$
+    UPDATE graph_sync_outbox
+    SET claimed_at = NULL, claimed_by = NULL, attempts = attempts + 1, last_error = error
+    WHERE id = ANY(ids);
+$$ LANGUAGE sql;
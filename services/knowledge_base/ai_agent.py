@@ -1,71 +1,20 @@
 """ИИ агент для Базы знаний требований."""
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain_community.chat_models import ChatOllama
-from langchain_core.messages import HumanMessage, SystemMessage
-from typing import Dict, Any, Optional, List
-from shared.ai_config import ai_settings, ModelProvider
-from shared.prompt_store import prompt_store
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from typing import Callable, Dict, Any, Optional, List, Tuple
+from shared.llm_client import llm_registry
+from shared.llm_telemetry import llm_telemetry, traced
+from shared.prompt_store import prompt_store, PromptTemplate
+from shared.structured_output import ainvoke_structured, invoke_structured
+from shared.token_budget import token_budget
+from services.knowledge_base.schemas import CompletenessAnalysis, ConflictAnalysis, DuplicateAnalysis, RecommendationList
 import json
 
+AGENT_NAME = "knowledge_base"
 
-def create_llm(config: dict):
-    """Создать LLM на основе конфигурации."""
-    provider = config["provider"]
-    model = config["model"]
-    temperature = config["temperature"]
-    api_key = config.get("api_key")
-    base_url = config.get("base_url")
-    
-    if provider == ModelProvider.OPENAI:
-        params = {
-            "model": model,
-            "api_key": api_key,
-            "temperature": temperature,
-        }
-        if base_url:
-            params["base_url"] = base_url
-        return ChatOpenAI(**params)
-    
-    elif provider == ModelProvider.ANTHROPIC:
-        return ChatAnthropic(
-            model=model,
-            anthropic_api_key=api_key,
-            temperature=temperature,
-        )
-    
-    elif provider == ModelProvider.AZURE_OPENAI:
-        from langchain_openai import AzureChatOpenAI
-        return AzureChatOpenAI(
-            azure_endpoint=config.get("azure_endpoint"),
-            azure_deployment=config.get("azure_deployment", model),
-            api_version=config.get("api_version", "2024-02-15-preview"),
-            api_key=api_key,
-            temperature=temperature,
-        )
-    
-    elif provider == ModelProvider.OPENROUTER:
-        # OpenRouter использует OpenAI-совместимый API
-        return ChatOpenAI(
-            model=model,
-            api_key=api_key,
-            base_url=base_url or "https://openrouter.ai/api/v1",
-            temperature=temperature,
-        )
-    
-    elif provider == ModelProvider.OLLAMA:
-        return ChatOllama(
-            model=model,
-            base_url=base_url,
-            temperature=temperature,
-        )
-    
-    else:
-        return ChatOpenAI(
-            model=model or "gpt-4-turbo-preview",
-            api_key=api_key,
-            temperature=temperature,
-        )
+
+def _requirement_text(requirement: Dict) -> str:
+    """Текст требования для оценки релевантности."""
+    return f"{requirement.get('name', '')} {requirement.get('shall', '')}"
 
 
 class KnowledgeBaseAgent:
@@ -73,28 +22,36 @@ class KnowledgeBaseAgent:
     
     def __init__(self):
         """Инициализация агента."""
-        config = ai_settings.get_config_for_agent("knowledge_base")
-        self.llm = create_llm(config)
+        self.llm = llm_registry.get_for_agent(AGENT_NAME)
     
-    def analyze_duplicates(self, new_requirement: Dict, existing_requirements: List[Dict]) -> Dict[str, Any]:
-        """Анализ дубликатов требования."""
+    def _duplicates_messages(self, new_requirement: Dict, existing_requirements: List[Dict]) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для анализа дубликатов (самые похожие требования в пределах бюджета)."""
+        # Номера REQ-N сохраняют позицию требования в исходном списке
+        labels = {id(r): f"REQ-{i+1}" for i, r in enumerate(existing_requirements)}
+        ranked = token_budget.rank(existing_requirements, _requirement_text, _requirement_text(new_requirement))
+        result, _ = token_budget.fit(
+            AGENT_NAME, ranked, lambda items: self._render_duplicates(new_requirement, items, labels)
+        )
+        return result
+    
+    def _render_duplicates(self, new_requirement: Dict, existing_requirements: List[Dict], labels: Dict[int, str]) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Сформировать сообщения для анализа дубликатов."""
         
         # Получить промпт из хранилища
         prompt_template = prompt_store.get_active_prompt("knowledge_base", "duplicate_analysis")
         
         if prompt_template:
             existing_text = "\n".join([
-                f"REQ-{i+1}: {r.get('name', '')} - {r.get('shall', '')}"
-                for i, r in enumerate(existing_requirements)
+                f"{labels[id(r)]}: {r.get('name', '')} - {r.get('shall', '')}"
+                for r in existing_requirements
             ])
-            human_prompt = prompt_store.render_prompt(
+            system_prompt, human_prompt = prompt_store.render_parts(
                 prompt_template.id,
                 {
                     "new_requirement": json.dumps(new_requirement, ensure_ascii=False, indent=2),
                     "existing_requirements": existing_text
                 }
             )
-            system_prompt = ""
         else:
             # Fallback на встроенный промпт
             system_prompt = """You are an expert in requirement analysis.
@@ -110,8 +67,8 @@ Return JSON:
 }"""
 
             existing_text = "\n".join([
-                f"REQ-{i+1}: {r.get('name', '')} - {r.get('shall', '')}"
-                for i, r in enumerate(existing_requirements)
+                f"{labels[id(r)]}: {r.get('name', '')} - {r.get('shall', '')}"
+                for r in existing_requirements
             ])
             
             human_prompt = f"""New requirement:
@@ -126,25 +83,46 @@ Analyze for duplicates."""
         if system_prompt:
             messages.append(SystemMessage(content=system_prompt))
         messages.append(HumanMessage(content=human_prompt))
-        
+        return messages, prompt_template
+    
+    @traced
+    def analyze_duplicates(self, new_requirement: Dict, existing_requirements: List[Dict]) -> Dict[str, Any]:
+        """Анализ дубликатов требования."""
+        messages, prompt = self._duplicates_messages(new_requirement, existing_requirements)
         try:
-            response = self.llm.invoke(messages)
-            content = response.content
-            
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            
-            return json.loads(content)
-        except:
-            return {
-                "is_duplicate": False,
-                "duplicate_of": [],
-                "similarity_score": 0.0,
-                "reason": "Analysis failed"
-            }
+            return invoke_structured(self.llm, messages, DuplicateAnalysis, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
+            return self._duplicates_fallback()
     
-    def analyze_conflicts(self, requirement: Dict, other_requirements: List[Dict]) -> Dict[str, Any]:
-        """Анализ противоречий требования."""
+    @traced
+    async def aanalyze_duplicates(self, new_requirement: Dict, existing_requirements: List[Dict]) -> Dict[str, Any]:
+        """Асинхронный анализ дубликатов требования."""
+        messages, prompt = self._duplicates_messages(new_requirement, existing_requirements)
+        try:
+            return await ainvoke_structured(self.llm, messages, DuplicateAnalysis, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
+            return self._duplicates_fallback()
+    
+    @staticmethod
+    def _duplicates_fallback() -> Dict[str, Any]:
+        """Результат анализа дубликатов по умолчанию."""
+        return {
+            "is_duplicate": False,
+            "duplicate_of": [],
+            "similarity_score": 0.0,
+            "reason": "Analysis failed"
+        }
+    
+    def _conflicts_messages(self, requirement: Dict, other_requirements: List[Dict]) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для анализа противоречий (самые релевантные требования в пределах бюджета)."""
+        ranked = token_budget.rank(other_requirements, _requirement_text, _requirement_text(requirement))
+        result, _ = token_budget.fit(AGENT_NAME, ranked, lambda items: self._render_conflicts(requirement, items))
+        return result
+    
+    def _render_conflicts(self, requirement: Dict, other_requirements: List[Dict]) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Сформировать сообщения для анализа противоречий."""
         
         # Получить промпт из хранилища
         prompt_template = prompt_store.get_active_prompt("knowledge_base", "conflict_analysis")
@@ -154,14 +132,13 @@ Analyze for duplicates."""
                 f"{r.get('identifier', '')}: {r.get('shall', '')}"
                 for r in other_requirements
             ])
-            human_prompt = prompt_store.render_prompt(
+            system_prompt, human_prompt = prompt_store.render_parts(
                 prompt_template.id,
                 {
                     "requirement": json.dumps(requirement, ensure_ascii=False, indent=2),
                     "other_requirements": others_text
                 }
             )
-            system_prompt = ""
         else:
             # Fallback на встроенный промпт
             system_prompt = """You are an expert in requirement analysis.
@@ -197,23 +174,30 @@ Analyze for conflicts."""
         if system_prompt:
             messages.append(SystemMessage(content=system_prompt))
         messages.append(HumanMessage(content=human_prompt))
-        
+        return messages, prompt_template
+    
+    @traced
+    def analyze_conflicts(self, requirement: Dict, other_requirements: List[Dict]) -> Dict[str, Any]:
+        """Анализ противоречий требования."""
+        messages, prompt = self._conflicts_messages(requirement, other_requirements)
         try:
-            response = self.llm.invoke(messages)
-            content = response.content
-            
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            
-            return json.loads(content)
-        except:
-            return {
-                "has_conflicts": False,
-                "conflicts": []
-            }
+            return invoke_structured(self.llm, messages, ConflictAnalysis, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
+            return {"has_conflicts": False, "conflicts": []}
     
-    def generate_recommendations(self, requirement: Dict, context: Dict) -> List[str]:
-        """Генерация рекомендаций по дополнению или уточнению требования."""
+    @traced
+    async def aanalyze_conflicts(self, requirement: Dict, other_requirements: List[Dict]) -> Dict[str, Any]:
+        """Асинхронный анализ противоречий требования."""
+        messages, prompt = self._conflicts_messages(requirement, other_requirements)
+        try:
+            return await ainvoke_structured(self.llm, messages, ConflictAnalysis, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
+            return {"has_conflicts": False, "conflicts": []}
+    
+    def _recommendations_messages(self, requirement: Dict, context: Dict) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для генерации рекомендаций."""
         
         system_prompt = """You are an expert business analyst.
 Analyze the requirement and provide recommendations for:
@@ -237,20 +221,38 @@ Provide recommendations."""
             SystemMessage(content=system_prompt),
             HumanMessage(content=human_prompt)
         ]
-        
+        return messages, None
+    
+    @traced
+    def generate_recommendations(self, requirement: Dict, context: Dict) -> List[str]:
+        """Генерация рекомендаций по дополнению или уточнению требования."""
+        messages, prompt = self._recommendations_messages(requirement, context)
         try:
-            response = self.llm.invoke(messages)
-            content = response.content
-            
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            
-            return json.loads(content)
-        except:
+            return invoke_structured(self.llm, messages, RecommendationList, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
             return []
     
-    def analyze_completeness(self, requirements: List[Dict], project_context: Dict) -> Dict[str, Any]:
-        """Анализ полноты набора требований."""
+    @traced
+    async def agenerate_recommendations(self, requirement: Dict, context: Dict) -> List[str]:
+        """Асинхронная генерация рекомендаций по требованию."""
+        messages, prompt = self._recommendations_messages(requirement, context)
+        try:
+            return await ainvoke_structured(self.llm, messages, RecommendationList, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
+            return []
+    
+    @staticmethod
+    def _completeness_lines(requirements: List[Dict]) -> List[str]:
+        """Строки требований для анализа полноты (сначала самые приоритетные)."""
+        return [
+            f"{r.get('identifier', '')}: {r.get('name', '')} ({r.get('category', '')})"
+            for r in token_budget.rank(requirements, _requirement_text)
+        ]
+    
+    def _completeness_messages(self, lines: List[str], project_context: Dict) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для анализа полноты."""
         
         system_prompt = """Analyze the completeness of requirements set.
 Identify missing requirements, gaps, and areas that need more coverage.
@@ -262,10 +264,7 @@ Return JSON:
     "recommendations": ["rec1", "rec2"]
 }"""
 
-        reqs_text = "\n".join([
-            f"{r.get('identifier', '')}: {r.get('name', '')} ({r.get('category', '')})"
-            for r in requirements
-        ])
+        reqs_text = "\n".join(lines)
         
         human_prompt = f"""Requirements:
 {reqs_text}
@@ -279,19 +278,47 @@ Analyze completeness."""
             SystemMessage(content=system_prompt),
             HumanMessage(content=human_prompt)
         ]
-        
+        return messages, None
+    
+    def _completeness_fits(self, project_context: Dict) -> Callable[[List[str]], bool]:
+        """Проверка, помещаются ли строки требований в бюджет промпта полноты."""
+        return lambda lines: token_budget.fits(AGENT_NAME, self._completeness_messages(lines, project_context)[0])
+    
+    @traced
+    def analyze_completeness(self, requirements: List[Dict], project_context: Dict) -> Dict[str, Any]:
+        """Анализ полноты набора требований (большие наборы резюмируются иерархически)."""
         try:
-            response = self.llm.invoke(messages)
-            content = response.content
-            
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            
-            return json.loads(content)
-        except:
-            return {
-                "completeness_score": 0.5,
-                "missing_areas": [],
-                "recommendations": []
-            }
-
+            lines = token_budget.summarize(
+                self.llm, AGENT_NAME, self._completeness_lines(requirements), self._completeness_fits(project_context)
+            )
+            (messages, prompt), _ = token_budget.fit(
+                AGENT_NAME, lines, lambda items: self._completeness_messages(items, project_context)
+            )
+            return invoke_structured(self.llm, messages, CompletenessAnalysis, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
+            return self._completeness_fallback()
+    
+    @traced
+    async def aanalyze_completeness(self, requirements: List[Dict], project_context: Dict) -> Dict[str, Any]:
+        """Асинхронный анализ полноты набора требований (большие наборы резюмируются иерархически)."""
+        try:
+            lines = await token_budget.asummarize(
+                self.llm, AGENT_NAME, self._completeness_lines(requirements), self._completeness_fits(project_context)
+            )
+            (messages, prompt), _ = token_budget.fit(
+                AGENT_NAME, lines, lambda items: self._completeness_messages(items, project_context)
+            )
+            return await ainvoke_structured(self.llm, messages, CompletenessAnalysis, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
+            return self._completeness_fallback()
+    
+    @staticmethod
+    def _completeness_fallback() -> Dict[str, Any]:
+        """Результат анализа полноты по умолчанию."""
+        return {
+            "completeness_score": 0.5,
+            "missing_areas": [],
+            "recommendations": []
+        }
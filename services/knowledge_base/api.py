@@ -1,18 +1,24 @@
 """API для Базы знаний требований."""
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
-from shared.database import get_db
-from services.knowledge_base.graph_rag import KnowledgeBaseGraph
-from services.knowledge_base.vector_store import VectorStore
+from shared.database import SessionLocal, get_db
+from services.knowledge_base.graph_rag import AsyncKnowledgeBaseGraph
+from services.knowledge_base.vector_store import VectorStore, requirement_text
 from services.knowledge_base.ai_agent import KnowledgeBaseAgent
+from shared.ai_config import ai_settings
+from shared.llm_cache import llm_cache
+from shared.llm_telemetry import llm_telemetry
+from shared.orchestration import TIMEOUT, Pipeline, PipelineError
+from shared.precompute import analysis_precompute, requirement_version
+import asyncio
 import uuid
 
 router = APIRouter(prefix="/api/knowledge", tags=["Knowledge Base"])
 
 # Глобальные экземпляры
-graph_rag = KnowledgeBaseGraph()
+graph_rag = AsyncKnowledgeBaseGraph()
 vector_store = VectorStore()
 ai_agent = KnowledgeBaseAgent()
 
@@ -26,6 +32,7 @@ class ImportRequirementResponse(BaseModel):
     imported: bool
     duplicates_found: List[Dict]
     conflicts_found: List[Dict]
+    failed_steps: List[str] = []
 
 
 class DuplicateAnalysisResponse(BaseModel):
@@ -47,6 +54,21 @@ class CompletenessAnalysisResponse(BaseModel):
     recommendations: List[str]
 
 
+class SimilarRequirement(BaseModel):
+    requirement_id: str
+    text: str
+    similarity: float
+
+class SimilarRequirementsResponse(BaseModel):
+    requirement_id: str
+    similar: List[SimilarRequirement]
+
+class EmbeddingsResponse(BaseModel):
+    project_id: uuid.UUID
+    embedded: int
+    provider: str
+
+
 @router.post("/import", response_model=ImportRequirementResponse)
 async def import_requirement(
     request: ImportRequirementRequest,
@@ -54,35 +76,71 @@ async def import_requirement(
 ):
     """Импортировать требование в базу знаний."""
     req_data = request.requirement_data
-    req_id = req_data.get("id") or req_data.get("identifier", "")
     
-    # Импорт в граф
-    imported_id = graph_rag.import_requirement(req_data, str(request.project_id))
+    # Поиск дубликатов и противоречий идет после импорта в граф, обновление векторов - параллельно
+    async def import_step():
+        return await graph_rag.import_requirement(req_data, str(request.project_id))
     
-    # Поиск дубликатов
-    duplicates = graph_rag.find_duplicates(req_data)
+    async def duplicates_step(imported_id):
+        return await graph_rag.find_duplicates(req_data)
     
-    # Анализ противоречий
-    conflicts = graph_rag.find_conflicts(imported_id)
+    async def conflicts_step(imported_id):
+        return await graph_rag.find_conflicts(imported_id)
     
-    # Обновление векторного хранилища
-    vector_store.batch_update([req_data])
+    pipeline = Pipeline("knowledge_import", default_timeout=ai_settings.step_timeout)
+    pipeline.step("imported_id", import_step)
+    pipeline.step(
+        "duplicates",
+        duplicates_step,
+        depends_on=("imported_id",),
+        required=False,
+        default=[]
+    )
+    pipeline.step(
+        "conflicts",
+        conflicts_step,
+        depends_on=("imported_id",),
+        required=False,
+        default=[]
+    )
+    pipeline.step(
+        "vectors",
+        lambda: vector_store.abatch_update([{**req_data, "project_id": str(request.project_id)}]),
+        required=False
+    )
+    
+    try:
+        result = await pipeline.run()
+    except PipelineError as e:
+        raise HTTPException(status_code=504 if e.step.status == TIMEOUT else 502, detail=str(e))
     
     return ImportRequirementResponse(
-        requirement_id=imported_id,
+        requirement_id=result["imported_id"],
         imported=True,
-        duplicates_found=duplicates,
-        conflicts_found=conflicts
+        duplicates_found=result["duplicates"],
+        conflicts_found=result["conflicts"],
+        failed_steps=result.failed
     )
 
 
-@router.get("/duplicates/{requirement_id}", response_model=DuplicateAnalysisResponse)
-async def check_duplicates(
-    requirement_id: str,
-    db: Session = Depends(get_db)
-):
-    """Проверить требование на дубликаты."""
-    # Получить требование из БД
+def _requirement_row(requirement) -> Dict[str, Any]:
+    """Данные требования из БД в формате строки Supabase (вход анализов и предрасчета)."""
+    return {
+        "id": str(requirement.id),
+        "project_id": str(requirement.project_id),
+        "identifier": requirement.identifier,
+        "name": requirement.name,
+        "shall": requirement.shall,
+        "rationale": requirement.rationale,
+        "category": requirement.category,
+        "priority": requirement.priority,
+        "acceptance_criteria": requirement.acceptance_criteria,
+        "version": requirement.version
+    }
+
+
+def _load_requirement(requirement_id: str, db: Session):
+    """Найти требование по идентификатору."""
     from shared.models import Requirement
     requirement = db.query(Requirement).filter(
         Requirement.identifier == requirement_id
@@ -90,101 +148,152 @@ async def check_duplicates(
     
     if not requirement:
         raise HTTPException(status_code=404, detail="Requirement not found")
-    
-    req_data = {
-        "id": str(requirement.id),
-        "identifier": requirement.identifier,
-        "name": requirement.name,
-        "shall": requirement.shall,
-        "category": requirement.category
+    return requirement
+
+
+def _project_context(project_id: Any, db: Optional[Session] = None) -> Dict[str, Any]:
+    """Контекст проекта для рекомендаций (без сессии запроса открывается своя)."""
+    from shared.models import Project
+    session = db or (SessionLocal() if SessionLocal else None)
+    if session is None:
+        return {"project_name": "", "methodology": ""}
+    try:
+        project = session.query(Project).filter(Project.id == project_id).first()
+    finally:
+        if db is None:
+            session.close()
+    return {
+        "project_name": project.name if project else "",
+        "methodology": project.methodology if project else ""
     }
+
+
+async def _duplicates_analysis(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Анализ дубликатов требования."""
+    req_data = {key: row.get(key) for key in ("id", "identifier", "name", "shall", "category")}
     
     # Поиск через граф
-    graph_duplicates = graph_rag.find_duplicates(req_data)
+    graph_duplicates = await graph_rag.find_duplicates(req_data)
     
     # ИИ анализ
     # Получить похожие требования для анализа
     similar_reqs = [{"id": d["id"], "name": d["name"]} for d in graph_duplicates[:5]]
-    ai_analysis = ai_agent.analyze_duplicates(req_data, similar_reqs)
+    with llm_telemetry.project_scope(row.get("project_id")):
+        ai_analysis = await ai_agent.aanalyze_duplicates(req_data, similar_reqs)
     
     return DuplicateAnalysisResponse(
         is_duplicate=ai_analysis.get("is_duplicate", False),
         duplicate_of=[d["id"] for d in graph_duplicates],
         similarity_score=ai_analysis.get("similarity_score", 0.0),
         reason=ai_analysis.get("reason", "")
-    )
+    ).dict()
 
 
-@router.get("/conflicts/{requirement_id}", response_model=ConflictAnalysisResponse)
-async def check_conflicts(
-    requirement_id: str,
-    db: Session = Depends(get_db)
-):
-    """Проверить требование на противоречия."""
-    # Получить требование
-    from shared.models import Requirement
-    requirement = db.query(Requirement).filter(
-        Requirement.identifier == requirement_id
-    ).first()
-    
-    if not requirement:
-        raise HTTPException(status_code=404, detail="Requirement not found")
-    
-    req_data = {
-        "id": str(requirement.id),
-        "identifier": requirement.identifier,
-        "name": requirement.name,
-        "shall": requirement.shall,
-        "category": requirement.category,
-        "priority": requirement.priority
-    }
+async def _conflicts_analysis(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Анализ противоречий требования."""
+    req_data = {key: row.get(key) for key in ("id", "identifier", "name", "shall", "category", "priority")}
     
     # Поиск через граф
-    graph_conflicts = graph_rag.find_conflicts(requirement_id)
+    graph_conflicts = await graph_rag.find_conflicts(row["identifier"])
     
     # ИИ анализ
     other_reqs = [{"id": c["id"], "shall": c["shall"]} for c in graph_conflicts[:10]]
-    ai_analysis = ai_agent.analyze_conflicts(req_data, other_reqs)
+    with llm_telemetry.project_scope(row.get("project_id")):
+        ai_analysis = await ai_agent.aanalyze_conflicts(req_data, other_reqs)
     
     return ConflictAnalysisResponse(
         has_conflicts=ai_analysis.get("has_conflicts", False),
         conflicts=ai_analysis.get("conflicts", [])
-    )
+    ).dict()
 
 
-@router.get("/recommendations/{requirement_id}", response_model=RecommendationsResponse)
-async def get_recommendations(
+async def _recommendations_analysis(row: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Рекомендации по требованию."""
+    req_data = {key: row.get(key) for key in ("identifier", "name", "shall", "rationale", "category")}
+    if context is None:
+        context = await asyncio.to_thread(_project_context, row.get("project_id"))
+    
+    # Получить связанные требования
+    related = await graph_rag.get_related_requirements(row["identifier"])
+    
+    with llm_telemetry.project_scope(row.get("project_id")):
+        return await ai_agent.agenerate_recommendations(req_data, context)
+
+
+def _load_rows(requirement_ids: List[str]) -> List[Dict[str, Any]]:
+    """Строки требований для предрасчета (из той же БД, что читают эндпоинты анализов)."""
+    from shared.models import Requirement
+    if SessionLocal is None:
+        return []
+    db = SessionLocal()
+    try:
+        requirements = db.query(Requirement).filter(Requirement.id.in_(requirement_ids)).all()
+        return [_requirement_row(requirement) for requirement in requirements]
+    finally:
+        db.close()
+
+
+# Анализы, которые считаются заранее при создании и изменении требования и после синхронизации с графом
+analysis_precompute.register_loader(_load_rows)
+analysis_precompute.register("duplicates", _duplicates_analysis, graph=True)
+analysis_precompute.register("conflicts", _conflicts_analysis, graph=True)
+analysis_precompute.register("recommendations", _recommendations_analysis)
+
+
+@router.get("/duplicates/{requirement_id}", response_model=DuplicateAnalysisResponse)
+async def check_duplicates(
     requirement_id: str,
+    refresh: bool = Query(False, description="Игнорировать кэш ответов ИИ"),
     db: Session = Depends(get_db)
 ):
-    """Получить рекомендации по требованию."""
-    from shared.models import Requirement, Project
-    requirement = db.query(Requirement).filter(
-        Requirement.identifier == requirement_id
-    ).first()
-    
-    if not requirement:
-        raise HTTPException(status_code=404, detail="Requirement not found")
+    """Проверить требование на дубликаты."""
+    row = _requirement_row(_load_requirement(requirement_id, db))
     
-    project = db.query(Project).filter(Project.id == requirement.project_id).first()
+    with llm_cache.bypass(refresh):
+        analysis = await analysis_precompute.get_or_compute(
+            row["id"], "duplicates", requirement_version(row),
+            lambda: _duplicates_analysis(row), refresh=refresh,
+            project_id=row["project_id"]
+        )
     
-    req_data = {
-        "identifier": requirement.identifier,
-        "name": requirement.name,
-        "shall": requirement.shall,
-        "rationale": requirement.rationale,
-        "category": requirement.category
-    }
+    return DuplicateAnalysisResponse(**analysis)
+
+
+@router.get("/conflicts/{requirement_id}", response_model=ConflictAnalysisResponse)
+async def check_conflicts(
+    requirement_id: str,
+    refresh: bool = Query(False, description="Игнорировать кэш ответов ИИ"),
+    db: Session = Depends(get_db)
+):
+    """Проверить требование на противоречия."""
+    row = _requirement_row(_load_requirement(requirement_id, db))
     
-    context = {
-        "project_name": project.name if project else "",
-        "methodology": project.methodology if project else ""
-    }
+    with llm_cache.bypass(refresh):
+        analysis = await analysis_precompute.get_or_compute(
+            row["id"], "conflicts", requirement_version(row),
+            lambda: _conflicts_analysis(row), refresh=refresh,
+            project_id=row["project_id"]
+        )
     
-    # Получить связанные требования
-    related = graph_rag.get_related_requirements(requirement_id)
+    return ConflictAnalysisResponse(**analysis)
+
+
+@router.get("/recommendations/{requirement_id}", response_model=RecommendationsResponse)
+async def get_recommendations(
+    requirement_id: str,
+    refresh: bool = Query(False, description="Игнорировать кэш ответов ИИ"),
+    db: Session = Depends(get_db)
+):
+    """Получить рекомендации по требованию."""
+    row = _requirement_row(_load_requirement(requirement_id, db))
+    context = _project_context(row["project_id"], db)
     
-    recommendations = ai_agent.generate_recommendations(req_data, context)
+    with llm_cache.bypass(refresh):
+        recommendations = await analysis_precompute.get_or_compute(
+            row["id"], "recommendations", requirement_version(row),
+            lambda: _recommendations_analysis(row, context), refresh=refresh,
+            project_id=row["project_id"]
+        )
     
     return RecommendationsResponse(recommendations=recommendations)
 
@@ -192,6 +301,7 @@ async def get_recommendations(
 @router.get("/completeness/{project_id}", response_model=CompletenessAnalysisResponse)
 async def analyze_completeness(
     project_id: uuid.UUID,
+    refresh: bool = Query(False, description="Игнорировать кэш ответов ИИ"),
     db: Session = Depends(get_db)
 ):
     """Анализ полноты требований проекта."""
@@ -217,7 +327,8 @@ async def analyze_completeness(
         "description": project.description
     }
     
-    analysis = ai_agent.analyze_completeness(reqs_data, context)
+    with llm_cache.bypass(refresh), llm_telemetry.project_scope(project_id):
+        analysis = await ai_agent.aanalyze_completeness(reqs_data, context)
     
     return CompletenessAnalysisResponse(
         completeness_score=analysis.get("completeness_score", 0.0),
@@ -226,6 +337,49 @@ async def analyze_completeness(
     )
 
 
+@router.post("/embeddings/{project_id}", response_model=EmbeddingsResponse)
+async def embed_project(
+    project_id: uuid.UUID,
+    db: Session = Depends(get_db)
+):
+    """Построить векторные представления всех требований проекта."""
+    from shared.models import Requirement
+    requirements = db.query(Requirement).filter(
+        Requirement.project_id == project_id
+    ).all()
+    
+    rows = [{
+        "id": str(r.id),
+        "project_id": str(project_id),
+        "name": r.name,
+        "shall": r.shall
+    } for r in requirements]
+    await vector_store.abatch_update(rows)
+    
+    return EmbeddingsResponse(project_id=project_id, embedded=len(rows), provider=vector_store.provider.name)
+
+
+@router.get("/similar/{requirement_id}", response_model=SimilarRequirementsResponse)
+async def find_similar_requirements(
+    requirement_id: str,
+    threshold: float = Query(0.3, ge=-1.0, le=1.0),
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """Найти семантически похожие требования проекта."""
+    row = _requirement_row(_load_requirement(requirement_id, db))
+    
+    embedding = (await vector_store.provider.aembed([requirement_text(row)]))[0]
+    similar = vector_store.find_similar(
+        embedding, threshold=threshold, limit=limit, project_id=row["project_id"], exclude=row["id"]
+    )
+    
+    return SimilarRequirementsResponse(
+        requirement_id=requirement_id,
+        similar=[SimilarRequirement(**item) for item in similar]
+    )
+
+
 @router.get("/graph/{project_id}")
 async def get_knowledge_graph(project_id: uuid.UUID):
     """Получить граф знаний проекта для визуализации."""
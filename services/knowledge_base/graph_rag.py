@@ -1,12 +1,15 @@
 """Graph RAG для хранения требований в виде графа."""
-from neo4j import GraphDatabase
-from neo4j.exceptions import ServiceUnavailable, TransientError
-from typing import List, Dict, Optional, Any
+from neo4j import AsyncGraphDatabase, GraphDatabase
+from neo4j.exceptions import ClientError, ServiceUnavailable, TransientError
+from typing import AsyncIterator, List, Dict, Optional, Any
+from contextlib import asynccontextmanager
 from pydantic_settings import BaseSettings
+import asyncio
 import json
+import time
 from shared.logging_config import get_logger
 from shared.exceptions import ExternalServiceError, DatabaseError
-from shared.retry import retry
+from shared.retry import RetryError, async_retry, retry
 
 logger = get_logger(__name__)
 
@@ -16,6 +19,24 @@ class Neo4jSettings(BaseSettings):
     neo4j_uri: str = "bolt://localhost:7687"
     neo4j_user: str = "neo4j"
     neo4j_password: str = ""
+    # Пул соединений драйвера: размер и ожидание свободного соединения, секунды
+    neo4j_max_pool_size: int = 100
+    neo4j_acquisition_timeout: float = 60.0
+    # Требований в одной транзакции при пакетном импорте
+    neo4j_import_batch_size: int = 1000
+    # Массовая синхронизация проекта: требований на страницу Supabase (одна транзакция Neo4j) и параллельных записей
+    graph_sync_page_size: int = 1000
+    graph_sync_workers: int = 4
+    # Инкрементальная синхронизация: период запуска по расписанию (0 - только по запросу)
+    # и перекрытие окна изменений для транзакций, зафиксированных позже своего updated_at
+    graph_sync_interval: float = 0.0
+    graph_sync_overlap_seconds: float = 5.0
+    # Обработчик очереди graph_sync_outbox: записей за проход, пауза при пустой очереди, попыток до разбора вручную
+    # (выключен - требования пишутся в граф сразу при создании и изменении; включать после миграции очереди)
+    graph_outbox_enabled: bool = False
+    graph_outbox_batch_size: int = 500
+    graph_outbox_poll_interval: float = 1.0
+    graph_outbox_max_attempts: int = 10
     
     class Config:
         env_file = ".env"
@@ -24,6 +45,124 @@ class Neo4jSettings(BaseSettings):
 
 neo4j_settings = Neo4jSettings()
 
+# Требования вместе с сущностями и связями INVOLVES одним запросом (FOREACH сохраняет строки без сущностей)
+IMPORT_REQUIREMENTS_QUERY = """
+    UNWIND $rows AS row
+    MERGE (r:Requirement {id: row.id})
+    SET r.project_id = row.project_id,
+        r.identifier = row.identifier,
+        r.name = row.name,
+        r.shall = row.shall,
+        r.category = row.category,
+        r.priority = row.priority,
+        r.status = row.status,
+        r.description = row.description,
+        r.created_at = datetime()
+    FOREACH (entity IN row.entities |
+        MERGE (e:Entity {id: entity.id})
+        SET e.name = entity.name,
+            e.type = entity.type,
+            e.created_at = datetime()
+        MERGE (r)-[:INVOLVES]->(e)
+    )
+    RETURN count(r) AS imported
+"""
+
+# Удаление требований вместе с их сущностями (id сущности содержит id требования)
+DELETE_REQUIREMENTS_QUERY = """
+    UNWIND $ids AS id
+    MATCH (r:Requirement {id: id})
+    OPTIONAL MATCH (r)-[:INVOLVES]->(e:Entity)
+    WHERE e.id STARTS WITH 'entity_' + id + '_'
+    DETACH DELETE e, r
+    RETURN count(DISTINCT id) AS deleted
+"""
+
+
+# Создание ограничений и индексов
+SCHEMA_QUERIES = (
+    """
+    CREATE CONSTRAINT IF NOT EXISTS FOR (r:Requirement) 
+    REQUIRE r.id IS UNIQUE
+    """,
+    """
+    CREATE CONSTRAINT IF NOT EXISTS FOR (e:Entity) 
+    REQUIRE e.id IS UNIQUE
+    """,
+    """
+    CREATE FULLTEXT INDEX requirementIndex IF NOT EXISTS
+    FOR (r:Requirement) ON EACH [r.name, r.shall, r.description]
+    """,
+)
+
+# Полнотекстовый поиск дубликатов
+FIND_DUPLICATES_QUERY = """
+    CALL db.index.fulltext.queryNodes('requirementIndex', $query)
+    YIELD node, score
+    WHERE score > $threshold
+    RETURN node.id as id,
+           node.identifier as identifier,
+           node.name as name,
+           score
+    ORDER BY score DESC
+    LIMIT 10
+"""
+
+# Поиск требований с противоположными формулировками
+FIND_CONFLICTS_QUERY = """
+    MATCH (r:Requirement {id: $id})
+    MATCH (other:Requirement)
+    WHERE other.id <> $id
+    AND other.project_id = r.project_id
+    AND (
+        (r.category = 'functional' AND other.category = 'non_functional' AND 
+         r.shall CONTAINS 'must' AND other.shall CONTAINS 'must not') OR
+        (r.priority = 1 AND other.priority = 1 AND 
+         r.shall <> other.shall)
+    )
+    RETURN other.id as id,
+           other.identifier as identifier,
+           other.name as name,
+           other.shall as shall,
+           'potential_conflict' as conflict_type
+    LIMIT 20
+"""
+
+# Связанные требования (глубина подставляется через %d)
+RELATED_REQUIREMENTS_QUERY = """
+    MATCH path = (r:Requirement {id: $id})-[*1..%d]-(related:Requirement)
+    RETURN DISTINCT related.id as id,
+                    related.identifier as identifier,
+                    related.name as name,
+                    length(path) as distance
+    ORDER BY distance
+    LIMIT 20
+"""
+
+
+def requirement_row(requirement_data: Dict[str, Any], project_id: Optional[str] = None) -> Dict[str, Any]:
+    """Параметры требования и его сущностей для IMPORT_REQUIREMENTS_QUERY."""
+    req_id = requirement_data.get("id") or requirement_data.get("identifier", "")
+    return {
+        "id": req_id,
+        "project_id": project_id if project_id is not None else requirement_data.get("project_id"),
+        "identifier": requirement_data.get("identifier", ""),
+        "name": requirement_data.get("name", ""),
+        "shall": requirement_data.get("shall", ""),
+        "category": requirement_data.get("category"),
+        "priority": requirement_data.get("priority"),
+        "status": requirement_data.get("status", "draft"),
+        "description": requirement_data.get("description", ""),
+        "entities": [
+            {
+                "id": f"entity_{req_id}_{entity.get('name', '').replace(' ', '_')}",
+                "name": entity.get("name", ""),
+                "type": entity.get("type", "unknown")
+            }
+            for entity in requirement_data.get("entities") or []
+        ]
+    }
+
 
 class KnowledgeBaseGraph:
     """Графовая база знаний требований."""
@@ -33,12 +172,14 @@ class KnowledgeBaseGraph:
         try:
             self.driver = GraphDatabase.driver(
                 neo4j_settings.neo4j_uri,
-                auth=(neo4j_settings.neo4j_user, neo4j_settings.neo4j_password)
+                auth=(neo4j_settings.neo4j_user, neo4j_settings.neo4j_password),
+                max_connection_pool_size=neo4j_settings.neo4j_max_pool_size,
+                connection_acquisition_timeout=neo4j_settings.neo4j_acquisition_timeout
             )
             # Проверить подключение
             self.driver.verify_connectivity()
-            self._create_constraints()
             self.available = True
+            self._create_constraints()
             logger.info("Neo4j connection established")
         except Exception as e:
             logger.warning(f"Could not connect to Neo4j: {e}", exc_info=True)
@@ -52,88 +193,110 @@ class KnowledgeBaseGraph:
         
         try:
             with self.driver.session() as session:
-                # Ограничения уникальности
-                session.run("""
-                    CREATE CONSTRAINT IF NOT EXISTS FOR (r:Requirement) 
-                    REQUIRE r.id IS UNIQUE
-                """)
-                session.run("""
-                    CREATE CONSTRAINT IF NOT EXISTS FOR (e:Entity) 
-                    REQUIRE e.id IS UNIQUE
-                """)
-                
-                # Индексы для полнотекстового поиска
-                session.run("""
-                    CREATE FULLTEXT INDEX requirementIndex IF NOT EXISTS
-                    FOR (r:Requirement) ON EACH [r.name, r.shall, r.description]
-                """)
+                for query in SCHEMA_QUERIES:
+                    session.run(query)
                 logger.info("Neo4j constraints and indexes created")
         except Exception as e:
             logger.error(f"Error creating Neo4j constraints: {e}", exc_info=True)
             raise DatabaseError(f"Failed to create Neo4j constraints: {str(e)}")
     
     @retry(max_attempts=3, delay=1.0, backoff=2.0, exceptions=(ServiceUnavailable, TransientError))
+    def _write_requirements(self, rows: List[Dict[str, Any]]) -> int:
+        """Записать требования с сущностями одним запросом в одной явной транзакции (временные ошибки Neo4j повторяются)."""
+        with self.driver.session() as session:
+            with session.begin_transaction() as tx:
+                record = tx.run(IMPORT_REQUIREMENTS_QUERY, rows=rows).single()
+                tx.commit()
+        return record["imported"] if record else 0
+    
     def import_requirement(self, requirement_data: Dict[str, Any], project_id: str) -> str:
         """Импортировать требование в граф."""
         if not self.available or not self.driver:
             logger.warning("Neo4j not available, skipping requirement import")
             return requirement_data.get("id", "")
         
-        req_id = requirement_data.get("id") or requirement_data.get("identifier", "")
+        row = requirement_row(requirement_data, project_id)
+        req_id = row["id"]
         
         try:
-            with self.driver.session() as session:
-            session.run("""
-                MERGE (r:Requirement {id: $id})
-                SET r.project_id = $project_id,
-                    r.identifier = $identifier,
-                    r.name = $name,
-                    r.shall = $shall,
-                    r.category = $category,
-                    r.priority = $priority,
-                    r.status = $status,
-                    r.description = $description,
-                    r.created_at = datetime()
-            """, 
-                id=req_id,
-                project_id=project_id,
-                identifier=requirement_data.get("identifier", ""),
-                name=requirement_data.get("name", ""),
-                shall=requirement_data.get("shall", ""),
-                category=requirement_data.get("category"),
-                priority=requirement_data.get("priority"),
-                status=requirement_data.get("status", "draft"),
-                description=requirement_data.get("description", "")
-            )
-            
-            # Создать узлы для сущностей
-            entities = requirement_data.get("entities", [])
-            for entity in entities:
-                entity_id = f"entity_{req_id}_{entity.get('name', '').replace(' ', '_')}"
-                session.run("""
-                    MERGE (e:Entity {id: $entity_id})
-                    SET e.name = $name,
-                        e.type = $type,
-                        e.created_at = datetime()
-                    WITH e
-                    MATCH (r:Requirement {id: $req_id})
-                    MERGE (r)-[:INVOLVES]->(e)
-                """,
-                    entity_id=entity_id,
-                    name=entity.get("name", ""),
-                    type=entity.get("type", "unknown"),
-                    req_id=req_id
-                )
-            
+            self._write_requirements([row])
             logger.info(f"Requirement {req_id} imported to Neo4j")
             return req_id
-        except (ServiceUnavailable, TransientError) as e:
+        except RetryError as e:
             logger.error(f"Neo4j transient error importing requirement {req_id}: {e}")
             raise ExternalServiceError("Neo4j", f"Failed to import requirement: {str(e)}")
         except Exception as e:
             logger.error(f"Error importing requirement {req_id} to Neo4j: {e}", exc_info=True)
             raise DatabaseError(f"Failed to import requirement: {str(e)}")
     
+    def _import_chunk(self, rows: List[Dict[str, Any]]) -> int:
+        """Импортировать пачку требований (повтор пачки при временной ошибке)."""
+        try:
+            return self._write_requirements(rows)
+        except RetryError as e:
+            logger.error(f"Neo4j transient error importing {len(rows)} requirements: {e}")
+            raise ExternalServiceError("Neo4j", f"Failed to import requirements: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error importing {len(rows)} requirements to Neo4j: {e}", exc_info=True)
+            raise DatabaseError(f"Failed to import requirements: {str(e)}")
+    
+    def import_requirements(
+        self,
+        requirements: List[Dict[str, Any]],
+        project_id: Optional[str] = None,
+        batch_size: Optional[int] = None
+    ) -> int:
+        """
+        Пакетный импорт требований: одна транзакция на пачку из batch_size требований.
+        
+        Args:
+            requirements: Требования (с сущностями в поле entities)
+            project_id: Проект (None - из поля project_id каждого требования)
+            batch_size: Размер пачки (None - NEO4J_IMPORT_BATCH_SIZE)
+        
+        Returns:
+            Число импортированных требований
+        """
+        if not self.available or not self.driver:
+            logger.warning("Neo4j not available, skipping requirements import")
+            return 0
+        
+        batch_size = batch_size or neo4j_settings.neo4j_import_batch_size
+        rows = [requirement_row(req, project_id) for req in requirements]
+        imported = 0
+        for start in range(0, len(rows), batch_size):
+            imported += self._import_chunk(rows[start:start + batch_size])
+        logger.info(f"Imported {imported} requirements to Neo4j")
+        return imported
+    
+    @retry(max_attempts=3, delay=1.0, backoff=2.0, exceptions=(ServiceUnavailable, TransientError))
+    def _delete_requirements(self, requirement_ids: List[str]) -> int:
+        """Удалить требования одной явной транзакцией (временные ошибки Neo4j повторяются)."""
+        with self.driver.session() as session:
+            with session.begin_transaction() as tx:
+                record = tx.run(DELETE_REQUIREMENTS_QUERY, ids=requirement_ids).single()
+                tx.commit()
+        return record["deleted"] if record else 0
+    
+    def delete_requirements(self, requirement_ids: List[str]) -> int:
+        """Удалить требования и их сущности из графа одной транзакцией."""
+        if not self.available or not self.driver:
+            logger.warning("Neo4j not available, skipping requirements delete")
+            return 0
+        if not requirement_ids:
+            return 0
+        
+        try:
+            deleted = self._delete_requirements(list(requirement_ids))
+            logger.info(f"Deleted {deleted} requirements from Neo4j")
+            return deleted
+        except RetryError as e:
+            logger.error(f"Neo4j transient error deleting requirements: {e}")
+            raise ExternalServiceError("Neo4j", f"Failed to delete requirements: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error deleting requirements from Neo4j: {e}", exc_info=True)
+            raise DatabaseError(f"Failed to delete requirements: {str(e)}")
+    
     @retry(max_attempts=3, delay=1.0, backoff=2.0, exceptions=(ServiceUnavailable, TransientError))
     def find_duplicates(self, requirement_data: Dict[str, Any], threshold: float = 0.8) -> List[Dict]:
         """Найти дубликаты требования."""
@@ -146,17 +309,8 @@ class KnowledgeBaseGraph:
             search_text = f"{requirement_data.get('name', '')} {requirement_data.get('shall', '')}"
             
             with self.driver.session() as session:
-                result = session.run("""
-                    CALL db.index.fulltext.queryNodes('requirementIndex', $query)
-                    YIELD node, score
-                    WHERE score > $threshold
-                    RETURN node.id as id,
-                           node.identifier as identifier,
-                           node.name as name,
-                           score
-                    ORDER BY score DESC
-                    LIMIT 10
-                """, query=search_text, threshold=threshold)
+                # Параметр $query передается словарем: имя совпадает с первым аргументом run()
+                result = session.run(FIND_DUPLICATES_QUERY, {"query": search_text, "threshold": threshold})
                 
                 duplicates = [dict(record) for record in result]
                 logger.debug(f"Found {len(duplicates)} potential duplicates")
@@ -177,25 +331,7 @@ class KnowledgeBaseGraph:
         
         try:
             with self.driver.session() as session:
-                # Поиск требований с противоположными формулировками
-                result = session.run("""
-                    MATCH (r:Requirement {id: $id})
-                    MATCH (other:Requirement)
-                    WHERE other.id <> $id
-                    AND other.project_id = r.project_id
-                    AND (
-                        (r.category = 'functional' AND other.category = 'non_functional' AND 
-                         r.shall CONTAINS 'must' AND other.shall CONTAINS 'must not') OR
-                        (r.priority = 1 AND other.priority = 1 AND 
-                         r.shall <> other.shall)
-                    )
-                    RETURN other.id as id,
-                           other.identifier as identifier,
-                           other.name as name,
-                           other.shall as shall,
-                           'potential_conflict' as conflict_type
-                    LIMIT 20
-                """, id=requirement_id)
+                result = session.run(FIND_CONFLICTS_QUERY, id=requirement_id)
                 
                 conflicts = [dict(record) for record in result]
                 logger.debug(f"Found {len(conflicts)} potential conflicts for requirement {requirement_id}")
@@ -216,15 +352,7 @@ class KnowledgeBaseGraph:
         
         try:
             with self.driver.session() as session:
-                result = session.run("""
-                    MATCH path = (r:Requirement {id: $id})-[*1..%d]-(related:Requirement)
-                    RETURN DISTINCT related.id as id,
-                           related.identifier as identifier,
-                           related.name as name,
-                           length(path) as distance
-                    ORDER BY distance
-                    LIMIT 20
-                """ % max_depth, id=requirement_id)
+                result = session.run(RELATED_REQUIREMENTS_QUERY % max_depth, id=requirement_id)
                 
                 related = [dict(record) for record in result]
                 logger.debug(f"Found {len(related)} related requirements for {requirement_id}")
@@ -245,3 +373,261 @@ class KnowledgeBaseGraph:
             except Exception as e:
                 logger.error(f"Error closing Neo4j connection: {e}", exc_info=True)
 
+
+
+class PoolMetrics:
+    """Загрузка пула соединений асинхронного драйвера: занятые сессии, ожидание соединения, таймауты."""
+    
+    def __init__(self, max_pool_size: int):
+        """Инициализация метрик."""
+        self.max_pool_size = max_pool_size
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.sessions = 0
+        self.acquisition_timeouts = 0
+        self.errors = 0
+        self.acquisition_seconds = 0.0
+        self.queries = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """Сводка загрузки пула."""
+        return {
+            "max_pool_size": self.max_pool_size,
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+            "utilization": round(self.in_use / self.max_pool_size, 4) if self.max_pool_size else None,
+            "sessions": self.sessions,
+            "queries": self.queries,
+            "avg_acquisition_seconds": round(self.acquisition_seconds / self.queries, 6) if self.queries else None,
+            "acquisition_timeouts": self.acquisition_timeouts,
+            "errors": self.errors,
+        }
+    
+    def prometheus(self) -> str:
+        """Метрики пула в текстовом формате Prometheus."""
+        lines = []
+        for name, kind, value, help_text in (
+            ("neo4j_pool_max_size", "gauge", self.max_pool_size, "Neo4j async driver connection pool size"),
+            ("neo4j_pool_in_use", "gauge", self.in_use, "Neo4j sessions currently holding a connection"),
+            ("neo4j_pool_peak_in_use", "gauge", self.peak_in_use, "Peak concurrent Neo4j sessions"),
+            ("neo4j_sessions_total", "counter", self.sessions, "Neo4j sessions opened"),
+            ("neo4j_queries_total", "counter", self.queries, "Neo4j queries and transactions started"),
+            ("neo4j_pool_acquisition_seconds_total", "counter", round(self.acquisition_seconds, 6), "Time spent waiting for a pooled connection"),
+            ("neo4j_pool_acquisition_timeouts_total", "counter", self.acquisition_timeouts, "Connection acquisitions that hit NEO4J_ACQUISITION_TIMEOUT"),
+            ("neo4j_errors_total", "counter", self.errors, "Failed Neo4j sessions"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class AsyncKnowledgeBaseGraph:
+    """Графовая база знаний требований на асинхронном драйвере Neo4j (запросы не блокируют цикл событий)."""
+    
+    # Пауза перед повторной попыткой подключения после ошибки, секунды
+    RECONNECT_INTERVAL = 30.0
+    
+    def __init__(self, settings: Neo4jSettings = neo4j_settings):
+        """Инициализация; подключение выполняется при первом запросе или в connect()."""
+        self.settings = settings
+        self.driver = None
+        self.available = False
+        self.metrics = PoolMetrics(settings.neo4j_max_pool_size)
+        self._connect_lock = asyncio.Lock()
+        self._retry_at = 0.0
+    
+    async def connect(self) -> bool:
+        """Подключиться к Neo4j и создать ограничения и индексы."""
+        async with self._connect_lock:
+            if self.available:
+                return True
+            if time.monotonic() < self._retry_at:
+                return False
+            try:
+                self.driver = AsyncGraphDatabase.driver(
+                    self.settings.neo4j_uri,
+                    auth=(self.settings.neo4j_user, self.settings.neo4j_password),
+                    max_connection_pool_size=self.settings.neo4j_max_pool_size,
+                    connection_acquisition_timeout=self.settings.neo4j_acquisition_timeout
+                )
+                await self.driver.verify_connectivity()
+                async with self.driver.session() as session:
+                    for query in SCHEMA_QUERIES:
+                        await session.run(query)
+                self.available = True
+                logger.info("Neo4j async connection established")
+            except Exception as e:
+                logger.warning(f"Could not connect to Neo4j: {e}", exc_info=True)
+                if self.driver is not None:
+                    await self.driver.close()
+                self.driver = None
+                self._retry_at = time.monotonic() + self.RECONNECT_INTERVAL
+            return self.available
+    
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator[Any]:
+        """Сессия драйвера с учетом загрузки пула."""
+        metrics = self.metrics
+        metrics.sessions += 1
+        metrics.in_use += 1
+        metrics.peak_in_use = max(metrics.peak_in_use, metrics.in_use)
+        try:
+            async with self.driver.session() as session:
+                yield session
+        except ClientError as e:
+            if "failed to obtain a connection from the pool" in str(e):
+                metrics.acquisition_timeouts += 1
+            metrics.errors += 1
+            raise
+        except Exception:
+            metrics.errors += 1
+            raise
+        finally:
+            metrics.in_use -= 1
+    
+    async def _begin(self, session: Any) -> Any:
+        """Начать транзакцию (время до получения соединения из пула учитывается в метриках)."""
+        started = time.monotonic()
+        tx = await session.begin_transaction()
+        self.metrics.acquisition_seconds += time.monotonic() - started
+        self.metrics.queries += 1
+        return tx
+    
+    @async_retry(max_attempts=3, delay=1.0, backoff=2.0, exceptions=(ServiceUnavailable, TransientError))
+    async def _read(self, cypher: str, **params: Any) -> List[Dict[str, Any]]:
+        """Выполнить запрос чтения и вернуть записи (временные ошибки Neo4j повторяются)."""
+        async with self._session() as session:
+            tx = await self._begin(session)
+            async with tx:
+                result = await tx.run(cypher, params)
+                return [dict(record) for record in await result.data()]
+    
+    @async_retry(max_attempts=3, delay=1.0, backoff=2.0, exceptions=(ServiceUnavailable, TransientError))
+    async def _write(self, cypher: str, **params: Any) -> Optional[Dict[str, Any]]:
+        """Выполнить запрос записи в явной транзакции и вернуть первую запись (временные ошибки Neo4j повторяются)."""
+        async with self._session() as session:
+            tx = await self._begin(session)
+            async with tx:
+                result = await tx.run(cypher, params)
+                record = await result.single()
+                await tx.commit()
+        return dict(record) if record else None
+    
+    async def _ready(self) -> bool:
+        """Подключение доступно (при необходимости - переподключиться)."""
+        return self.available or await self.connect()
+    
+    async def import_requirement(self, requirement_data: Dict[str, Any], project_id: str) -> str:
+        """Импортировать требование в граф."""
+        if not await self._ready():
+            logger.warning("Neo4j not available, skipping requirement import")
+            return requirement_data.get("id", "")
+        
+        row = requirement_row(requirement_data, project_id)
+        req_id = row["id"]
+        
+        try:
+            await self._write(IMPORT_REQUIREMENTS_QUERY, rows=[row])
+            logger.info(f"Requirement {req_id} imported to Neo4j")
+            return req_id
+        except RetryError as e:
+            logger.error(f"Neo4j transient error importing requirement {req_id}: {e}")
+            raise ExternalServiceError("Neo4j", f"Failed to import requirement: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error importing requirement {req_id} to Neo4j: {e}", exc_info=True)
+            raise DatabaseError(f"Failed to import requirement: {str(e)}")
+    
+    async def import_requirements(
+        self,
+        requirements: List[Dict[str, Any]],
+        project_id: Optional[str] = None,
+        batch_size: Optional[int] = None
+    ) -> int:
+        """Пакетный импорт требований: одна транзакция на пачку из batch_size требований."""
+        if not await self._ready():
+            logger.warning("Neo4j not available, skipping requirements import")
+            return 0
+        
+        batch_size = batch_size or self.settings.neo4j_import_batch_size
+        rows = [requirement_row(req, project_id) for req in requirements]
+        imported = 0
+        try:
+            for start in range(0, len(rows), batch_size):
+                record = await self._write(IMPORT_REQUIREMENTS_QUERY, rows=rows[start:start + batch_size])
+                imported += record["imported"] if record else 0
+        except RetryError as e:
+            logger.error(f"Neo4j transient error importing requirements: {e}")
+            raise ExternalServiceError("Neo4j", f"Failed to import requirements: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error importing requirements to Neo4j: {e}", exc_info=True)
+            raise DatabaseError(f"Failed to import requirements: {str(e)}")
+        logger.info(f"Imported {imported} requirements to Neo4j")
+        return imported
+    
+    async def find_duplicates(self, requirement_data: Dict[str, Any], threshold: float = 0.8) -> List[Dict]:
+        """Найти дубликаты требования."""
+        if not await self._ready():
+            logger.warning("Neo4j not available, returning empty duplicates list")
+            return []
+        
+        search_text = f"{requirement_data.get('name', '')} {requirement_data.get('shall', '')}"
+        try:
+            duplicates = await self._read(FIND_DUPLICATES_QUERY, query=search_text, threshold=threshold)
+            logger.debug(f"Found {len(duplicates)} potential duplicates")
+            return duplicates
+        except RetryError as e:
+            logger.error(f"Neo4j transient error finding duplicates: {e}")
+            raise ExternalServiceError("Neo4j", f"Failed to find duplicates: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error finding duplicates: {e}", exc_info=True)
+            raise DatabaseError(f"Failed to find duplicates: {str(e)}")
+    
+    async def find_conflicts(self, requirement_id: str) -> List[Dict]:
+        """Найти противоречия требования."""
+        if not await self._ready():
+            logger.warning("Neo4j not available, returning empty conflicts list")
+            return []
+        
+        try:
+            conflicts = await self._read(FIND_CONFLICTS_QUERY, id=requirement_id)
+            logger.debug(f"Found {len(conflicts)} potential conflicts for requirement {requirement_id}")
+            return conflicts
+        except RetryError as e:
+            logger.error(f"Neo4j transient error finding conflicts: {e}")
+            raise ExternalServiceError("Neo4j", f"Failed to find conflicts: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error finding conflicts: {e}", exc_info=True)
+            raise DatabaseError(f"Failed to find conflicts: {str(e)}")
+    
+    async def get_related_requirements(self, requirement_id: str, max_depth: int = 2) -> List[Dict]:
+        """Получить связанные требования."""
+        if not await self._ready():
+            logger.warning("Neo4j not available, returning empty related requirements list")
+            return []
+        
+        try:
+            related = await self._read(RELATED_REQUIREMENTS_QUERY % int(max_depth), id=requirement_id)
+            logger.debug(f"Found {len(related)} related requirements for {requirement_id}")
+            return related
+        except RetryError as e:
+            logger.error(f"Neo4j transient error getting related requirements: {e}")
+            raise ExternalServiceError("Neo4j", f"Failed to get related requirements: {str(e)}")
+        except Exception as e:
+            logger.error(f"Error getting related requirements: {e}", exc_info=True)
+            raise DatabaseError(f"Failed to get related requirements: {str(e)}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Состояние подключения и загрузка пула."""
+        return {"available": self.available, **self.metrics.stats()}
+    
+    async def close(self):
+        """Закрыть подключение."""
+        if self.driver:
+            try:
+                await self.driver.close()
+                logger.info("Neo4j async connection closed")
+            except Exception as e:
+                logger.error(f"Error closing Neo4j connection: {e}", exc_info=True)
+            self.driver = None
+            self.available = False
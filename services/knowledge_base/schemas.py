@@ -0,0 +1,31 @@
+"""Схемы ответов ИИ агента базы знаний."""
+from pydantic import BaseModel, Field
+from typing import List
+
+
+class DuplicateAnalysis(BaseModel):
+    is_duplicate: bool
+    duplicate_of: List[str] = []
+    similarity_score: float = Field(default=0.0, ge=0.0, le=1.0)
+    reason: str = ""
+
+class Conflict(BaseModel):
+    requirement_id: str = ""
+    conflict_type: str = "contradiction"
+    description: str = ""
+    severity: str = "medium"
+    
+    class Config:
+        extra = "allow"
+
+class ConflictAnalysis(BaseModel):
+    has_conflicts: bool
+    conflicts: List[Conflict] = []
+
+class CompletenessAnalysis(BaseModel):
+    completeness_score: float = Field(ge=0.0, le=1.0)
+    missing_areas: List[str] = []
+    recommendations: List[str] = []
+
+
+RecommendationList = List[str]
@@ -1,43 +1,179 @@
 """Векторное хранилище для семантического поиска требований."""
-from typing import List, Dict, Any, Optional
-import json
+from typing import List, Dict, Any, Optional, Sequence
+import threading
+import numpy as np
+from shared.embeddings import EmbeddingProvider, create_embedding_provider
+
+
+def requirement_text(requirement: Dict[str, Any]) -> str:
+    """Текст требования для векторного представления."""
+    return f"{requirement.get('name', '')} {requirement.get('shall', '')}"
 
 
 class VectorStore:
-    """Векторное хранилище требований (упрощенная версия)."""
+    """Векторное хранилище требований в памяти: матрица векторов и поиск по косинусному сходству."""
     
-    def __init__(self):
+    def __init__(self, provider: Optional[EmbeddingProvider] = None):
         """Инициализация векторного хранилища."""
-        # В production использовать pgvector, ChromaDB или Qdrant
-        self.embeddings_cache = {}
-        self.available = False  # Требует настройки векторной БД
-    
-    def update_embeddings(self, requirement_id: str, requirement_text: str, embedding: List[float]):
-        """Обновить векторное представление требования."""
-        self.embeddings_cache[requirement_id] = {
-            "text": requirement_text,
-            "embedding": embedding
-        }
+        self.provider = provider or create_embedding_provider()
+        self.available = True
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._projects: List[Optional[str]] = []
+        self._index: Dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+        # Число векторов с ненулевым признаком (для IDF локальных векторов)
+        self._document_frequency: Optional[np.ndarray] = None
+        self._normalized: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._ids)
     
-    def find_similar(self, embedding: List[float], threshold: float = 0.8, limit: int = 10) -> List[Dict]:
-        """Найти похожие требования по векторному сходству."""
-        # В production использовать реальный векторный поиск
-        results = []
-        for req_id, data in self.embeddings_cache.items():
-            # Упрощенный расчет сходства (в production использовать cosine similarity)
-            results.append({
-                "requirement_id": req_id,
-                "text": data["text"],
-                "similarity": 0.9  # Placeholder
-            })
+    def _ensure_capacity(self, dimension: int, rows: int):
+        """Выделить место под векторы (емкость растет вдвое)."""
+        if self._matrix is None:
+            self._matrix = np.zeros((max(rows, 64), dimension), dtype=np.float32)
+            self._document_frequency = np.zeros(dimension, dtype=np.float64)
+        elif self._matrix.shape[1] != dimension:
+            raise ValueError(f"Embedding dimension {dimension} does not match store dimension {self._matrix.shape[1]}")
+        elif rows > self._matrix.shape[0]:
+            grown = np.zeros((max(rows, 2 * self._matrix.shape[0]), dimension), dtype=np.float32)
+            grown[:len(self._ids)] = self._matrix[:len(self._ids)]
+            self._matrix = grown
+    
+    def _add(self, ids: Sequence[str], texts: Sequence[str], projects: Sequence[Optional[str]], vectors: np.ndarray):
+        """Записать векторы (новые строки или замена существующих)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("Embeddings must be a matrix with one row per requirement")
+        if len(set(ids)) != len(ids):
+            # Повтор требования в пакете: остается последний вектор
+            last = {req_id: i for i, req_id in enumerate(ids)}
+            keep = sorted(last.values())
+            ids, texts, projects = [ids[i] for i in keep], [texts[i] for i in keep], [projects[i] for i in keep]
+            vectors = vectors[keep]
+        if not self.provider.corpus_weighted:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms > 0, norms, 1.0)
         
-        return sorted(results, key=lambda x: x["similarity"], reverse=True)[:limit]
+        with self._lock:
+            new = [req_id for req_id in dict.fromkeys(ids) if req_id not in self._index]
+            self._ensure_capacity(vectors.shape[1], len(self._ids) + len(new))
+            for req_id in new:
+                self._index[req_id] = len(self._ids)
+                self._ids.append(req_id)
+                self._texts.append("")
+                self._projects.append(None)
+            
+            rows = np.array([self._index[req_id] for req_id in ids], dtype=np.int64)
+            self._document_frequency -= (self._matrix[rows] > 0).sum(axis=0)
+            self._matrix[rows] = vectors
+            self._document_frequency += (self._matrix[rows] > 0).sum(axis=0)
+            for row, text, project_id in zip(rows, texts, projects):
+                self._texts[row] = text
+                self._projects[row] = project_id
+            self._normalized = None
+    
+    def _weights(self) -> Optional[np.ndarray]:
+        """IDF признаков по всему корпусу (только для локальных векторов)."""
+        if not self.provider.corpus_weighted:
+            return None
+        return np.log((1 + len(self._ids)) / (1 + self._document_frequency)).astype(np.float32) + 1
+    
+    def _normalize(self, vectors: np.ndarray, weights: Optional[np.ndarray]) -> np.ndarray:
+        """Взвесить и нормировать векторы для косинусного сходства."""
+        if weights is not None:
+            vectors = vectors * weights
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+    
+    def update_embeddings(self, requirement_id: str, requirement_text: str, embedding: Optional[List[float]] = None, project_id: Optional[str] = None):
+        """Обновить векторное представление требования (без вектора - посчитать провайдером)."""
+        vectors = self.provider.embed([requirement_text]) if embedding is None else np.asarray([embedding])
+        self._add([requirement_id], [requirement_text], [project_id], vectors)
+    
+    def find_similar(
+        self,
+        embedding: List[float],
+        threshold: float = 0.8,
+        limit: int = 10,
+        project_id: Optional[str] = None,
+        exclude: Optional[str] = None
+    ) -> List[Dict]:
+        """Найти похожие требования по косинусному сходству."""
+        with self._lock:
+            if not self._ids:
+                return []
+            count = len(self._ids)
+            weights = self._weights()
+            if self._normalized is None:
+                self._normalized = self._normalize(self._matrix[:count], weights)
+            matrix = self._normalized
+            query = self._normalize(np.asarray(embedding, dtype=np.float32), weights)
+            scores = matrix @ query
+            
+            mask = scores >= threshold
+            if project_id is not None:
+                mask &= np.array([p == project_id for p in self._projects])
+            if exclude is not None and exclude in self._index:
+                mask[self._index[exclude]] = False
+            candidates = np.flatnonzero(mask)
+            top = candidates[np.argsort(-scores[candidates], kind="stable")[:limit]]
+            return [{
+                "requirement_id": self._ids[row],
+                "text": self._texts[row],
+                "similarity": float(scores[row])
+            } for row in top]
+    
+    def search(self, text: str, threshold: float = 0.3, limit: int = 10, project_id: Optional[str] = None, exclude: Optional[str] = None) -> List[Dict]:
+        """Найти требования, похожие на текст."""
+        return self.find_similar(self.provider.embed([text])[0], threshold, limit, project_id, exclude)
+    
+    @staticmethod
+    def _fields(requirements: List[Dict[str, Any]]):
+        """Идентификаторы, тексты и проекты требований."""
+        ids = [str(req.get("id") or req.get("identifier", "")) for req in requirements]
+        texts = [requirement_text(req) for req in requirements]
+        projects = [str(req["project_id"]) if req.get("project_id") else None for req in requirements]
+        return ids, texts, projects
     
     def batch_update(self, requirements: List[Dict[str, Any]]):
-        """Пакетное обновление векторов."""
-        for req in requirements:
-            req_id = req.get("id") or req.get("identifier", "")
-            text = f"{req.get('name', '')} {req.get('shall', '')}"
-            # В production генерировать embedding через модель
-            self.update_embeddings(req_id, text, [])
-
+        """Пакетное обновление векторов (векторы считаются пакетами провайдера)."""
+        ids, texts, projects = self._fields(requirements)
+        if ids:
+            self._add(ids, texts, projects, self.provider.embed(texts))
+    
+    async def abatch_update(self, requirements: List[Dict[str, Any]]):
+        """Асинхронная версия batch_update (удаленные провайдеры не блокируют цикл событий)."""
+        ids, texts, projects = self._fields(requirements)
+        if ids:
+            self._add(ids, texts, projects, await self.provider.aembed(texts))
+    
+    def remove(self, requirement_id: str) -> bool:
+        """Удалить вектор требования."""
+        with self._lock:
+            row = self._index.pop(requirement_id, None)
+            if row is None:
+                return False
+            last = len(self._ids) - 1
+            self._document_frequency -= self._matrix[row] > 0
+            # Последняя строка переносится на место удаленной
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                for values in (self._ids, self._texts, self._projects):
+                    values[row] = values[last]
+                self._index[self._ids[row]] = row
+            self._matrix[last] = 0
+            for values in (self._ids, self._texts, self._projects):
+                values.pop()
+            self._normalized = None
+            return True
+    
+    def stats(self) -> Dict[str, Any]:
+        """Размер хранилища и провайдер."""
+        return {
+            "provider": self.provider.name,
+            "vectors": len(self._ids),
+            "dimension": None if self._matrix is None else int(self._matrix.shape[1])
+        }
@@ -1,94 +1,34 @@
 """ИИ агент для Администратора проекта."""
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain_community.chat_models import ChatOllama
-from langchain_core.messages import HumanMessage, SystemMessage
-from typing import Dict, Any, Optional
-from shared.ai_config import ai_settings, ModelProvider
-from shared.prompt_store import prompt_store
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from typing import Dict, Any, Optional, List, Tuple
+from shared.llm_client import llm_registry
+from shared.llm_telemetry import llm_telemetry, traced
+from shared.prompt_store import prompt_store, PromptTemplate
+from shared.structured_output import ainvoke_structured, invoke_structured
+from services.project_admin.schemas import ProjectAnalysis, ProjectStructure
 import json
 
 
-def create_llm(config: dict):
-    """Создать LLM на основе конфигурации."""
-    provider = config["provider"]
-    model = config["model"]
-    temperature = config["temperature"]
-    api_key = config.get("api_key")
-    base_url = config.get("base_url")
-    
-    if provider == ModelProvider.OPENAI:
-        params = {
-            "model": model,
-            "api_key": api_key,
-            "temperature": temperature,
-        }
-        if base_url:
-            params["base_url"] = base_url
-        return ChatOpenAI(**params)
-    
-    elif provider == ModelProvider.ANTHROPIC:
-        return ChatAnthropic(
-            model=model,
-            anthropic_api_key=api_key,
-            temperature=temperature,
-        )
-    
-    elif provider == ModelProvider.AZURE_OPENAI:
-        from langchain_openai import AzureChatOpenAI
-        return AzureChatOpenAI(
-            azure_endpoint=config.get("azure_endpoint"),
-            azure_deployment=config.get("azure_deployment", model),
-            api_version=config.get("api_version", "2024-02-15-preview"),
-            api_key=api_key,
-            temperature=temperature,
-        )
-    
-    elif provider == ModelProvider.OPENROUTER:
-        # OpenRouter использует OpenAI-совместимый API
-        return ChatOpenAI(
-            model=model,
-            api_key=api_key,
-            base_url=base_url or "https://openrouter.ai/api/v1",
-            temperature=temperature,
-        )
-    
-    elif provider == ModelProvider.OLLAMA:
-        return ChatOllama(
-            model=model,
-            base_url=base_url,
-            temperature=temperature,
-        )
-    
-    else:
-        return ChatOpenAI(
-            model=model or "gpt-4-turbo-preview",
-            api_key=api_key,
-            temperature=temperature,
-        )
-
 
 class ProjectAdminAgent:
     """ИИ агент для анализа и рекомендаций по проектам."""
     
     def __init__(self):
         """Инициализация агента."""
-        config = ai_settings.get_config_for_agent("project_admin")
-        self.llm = create_llm(config)
+        self.llm = llm_registry.get_for_agent("project_admin")
     
-    def analyze_project(self, project_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Анализ проекта и генерация рекомендаций."""
+    def _analysis_messages(self, project_data: Dict[str, Any]) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для анализа проекта."""
         
         # Получить промпт из хранилища
         prompt_template = prompt_store.get_active_prompt("project_admin", "analysis")
         
         if prompt_template:
             # Использовать промпт из хранилища
-            human_prompt = prompt_store.render_prompt(
+            system_prompt, human_prompt = prompt_store.render_parts(
                 prompt_template.id,
                 {"project_data": json.dumps(project_data, ensure_ascii=False, indent=2)}
             )
-            system_prompt = ""  # Промпт уже содержит все инструкции
         else:
             # Fallback на встроенный промпт
             system_prompt = """You are an expert project manager and business analyst.
@@ -119,30 +59,42 @@ Provide comprehensive analysis and recommendations."""
         if system_prompt:
             messages.append(SystemMessage(content=system_prompt))
         messages.append(HumanMessage(content=human_prompt))
-        
+        return messages, prompt_template
+    
+    @traced
+    def analyze_project(self, project_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Анализ проекта и генерация рекомендаций."""
+        messages, prompt = self._analysis_messages(project_data)
         try:
-            response = self.llm.invoke(messages)
-            content = response.content
-            
-            # Извлечение JSON
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            return json.loads(content)
+            return invoke_structured(self.llm, messages, ProjectAnalysis, prompt=prompt)
         except Exception as e:
-            return {
-                "recommendations": [],
-                "suggested_structure": {},
-                "risks": [],
-                "methodology_suggestions": "",
-                "team_roles": [],
-                "error": str(e)
-            }
+            llm_telemetry.record_fallback(e)
+            return self._analysis_fallback(e)
     
-    def generate_project_structure(self, methodology: str, project_type: str) -> Dict[str, Any]:
-        """Генерация структуры проекта на основе методологии."""
+    @traced
+    async def aanalyze_project(self, project_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Асинхронный анализ проекта и генерация рекомендаций."""
+        messages, prompt = self._analysis_messages(project_data)
+        try:
+            return await ainvoke_structured(self.llm, messages, ProjectAnalysis, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
+            return self._analysis_fallback(e)
+    
+    @staticmethod
+    def _analysis_fallback(error: Exception) -> Dict[str, Any]:
+        """Результат анализа проекта по умолчанию."""
+        return {
+            "recommendations": [],
+            "suggested_structure": {},
+            "risks": [],
+            "methodology_suggestions": "",
+            "team_roles": [],
+            "error": str(error)
+        }
+    
+    def _structure_messages(self, methodology: str, project_type: str) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для генерации структуры проекта."""
         
         system_prompt = """You are an expert in software development methodologies.
 Generate a project structure template based on the methodology and project type."""
@@ -163,20 +115,34 @@ Return JSON with structure:
             SystemMessage(content=system_prompt),
             HumanMessage(content=human_prompt)
         ]
-        
+        return messages, None
+    
+    @traced
+    def generate_project_structure(self, methodology: str, project_type: str) -> Dict[str, Any]:
+        """Генерация структуры проекта на основе методологии."""
+        messages, prompt = self._structure_messages(methodology, project_type)
         try:
-            response = self.llm.invoke(messages)
-            content = response.content
-            
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            
-            return json.loads(content)
+            return invoke_structured(self.llm, messages, ProjectStructure, prompt=prompt)
         except Exception as e:
-            return {
-                "phases": [],
-                "milestones": [],
-                "workflows": [],
-                "artifacts": []
-            }
-
+            llm_telemetry.record_fallback(e)
+            return self._structure_fallback()
+    
+    @traced
+    async def agenerate_project_structure(self, methodology: str, project_type: str) -> Dict[str, Any]:
+        """Асинхронная генерация структуры проекта."""
+        messages, prompt = self._structure_messages(methodology, project_type)
+        try:
+            return await ainvoke_structured(self.llm, messages, ProjectStructure, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
+            return self._structure_fallback()
+    
+    @staticmethod
+    def _structure_fallback() -> Dict[str, Any]:
+        """Структура проекта по умолчанию."""
+        return {
+            "phases": [],
+            "milestones": [],
+            "workflows": [],
+            "artifacts": []
+        }
@@ -6,11 +6,18 @@ from pydantic import BaseModel, Field
 from shared.database import get_db
 from shared.models import Project, User
 from services.project_admin.ai_agent import ProjectAdminAgent
+from shared.ai_config import ai_settings
+from shared.llm_telemetry import llm_telemetry
+from shared.orchestration import TIMEOUT, Pipeline, PipelineError
 from datetime import date
+from functools import partial
 import uuid
 
 router = APIRouter(prefix="/api/projects", tags=["Project Admin"])
 
+# Агент использует общий LLM клиент из реестра
+agent = ProjectAdminAgent()
+
 # Pydantic схемы
 class ProjectCreate(BaseModel):
     name: str
@@ -44,6 +51,7 @@ class ProjectAnalysisResponse(BaseModel):
     risks: List[str]
     methodology_suggestions: str
     team_roles: List[str]
+    failed_steps: List[str] = []
 
 
 @router.post("", response_model=ProjectResponse, status_code=status.HTTP_201_CREATED)
@@ -103,8 +111,6 @@ async def analyze_project(
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    agent = ProjectAdminAgent()
-    
     project_data = {
         "name": project.name,
         "description": project.description,
@@ -114,14 +120,25 @@ async def analyze_project(
         "status": project.status,
     }
     
-    analysis = agent.analyze_project(project_data)
-    
+    # Анализ и структура независимы и выполняются параллельно
+    pipeline = Pipeline("project_analyze", default_timeout=ai_settings.step_timeout)
+    pipeline.step("analysis", partial(agent.aanalyze_project, project_data))
     if analysis_request.include_structure and project.methodology:
-        structure = agent.generate_project_structure(
-            project.methodology,
-            "software_development"
+        pipeline.step(
+            "structure",
+            partial(agent.agenerate_project_structure, project.methodology, "software_development"),
+            required=False
         )
-        analysis["suggested_structure"] = structure
     
-    return ProjectAnalysisResponse(**analysis)
+    try:
+        with llm_telemetry.project_scope(project_id):
+            result = await pipeline.run()
+    except PipelineError as e:
+        raise HTTPException(status_code=504 if e.step.status == TIMEOUT else 502, detail=str(e))
+    
+    analysis = result["analysis"]
+    if "structure" in result and result["structure"] is not None:
+        analysis["suggested_structure"] = result["structure"]
+    
+    return ProjectAnalysisResponse(**analysis, failed_steps=result.failed)
 
@@ -0,0 +1,23 @@
+"""Схемы ответов ИИ агента администратора проекта."""
+from pydantic import BaseModel
+from typing import Any, Dict, List, Union
+
+
+class ProjectAnalysis(BaseModel):
+    recommendations: List[str] = []
+    suggested_structure: Dict[str, Any] = {}
+    risks: List[str] = []
+    methodology_suggestions: Union[str, List[str]] = ""
+    team_roles: List[str] = []
+    
+    class Config:
+        extra = "allow"
+
+class ProjectStructure(BaseModel):
+    phases: List[Any] = []
+    milestones: List[Any] = []
+    workflows: List[Any] = []
+    artifacts: List[Any] = []
+    
+    class Config:
+        extra = "allow"
@@ -2,8 +2,10 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
+from shared.llm_telemetry import llm_telemetry
 from shared.prompt_store import PromptTemplate
 from shared.prompt_store_supabase import get_prompt_store
+from shared.prompt_templates import compile_template
 import uuid
 
 # Получить хранилище (Supabase или in-memory)
@@ -55,6 +57,12 @@ async def list_prompts(
     return prompts
 
 
+@router.get("/snapshot", response_model=Dict[str, Any])
+async def export_snapshot():
+    """Снимок всех промптов (формат файла AI_PROMPT_SNAPSHOT_PATH)."""
+    return prompt_store.snapshot().to_dict()
+
+
 @router.get("/{prompt_id}", response_model=PromptTemplate)
 async def get_prompt(prompt_id: str):
     """Получить промпт по ID."""
@@ -64,6 +72,16 @@ async def get_prompt(prompt_id: str):
     return prompt
 
 
+@router.get("/{prompt_id}/stats", response_model=Dict[str, Any])
+async def get_prompt_stats(prompt_id: str):
+    """Метрики версий промпта (вызовы, задержка, токены, ошибки разбора, fallback) и сравнение двух последних."""
+    prompt = prompt_store.get_prompt(prompt_id)
+    stats = llm_telemetry.prompt_stats(prompt_id)
+    if not prompt and not stats["versions"]:
+        raise HTTPException(status_code=404, detail="Prompt not found")
+    return {**stats, "current_version": prompt.version if prompt else None}
+
+
 @router.get("/agent/{agent_type}", response_model=List[PromptTemplate])
 async def get_agent_prompts(
     agent_type: str,
@@ -104,7 +122,8 @@ async def create_prompt(prompt_data: PromptCreate):
         agent_type=prompt_data.agent_type,
         prompt_type=prompt_data.prompt_type,
         template=prompt_data.template,
-        variables=prompt_data.variables,
+        # Без списка переменных берутся переменные шаблона
+        variables=prompt_data.variables or list(compile_template(prompt_data.template).variables),
         version=1,
         is_active=prompt_data.is_active,
         metadata=prompt_data.metadata,
@@ -112,7 +131,10 @@ async def create_prompt(prompt_data: PromptCreate):
         updated_at=now,
     )
     
-    prompt_store.add_prompt(prompt)
+    try:
+        prompt_store.add_prompt(prompt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return prompt
 
 
@@ -121,7 +143,10 @@ async def update_prompt(prompt_id: str, updates: PromptUpdate):
     """Обновить промпт (создает новую версию)."""
     update_dict = updates.dict(exclude_unset=True)
     
-    updated = prompt_store.update_prompt(prompt_id, update_dict)
+    try:
+        updated = prompt_store.update_prompt(prompt_id, update_dict)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not updated:
         raise HTTPException(status_code=404, detail="Prompt not found")
     
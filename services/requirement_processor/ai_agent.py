@@ -1,71 +1,47 @@
 """ИИ агент для обработки входящих требований."""
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain_community.chat_models import ChatOllama
-from langchain_core.messages import HumanMessage, SystemMessage
-from typing import Dict, Any, Optional, List
-from shared.ai_config import ai_settings, ModelProvider
-from shared.prompt_store import prompt_store
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from typing import Dict, Any, Optional, List, Tuple
+from shared.ai_config import ai_settings
+from shared.llm_client import llm_registry
+from shared.llm_hedging import is_failover_error
+from shared.llm_telemetry import llm_telemetry, traced
+from shared.prompt_store import prompt_store, PromptTemplate
+from shared.structured_output import (
+    StructuredOutputError, ainvoke_structured, extract_json, invoke_structured, validate_output
+)
+from shared.tokens import count_tokens
+from services.requirement_processor.schemas import BatchFormalizedRequirement, EntityList, FormalizedRequirement
+import asyncio
 import json
 
 
-def create_llm(config: dict):
-    """Создать LLM на основе конфигурации."""
-    provider = config["provider"]
-    model = config["model"]
-    temperature = config["temperature"]
-    api_key = config.get("api_key")
-    base_url = config.get("base_url")
-    
-    if provider == ModelProvider.OPENAI:
-        params = {
-            "model": model,
-            "api_key": api_key,
-            "temperature": temperature,
-        }
-        if base_url:
-            params["base_url"] = base_url
-        return ChatOpenAI(**params)
-    
-    elif provider == ModelProvider.ANTHROPIC:
-        return ChatAnthropic(
-            model=model,
-            anthropic_api_key=api_key,
-            temperature=temperature,
-        )
-    
-    elif provider == ModelProvider.AZURE_OPENAI:
-        from langchain_openai import AzureChatOpenAI
-        return AzureChatOpenAI(
-            azure_endpoint=config.get("azure_endpoint"),
-            azure_deployment=config.get("azure_deployment", model),
-            api_version=config.get("api_version", "2024-02-15-preview"),
-            api_key=api_key,
-            temperature=temperature,
-        )
-    
-    elif provider == ModelProvider.OPENROUTER:
-        # OpenRouter использует OpenAI-совместимый API
-        return ChatOpenAI(
-            model=model,
-            api_key=api_key,
-            base_url=base_url or "https://openrouter.ai/api/v1",
-            temperature=temperature,
-        )
-    
-    elif provider == ModelProvider.OLLAMA:
-        return ChatOllama(
-            model=model,
-            base_url=base_url,
-            temperature=temperature,
-        )
-    
-    else:
-        return ChatOpenAI(
-            model=model or "gpt-4-turbo-preview",
-            api_key=api_key,
-            temperature=temperature,
-        )
+# Системный промпт пакетной формализации (общий для всех элементов пакета)
+BATCH_SYSTEM_PROMPT = """You are an expert business analyst specializing in requirement formalization according to ISO/IEC/IEEE 29148 standard.
+
+You will receive a JSON array of informal requirements. Each item has an "index", a "text" and an optional "context".
+Formalize every item independently and extract the entities (actors, data objects, business processes, external systems, resources) it involves.
+
+Return ONLY a JSON array with exactly one object per input item, keeping its "index":
+[
+    {
+        "index": 0,
+        "identifier": "REQ-001",
+        "name": "Clear requirement name",
+        "shall": "Formal requirement statement starting with 'The system shall...'",
+        "rationale": "Why this requirement exists",
+        "verification_method": "testing|inspection|analysis|demonstration",
+        "category": "functional|non_functional|business|technical",
+        "priority": 1-5,
+        "source": "source of requirement",
+        "acceptance_criteria": ["criterion1", "criterion2"],
+        "tags": ["tag1", "tag2"],
+        "estimated_effort": 5.0,
+        "entities": [
+            {"name": "User", "type": "actor"}
+        ]
+    }
+]
+Do not merge, skip or reorder items."""
 
 
 class RequirementProcessorAgent:
@@ -73,11 +49,10 @@ class RequirementProcessorAgent:
     
     def __init__(self):
         """Инициализация агента."""
-        config = ai_settings.get_config_for_agent("requirement_processor")
-        self.llm = create_llm(config)
+        self.llm = llm_registry.get_for_agent("requirement_processor")
     
-    def formalize_requirement(self, informal_text: str, context: Optional[Dict] = None) -> Dict[str, Any]:
-        """Формализация неформализованного требования в формат ISO/IEC/IEEE 29148."""
+    def _formalize_messages(self, informal_text: str, context: Optional[Dict] = None) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для формализации требования."""
         
         # Получить промпт из хранилища
         prompt_template = prompt_store.get_active_prompt("requirement_processor", "formalization")
@@ -85,14 +60,13 @@ class RequirementProcessorAgent:
         if prompt_template:
             # Использовать промпт из хранилища
             context_text = json.dumps(context, ensure_ascii=False, indent=2) if context else ""
-            human_prompt = prompt_store.render_prompt(
+            system_prompt, human_prompt = prompt_store.render_parts(
                 prompt_template.id,
                 {
                     "informal_text": informal_text,
                     "context": context_text
                 }
             )
-            system_prompt = ""
         else:
             # Fallback на встроенный промпт
             system_prompt = """You are an expert business analyst specializing in requirement formalization according to ISO/IEC/IEEE 29148 standard.
@@ -110,7 +84,7 @@ Analyze the input requirement and extract:
 8. Source (stakeholder, regulation, etc.)
 9. Acceptance criteria (list of criteria)
 10. Tags (relevant tags)
-11. Entities involved (actors, data objects, processes)
+11. Entities involved (actors, data objects, business processes, external systems, resources)
 12. Estimated effort (if possible)
 
 Return the result as a JSON object with the following structure:
@@ -130,7 +104,8 @@ Return the result as a JSON object with the following structure:
         {"name": "User", "type": "actor"},
         {"name": "Order", "type": "data_object"}
     ]
-}"""
+}
+Entity type is one of: actor, data_object, business_process, external_system, resource."""
 
             context_text = ""
             if context:
@@ -151,39 +126,65 @@ Provide the formalized requirement in JSON format."""
         if system_prompt:
             messages.append(SystemMessage(content=system_prompt))
         messages.append(HumanMessage(content=human_prompt))
-        
+        return messages, prompt_template
+    
+    @traced
+    def formalize_requirement(self, informal_text: str, context: Optional[Dict] = None) -> Dict[str, Any]:
+        """Формализация неформализованного требования в формат ISO/IEC/IEEE 29148."""
+        messages, prompt = self._formalize_messages(informal_text, context)
         try:
-            response = self.llm.invoke(messages)
-            content = response.content
-            
-            # Извлечение JSON
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            result = json.loads(content)
-            return result
+            return invoke_structured(self.llm, messages, FormalizedRequirement, prompt=prompt)
         except Exception as e:
-            # Fallback
-            return {
-                "identifier": "REQ-UNKNOWN",
-                "name": informal_text[:100],
-                "shall": informal_text,
-                "rationale": "Requirement needs review",
-                "verification_method": "testing",
-                "category": "functional",
-                "priority": 3,
-                "source": "unknown",
-                "acceptance_criteria": [],
-                "tags": [],
-                "estimated_effort": None,
-                "entities": [],
-                "error": str(e)
-            }
+            llm_telemetry.record_fallback(e)
+            return self._formalize_fallback(informal_text, e)
     
-    def extract_entities(self, requirement_text: str) -> List[Dict[str, str]]:
-        """Извлечение сущностей из требования."""
+    @traced
+    async def aformalize_requirement(self, informal_text: str, context: Optional[Dict] = None) -> Dict[str, Any]:
+        """Асинхронная формализация требования в формат ISO/IEC/IEEE 29148."""
+        messages, prompt = self._formalize_messages(informal_text, context)
+        try:
+            return await ainvoke_structured(self.llm, messages, FormalizedRequirement, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
+            return self._formalize_fallback(informal_text, e)
+    
+    @staticmethod
+    def _formalize_fallback(informal_text: str, error: Exception) -> Dict[str, Any]:
+        """Результат формализации по умолчанию."""
+        return {
+            "identifier": "REQ-UNKNOWN",
+            "name": informal_text[:100],
+            "shall": informal_text,
+            "rationale": "Requirement needs review",
+            "verification_method": "testing",
+            "category": "functional",
+            "priority": 3,
+            "source": "unknown",
+            "acceptance_criteria": [],
+            "tags": [],
+            "estimated_effort": None,
+            "entities": [],
+            "error": str(error)
+        }
+    
+    @traced
+    def process_requirement(self, informal_text: str, context: Optional[Dict] = None) -> Dict[str, Any]:
+        """Формализация с извлечением сущностей за один вызов модели (отдельное извлечение - только если сущностей нет)."""
+        formalized = self.formalize_requirement(informal_text, context)
+        if not formalized.get("entities"):
+            formalized["entities"] = self.extract_entities(informal_text)
+        return formalized
+    
+    @traced
+    async def aprocess_requirement(self, informal_text: str, context: Optional[Dict] = None) -> Dict[str, Any]:
+        """Асинхронная формализация с извлечением сущностей за один вызов модели."""
+        formalized = await self.aformalize_requirement(informal_text, context)
+        if not formalized.get("entities"):
+            formalized["entities"] = await self.aextract_entities(informal_text)
+        return formalized
+    
+    def _entities_messages(self, requirement_text: str) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для извлечения сущностей."""
         
         system_prompt = """Extract entities (actors, data objects, business processes) from the requirement.
 Return JSON array:
@@ -201,15 +202,146 @@ Return JSON array of entities."""
             SystemMessage(content=system_prompt),
             HumanMessage(content=human_prompt)
         ]
-        
+        return messages, None
+    
+    @traced
+    def extract_entities(self, requirement_text: str) -> List[Dict[str, str]]:
+        """Извлечение сущностей из требования."""
+        messages, prompt = self._entities_messages(requirement_text)
+        try:
+            return invoke_structured(self.llm, messages, EntityList, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
+            return []
+    
+    @traced
+    async def aextract_entities(self, requirement_text: str) -> List[Dict[str, str]]:
+        """Асинхронное извлечение сущностей из требования."""
+        messages, prompt = self._entities_messages(requirement_text)
         try:
-            response = self.llm.invoke(messages)
-            content = response.content
-            
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            
-            return json.loads(content)
-        except:
+            return await ainvoke_structured(self.llm, messages, EntityList, prompt=prompt)
+        except Exception as e:
+            llm_telemetry.record_fallback(e)
             return []
+    
+    def _batch_item(self, index: int, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Представление элемента пакета в промпте."""
+        packed = {"index": index, "text": item["informal_text"]}
+        if item.get("context"):
+            packed["context"] = item["context"]
+        return packed
+    
+    def _pack_batches(self, items: List[Dict[str, Any]], indices: List[int]) -> List[List[int]]:
+        """Разбить элементы на пакеты с учетом бюджета токенов и размера пакета."""
+        budget = max(1, ai_settings.batch_max_input_tokens - count_tokens(BATCH_SYSTEM_PROMPT))
+        max_items = max(1, ai_settings.batch_max_items)
+        
+        batches: List[List[int]] = []
+        current: List[int] = []
+        used = 0
+        for index in indices:
+            cost = count_tokens(json.dumps(self._batch_item(index, items[index]), ensure_ascii=False, default=str))
+            # Слишком большой элемент уходит отдельным пакетом
+            if current and (used + cost > budget or len(current) >= max_items):
+                batches.append(current)
+                current, used = [], 0
+            current.append(index)
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+    
+    def _batch_messages(self, items: List[Dict[str, Any]], batch: List[int]) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для пакетной формализации."""
+        packed = [self._batch_item(index, items[index]) for index in batch]
+        human_prompt = f"""Formalize the following {len(packed)} requirements according to ISO/IEC/IEEE 29148:
+
+{json.dumps(packed, ensure_ascii=False, indent=2, default=str)}
+
+Return a JSON array with one formalized requirement per item."""
 
+        messages = [
+            SystemMessage(content=BATCH_SYSTEM_PROMPT),
+            HumanMessage(content=human_prompt)
+        ]
+        return messages, None
+    
+    @staticmethod
+    def _validate_batch_item(entry: Any) -> Optional[Dict[str, Any]]:
+        """Проверить результат элемента пакета схемой; None - элемент нужно повторить."""
+        try:
+            item = validate_output(entry, BatchFormalizedRequirement)
+        except StructuredOutputError:
+            return None
+        item.pop("index", None)
+        return item
+    
+    async def _aformalize_packed(self, items: List[Dict[str, Any]], batch: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Формализовать один пакет; вернуть только валидные результаты по индексам."""
+        messages, prompt = self._batch_messages(items, batch)
+        try:
+            response = await self.llm.ainvoke(messages, prompt=prompt)
+        except Exception as e:
+            # Временные ошибки провайдера - элементы повторяются; остальные (бюджет, авторизация, ошибки кода) - наверх
+            if not is_failover_error(e):
+                raise
+            llm_telemetry.record_fallback(e)
+            return {}
+        
+        try:
+            parsed = extract_json(response.content)
+            if isinstance(parsed, dict):
+                parsed = parsed.get("items") or parsed.get("requirements") or []
+            if not isinstance(parsed, list):
+                raise StructuredOutputError("Batch response is not a JSON array", response.content)
+        except StructuredOutputError as e:
+            llm_telemetry.record_parse_failure(error=e)
+            return {}
+        
+        expected = set(batch)
+        results: Dict[int, Dict[str, Any]] = {}
+        for entry in parsed:
+            index = entry.get("index") if isinstance(entry, dict) else None
+            if index not in expected or index in results:
+                continue
+            item = self._validate_batch_item(entry)
+            if item is not None:
+                results[index] = item
+        return results
+    
+    @traced
+    async def aformalize_batch(self, items: List[Dict[str, Any]], max_attempts: int = 2) -> List[Dict[str, Any]]:
+        """
+        Пакетная формализация требований с извлечением сущностей.
+        
+        Args:
+            items: Список словарей с ключами informal_text и context
+            max_attempts: Количество пакетных попыток для невалидных элементов (затем - по одному)
+        
+        Returns:
+            Результаты формализации в порядке входных элементов
+        """
+        results: Dict[int, Dict[str, Any]] = {}
+        pending = list(range(len(items)))
+        
+        for attempt in range(max_attempts):
+            if not pending:
+                break
+            if attempt > 0:
+                llm_telemetry.record_retry("batch")
+            batches = self._pack_batches(items, pending)
+            outcomes = await asyncio.gather(*[self._aformalize_packed(items, batch) for batch in batches])
+            for outcome in outcomes:
+                results.update(outcome)
+            # Повторяются только элементы без валидного результата
+            pending = [index for index in pending if index not in results]
+        
+        # Оставшиеся элементы формализуются по одному (с исправлением ответа и значением по умолчанию при неудаче)
+        if pending:
+            llm_telemetry.record_retry("item")
+            singles = await asyncio.gather(*[
+                self.aformalize_requirement(items[index]["informal_text"], items[index].get("context"))
+                for index in pending
+            ])
+            results.update(zip(pending, singles))
+        return [results[index] for index in range(len(items))]
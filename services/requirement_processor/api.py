@@ -5,10 +5,14 @@ from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
 from shared.database import get_db
 from services.requirement_processor.ai_agent import RequirementProcessorAgent
+from shared.llm_telemetry import llm_telemetry
 import uuid
 
 router = APIRouter(prefix="/api/requirements/process", tags=["Requirement Processor"])
 
+# Агент использует общий LLM клиент из реестра
+agent = RequirementProcessorAgent()
+
 # Хранилище статусов обработки (в production использовать Redis или БД)
 processing_status = {}
 
@@ -74,15 +78,9 @@ async def process_requirement_task(
     try:
         processing_status[str(processing_id)]["status"] = "processing"
         
-        # Инициализация агента
-        agent = RequirementProcessorAgent()
-        
-        # Формализация требования
-        formalized = agent.formalize_requirement(informal_text, context)
-        
-        # Извлечение сущностей
-        entities = agent.extract_entities(informal_text)
-        formalized["entities"] = entities
+        with llm_telemetry.project_scope(project_id):
+            # Формализация и извлечение сущностей одним вызовом модели
+            formalized = await agent.aprocess_requirement(informal_text, context)
         
         # Сохранение результата
         processing_status[str(processing_id)] = {
@@ -133,15 +131,14 @@ async def process_batch(
             "result": None,
             "error": None
         }
-        
-        background_tasks.add_task(
-            process_requirement_task,
-            processing_id,
-            req.project_id,
-            req.informal_text,
-            req.context,
-            db
-        )
+    
+    # Все требования формализуются пакетными запросами к модели
+    background_tasks.add_task(
+        process_batch_task,
+        processing_ids,
+        requirements,
+        db
+    )
     
     return {
         "processing_ids": processing_ids,
@@ -149,3 +146,38 @@ async def process_batch(
         "message": "Batch processing started"
     }
 
+
+async def process_batch_task(
+    processing_ids: List[uuid.UUID],
+    requirements: List[ProcessRequirementRequest],
+    db: Session
+):
+    """Фоновая задача пакетной обработки требований."""
+    for processing_id in processing_ids:
+        processing_status[str(processing_id)]["status"] = "processing"
+    
+    # Стоимость пакета относится к проекту, только если все требования из одного проекта
+    project_ids = {req.project_id for req in requirements}
+    project_id = project_ids.pop() if len(project_ids) == 1 else None
+    
+    try:
+        with llm_telemetry.project_scope(project_id):
+            results = await agent.aformalize_batch([
+                {"informal_text": req.informal_text, "context": req.context}
+                for req in requirements
+            ])
+    except Exception as e:
+        for processing_id in processing_ids:
+            processing_status[str(processing_id)] = {
+                "status": "failed",
+                "result": None,
+                "error": str(e)
+            }
+        return
+    
+    for processing_id, formalized in zip(processing_ids, results):
+        processing_status[str(processing_id)] = {
+            "status": "completed",
+            "result": formalized,
+            "error": None
+        }
@@ -0,0 +1,63 @@
+"""Схемы ответов ИИ агента обработки требований."""
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Optional
+
+
+# Типы сущностей, которые просим у модели
+ENTITY_TYPES = ("actor", "data_object", "business_process", "external_system", "resource")
+
+
+class ExtractedEntity(BaseModel):
+    name: str = Field(min_length=1)
+    type: str = "data_object"
+    
+    @field_validator("name")
+    @classmethod
+    def strip_name(cls, value: str) -> str:
+        return value.strip()
+    
+    @field_validator("type")
+    @classmethod
+    def normalize_type(cls, value: str) -> str:
+        # "Data Object" / "data-object" -> "data_object"
+        return "_".join(value.strip().lower().replace("-", " ").split()) or "data_object"
+    
+    class Config:
+        extra = "allow"
+
+
+class FormalizedRequirement(BaseModel):
+    identifier: str = Field(min_length=1)
+    name: str = Field(min_length=1)
+    shall: str = Field(min_length=1)
+    rationale: Optional[str] = None
+    verification_method: Optional[str] = None
+    category: str = "functional"
+    priority: int = Field(default=3, ge=1, le=5)
+    source: Optional[str] = None
+    acceptance_criteria: List[str] = []
+    tags: List[str] = []
+    estimated_effort: Optional[float] = None
+    entities: List[ExtractedEntity] = []
+    
+    @field_validator("entities")
+    @classmethod
+    def unique_entities(cls, value: List[ExtractedEntity]) -> List[ExtractedEntity]:
+        seen = set()
+        unique = []
+        for entity in value:
+            key = (entity.name.lower(), entity.type)
+            if entity.name and key not in seen:
+                seen.add(key)
+                unique.append(entity)
+        return unique
+    
+    class Config:
+        extra = "allow"
+
+
+class BatchFormalizedRequirement(FormalizedRequirement):
+    index: int
+
+
+EntityList = List[ExtractedEntity]
@@ -1,9 +1,11 @@
 """API для Хранилища требований через Supabase."""
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
 from pydantic import BaseModel
 from typing import List, Optional
 from shared.supabase_config import get_supabase
-from shared.sync_manager import sync_manager
+from shared.sync_manager import FULL, INCREMENTAL, RUNNING, sync_manager
+from shared.precompute import analysis_precompute
+from services.knowledge_base.graph_rag import neo4j_settings
 import uuid
 from datetime import date
 
@@ -90,8 +92,12 @@ async def create_requirement(
     
     created_req = result.data[0]
     
-    # Синхронизация с Neo4j
-    sync_manager.sync_requirement_to_graph(created_req, str(requirement.project_id))
+    # Синхронизация с Neo4j: через очередь graph_sync_outbox (запись ставит триггер в той же транзакции) или сразу
+    if not neo4j_settings.graph_outbox_enabled:
+        sync_manager.sync_requirement_to_graph(created_req, str(requirement.project_id))
+    
+    # Фоновый предрасчет анализов новой версии (с очередью - повторно после записи в граф)
+    await analysis_precompute.schedule_ids([created_req["id"]])
     
     return RequirementResponse(**created_req)
 
@@ -170,8 +176,13 @@ async def update_requirement(
     
     updated_req = result.data[0]
     
-    # Синхронизация с Neo4j
-    sync_manager.sync_requirement_to_graph(updated_req, updated_req["project_id"])
+    # Синхронизация с Neo4j (без очереди graph_sync_outbox - сразу)
+    if not neo4j_settings.graph_outbox_enabled:
+        sync_manager.sync_requirement_to_graph(updated_req, updated_req["project_id"])
+    
+    # Фоновый предрасчет анализов новой версии (с очередью - повторно после записи в граф)
+    analysis_precompute.invalidate(str(requirement_id))
+    await analysis_precompute.schedule_ids([updated_req["id"]])
     
     return RequirementResponse(**updated_req)
 
@@ -192,6 +203,21 @@ async def delete_requirement(
     if not result.data:
         raise HTTPException(status_code=404, detail="Requirement not found")
     
+    deleted_req = result.data[0]
+    
+    # Запись об удалении для инкрементальной синхронизации с Neo4j
+    try:
+        supabase.table("change_history").insert({
+            "entity_type": "requirement",
+            "entity_id": str(requirement_id),
+            "action": "deleted",
+            "old_values": {"project_id": deleted_req.get("project_id"), "identifier": deleted_req.get("identifier")}
+        }).execute()
+    except Exception as e:
+        print(f"Error recording requirement deletion: {e}")
+    
+    analysis_precompute.invalidate(str(requirement_id))
+    
     return None
 
 
@@ -217,3 +243,43 @@ async def sync_requirement(
     
     return {"success": success, "requirement_id": str(requirement_id)}
 
+
+@router.post("/projects/{project_id}/sync", status_code=202)
+async def sync_project(
+    project_id: uuid.UUID,
+    background_tasks: BackgroundTasks,
+    mode: str = Query(FULL, pattern=f"^({FULL}|{INCREMENTAL})$", description="full - все требования, incremental - изменения после водяного знака"),
+    resume: bool = Query(True, description="Продолжить прерванную полную синхронизацию с точки возобновления")
+):
+    """Запустить синхронизацию проекта с Neo4j в фоне."""
+    if not sync_manager.supabase:
+        raise HTTPException(status_code=503, detail="Supabase not available")
+    if not sync_manager.graph.available:
+        raise HTTPException(status_code=503, detail="Neo4j not available")
+    
+    progress = sync_manager.sync_progress(str(project_id))
+    if progress and progress["status"] == RUNNING:
+        return progress
+    
+    if mode == INCREMENTAL:
+        background_tasks.add_task(sync_manager.incremental_sync_project, str(project_id))
+    else:
+        background_tasks.add_task(sync_manager.bulk_sync_project, str(project_id), resume)
+    return {"project_id": str(project_id), "mode": mode, "status": "scheduled"}
+
+
+@router.get("/sync/outbox")
+async def get_outbox_stats():
+    """Состояние очереди синхронизации с Neo4j."""
+    if not sync_manager.supabase:
+        raise HTTPException(status_code=503, detail="Supabase not available")
+    return sync_manager.outbox_stats()
+
+
+@router.get("/projects/{project_id}/sync")
+async def get_project_sync_progress(project_id: uuid.UUID):
+    """Ход массовой синхронизации проекта (прогресс, скорость, точка возобновления)."""
+    progress = sync_manager.sync_progress(str(project_id))
+    if not progress:
+        raise HTTPException(status_code=404, detail="No sync started for this project")
+    return progress
@@ -1,99 +1,38 @@
 """ИИ агент для генерации спецификаций."""
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain_community.chat_models import ChatOllama
-from langchain_core.messages import HumanMessage, SystemMessage
-from typing import Dict, Any, Optional, List
-from shared.ai_config import ai_settings, ModelProvider
-from shared.prompt_store import prompt_store
-from services.spec_generator.templates import SpecificationType, TemplateManager
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from typing import Dict, Any, AsyncIterator, Callable, Optional, List, Tuple
+from shared.llm_client import llm_registry
+from shared.llm_telemetry import llm_telemetry, traced
+from shared.prompt_store import prompt_store, PromptTemplate
+from shared.structured_output import StructuredOutputError, ainvoke_structured, invoke_structured, parse_structured
+from services.spec_generator.schemas import AsyncAPISpec, OpenAPISpec
+from services.spec_generator.templates import SpecificationType, TemplateManager, SPEC_FORMATS
 import json
 
 
-def create_llm(config: dict):
-    """Создать LLM на основе конфигурации."""
-    provider = config["provider"]
-    model = config["model"]
-    temperature = config["temperature"]
-    api_key = config.get("api_key")
-    base_url = config.get("base_url")
-    
-    if provider == ModelProvider.OPENAI:
-        params = {
-            "model": model,
-            "api_key": api_key,
-            "temperature": temperature,
-        }
-        if base_url:
-            params["base_url"] = base_url
-        return ChatOpenAI(**params)
-    
-    elif provider == ModelProvider.ANTHROPIC:
-        return ChatAnthropic(
-            model=model,
-            anthropic_api_key=api_key,
-            temperature=temperature,
-        )
-    
-    elif provider == ModelProvider.AZURE_OPENAI:
-        from langchain_openai import AzureChatOpenAI
-        return AzureChatOpenAI(
-            azure_endpoint=config.get("azure_endpoint"),
-            azure_deployment=config.get("azure_deployment", model),
-            api_version=config.get("api_version", "2024-02-15-preview"),
-            api_key=api_key,
-            temperature=temperature,
-        )
-    
-    elif provider == ModelProvider.OPENROUTER:
-        # OpenRouter использует OpenAI-совместимый API
-        return ChatOpenAI(
-            model=model,
-            api_key=api_key,
-            base_url=base_url or "https://openrouter.ai/api/v1",
-            temperature=temperature,
-        )
-    
-    elif provider == ModelProvider.OLLAMA:
-        return ChatOllama(
-            model=model,
-            base_url=base_url,
-            temperature=temperature,
-        )
-    
-    else:
-        return ChatOpenAI(
-            model=model or "gpt-4-turbo-preview",
-            api_key=api_key,
-            temperature=temperature,
-        )
-
-
 class SpecificationGeneratorAgent:
     """ИИ агент для генерации спецификаций."""
     
     def __init__(self):
         """Инициализация агента."""
-        config = ai_settings.get_config_for_agent("spec_generator")
-        self.llm = create_llm(config)
+        self.llm = llm_registry.get_for_agent("spec_generator")
         self.template_manager = TemplateManager()
     
-    def generate_user_story(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> str:
-        """Генерация User Story."""
+    def _user_story_messages(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для генерации User Story."""
         
         # Получить промпт из хранилища
         prompt_template = prompt_store.get_active_prompt("spec_generator", "user_story")
         
         if prompt_template:
             context_text = json.dumps(context, ensure_ascii=False, indent=2) if context else ""
-            human_prompt = prompt_store.render_prompt(
+            system_prompt, human_prompt = prompt_store.render_parts(
                 prompt_template.id,
                 {
                     "requirement": json.dumps(requirement, ensure_ascii=False, indent=2),
                     "context": context_text
                 }
             )
-            system_prompt = ""
         else:
             # Fallback на встроенный промпт
             system_prompt = """You are an expert in writing User Stories.
@@ -111,12 +50,24 @@ Generate a User Story."""
         if system_prompt:
             messages.append(SystemMessage(content=system_prompt))
         messages.append(HumanMessage(content=human_prompt))
-        
-        response = self.llm.invoke(messages)
+        return messages, prompt_template
+    
+    @traced
+    def generate_user_story(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> str:
+        """Генерация User Story."""
+        messages, prompt = self._user_story_messages(requirement, context)
+        response = self.llm.invoke(messages, prompt=prompt)
         return response.content
     
-    def generate_use_case(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> str:
-        """Генерация Use Case."""
+    @traced
+    async def agenerate_user_story(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> str:
+        """Асинхронная генерация User Story."""
+        messages, prompt = self._user_story_messages(requirement, context)
+        response = await self.llm.ainvoke(messages, prompt=prompt)
+        return response.content
+    
+    def _use_case_messages(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для генерации Use Case."""
         
         system_prompt = """You are an expert in writing Use Cases.
 Generate a detailed Use Case specification with actors, preconditions, main flow, alternative flows, and postconditions."""
@@ -130,26 +81,37 @@ Generate a Use Case specification."""
             SystemMessage(content=system_prompt),
             HumanMessage(content=human_prompt)
         ]
-        
-        response = self.llm.invoke(messages)
+        return messages, None
+    
+    @traced
+    def generate_use_case(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> str:
+        """Генерация Use Case."""
+        messages, prompt = self._use_case_messages(requirement, context)
+        response = self.llm.invoke(messages, prompt=prompt)
         return response.content
     
-    def generate_rest_api(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> Dict[str, Any]:
-        """Генерация REST API контракта (OpenAPI)."""
+    @traced
+    async def agenerate_use_case(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> str:
+        """Асинхронная генерация Use Case."""
+        messages, prompt = self._use_case_messages(requirement, context)
+        response = await self.llm.ainvoke(messages, prompt=prompt)
+        return response.content
+    
+    def _rest_api_messages(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для генерации REST API контракта."""
         
         # Получить промпт из хранилища
         prompt_template = prompt_store.get_active_prompt("spec_generator", "rest_api")
         
         if prompt_template:
             context_text = json.dumps(context, ensure_ascii=False, indent=2) if context else ""
-            human_prompt = prompt_store.render_prompt(
+            system_prompt, human_prompt = prompt_store.render_parts(
                 prompt_template.id,
                 {
                     "requirement": json.dumps(requirement, ensure_ascii=False, indent=2),
                     "context": context_text
                 }
             )
-            system_prompt = ""
         else:
             # Fallback на встроенный промпт
             system_prompt = """You are an expert in API design.
@@ -165,23 +127,35 @@ Generate OpenAPI 3.0 specification in JSON format."""
         if system_prompt:
             messages.append(SystemMessage(content=system_prompt))
         messages.append(HumanMessage(content=human_prompt))
-        
-        response = self.llm.invoke(messages)
-        content = response.content
-        
-        # Извлечение JSON
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0].strip()
-        
+        return messages, prompt_template
+    
+    @staticmethod
+    def _rest_api_fallback() -> Dict[str, Any]:
+        """OpenAPI контракт по умолчанию."""
+        return {"openapi": "3.0.0", "info": {"title": "API", "version": "1.0.0"}, "paths": {}}
+    
+    @traced
+    def generate_rest_api(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> Dict[str, Any]:
+        """Генерация REST API контракта (OpenAPI)."""
+        messages, prompt = self._rest_api_messages(requirement, context)
         try:
-            return json.loads(content)
-        except:
-            return {"openapi": "3.0.0", "info": {"title": "API", "version": "1.0.0"}, "paths": {}}
+            return invoke_structured(self.llm, messages, OpenAPISpec, prompt=prompt)
+        except StructuredOutputError as e:
+            llm_telemetry.record_fallback(e)
+            return self._rest_api_fallback()
     
-    def generate_grpc_api(self, requirement: Dict[str, Any]) -> str:
-        """Генерация gRPC API (Protocol Buffers)."""
+    @traced
+    async def agenerate_rest_api(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> Dict[str, Any]:
+        """Асинхронная генерация REST API контракта (OpenAPI)."""
+        messages, prompt = self._rest_api_messages(requirement, context)
+        try:
+            return await ainvoke_structured(self.llm, messages, OpenAPISpec, prompt=prompt)
+        except StructuredOutputError as e:
+            llm_telemetry.record_fallback(e)
+            return self._rest_api_fallback()
+    
+    def _grpc_api_messages(self, requirement: Dict[str, Any]) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для генерации gRPC API."""
         
         system_prompt = """You are an expert in gRPC and Protocol Buffers.
 Generate .proto file specification for the requirement."""
@@ -195,12 +169,24 @@ Generate Protocol Buffers specification."""
             SystemMessage(content=system_prompt),
             HumanMessage(content=human_prompt)
         ]
-        
-        response = self.llm.invoke(messages)
+        return messages, None
+    
+    @traced
+    def generate_grpc_api(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> str:
+        """Генерация gRPC API (Protocol Buffers)."""
+        messages, prompt = self._grpc_api_messages(requirement)
+        response = self.llm.invoke(messages, prompt=prompt)
         return response.content
     
-    def generate_async_api(self, requirement: Dict[str, Any]) -> Dict[str, Any]:
-        """Генерация AsyncAPI контракта."""
+    @traced
+    async def agenerate_grpc_api(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> str:
+        """Асинхронная генерация gRPC API (Protocol Buffers)."""
+        messages, prompt = self._grpc_api_messages(requirement)
+        response = await self.llm.ainvoke(messages, prompt=prompt)
+        return response.content
+    
+    def _async_api_messages(self, requirement: Dict[str, Any]) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для генерации AsyncAPI контракта."""
         
         system_prompt = """You are an expert in event-driven APIs.
 Generate AsyncAPI 2.0 specification (JSON format) for the requirement.
@@ -215,20 +201,35 @@ Generate AsyncAPI 2.0 specification in JSON format."""
             SystemMessage(content=system_prompt),
             HumanMessage(content=human_prompt)
         ]
-        
-        response = self.llm.invoke(messages)
-        content = response.content
-        
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        
+        return messages, None
+    
+    @staticmethod
+    def _async_api_fallback() -> Dict[str, Any]:
+        """AsyncAPI контракт по умолчанию."""
+        return {"asyncapi": "2.0.0", "info": {"title": "API", "version": "1.0.0"}, "channels": {}}
+    
+    @traced
+    def generate_async_api(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> Dict[str, Any]:
+        """Генерация AsyncAPI контракта."""
+        messages, prompt = self._async_api_messages(requirement)
         try:
-            return json.loads(content)
-        except:
-            return {"asyncapi": "2.0.0", "info": {"title": "API", "version": "1.0.0"}, "channels": {}}
+            return invoke_structured(self.llm, messages, AsyncAPISpec, prompt=prompt)
+        except StructuredOutputError as e:
+            llm_telemetry.record_fallback(e)
+            return self._async_api_fallback()
     
-    def generate_uml_sequence(self, requirement: Dict[str, Any], components: List[Dict]) -> str:
-        """Генерация UML Sequence диаграммы (PlantUML)."""
+    @traced
+    async def agenerate_async_api(self, requirement: Dict[str, Any], context: Optional[Dict] = None) -> Dict[str, Any]:
+        """Асинхронная генерация AsyncAPI контракта."""
+        messages, prompt = self._async_api_messages(requirement)
+        try:
+            return await ainvoke_structured(self.llm, messages, AsyncAPISpec, prompt=prompt)
+        except StructuredOutputError as e:
+            llm_telemetry.record_fallback(e)
+            return self._async_api_fallback()
+    
+    def _uml_sequence_messages(self, requirement: Dict[str, Any], components: List[Dict]) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для генерации UML Sequence диаграммы."""
         
         system_prompt = """You are an expert in UML diagrams.
 Generate PlantUML sequence diagram code based on the requirement and components."""
@@ -247,12 +248,24 @@ Generate PlantUML sequence diagram code."""
             SystemMessage(content=system_prompt),
             HumanMessage(content=human_prompt)
         ]
-        
-        response = self.llm.invoke(messages)
+        return messages, None
+    
+    @traced
+    def generate_uml_sequence(self, requirement: Dict[str, Any], components: List[Dict]) -> str:
+        """Генерация UML Sequence диаграммы (PlantUML)."""
+        messages, prompt = self._uml_sequence_messages(requirement, components)
+        response = self.llm.invoke(messages, prompt=prompt)
         return response.content
     
-    def generate_uml_er(self, requirement: Dict[str, Any], entities: List[Dict]) -> str:
-        """Генерация UML ER диаграммы (PlantUML)."""
+    @traced
+    async def agenerate_uml_sequence(self, requirement: Dict[str, Any], components: List[Dict]) -> str:
+        """Асинхронная генерация UML Sequence диаграммы (PlantUML)."""
+        messages, prompt = self._uml_sequence_messages(requirement, components)
+        response = await self.llm.ainvoke(messages, prompt=prompt)
+        return response.content
+    
+    def _uml_er_messages(self, requirement: Dict[str, Any], entities: List[Dict]) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для генерации UML ER диаграммы."""
         
         system_prompt = """You are an expert in Entity-Relationship diagrams.
 Generate PlantUML ER diagram code."""
@@ -271,12 +284,24 @@ Generate PlantUML ER diagram code."""
             SystemMessage(content=system_prompt),
             HumanMessage(content=human_prompt)
         ]
-        
-        response = self.llm.invoke(messages)
+        return messages, None
+    
+    @traced
+    def generate_uml_er(self, requirement: Dict[str, Any], entities: List[Dict]) -> str:
+        """Генерация UML ER диаграммы (PlantUML)."""
+        messages, prompt = self._uml_er_messages(requirement, entities)
+        response = self.llm.invoke(messages, prompt=prompt)
         return response.content
     
-    def generate_c4_context(self, requirement: Dict[str, Any], system_context: Dict) -> str:
-        """Генерация C4 Context диаграммы."""
+    @traced
+    async def agenerate_uml_er(self, requirement: Dict[str, Any], entities: List[Dict]) -> str:
+        """Асинхронная генерация UML ER диаграммы (PlantUML)."""
+        messages, prompt = self._uml_er_messages(requirement, entities)
+        response = await self.llm.ainvoke(messages, prompt=prompt)
+        return response.content
+    
+    def _c4_context_messages(self, requirement: Dict[str, Any], system_context: Dict) -> Tuple[List[BaseMessage], Optional[PromptTemplate]]:
+        """Подготовить сообщения для генерации C4 Context диаграммы."""
         
         system_prompt = """You are an expert in C4 model diagrams.
 Generate C4 Context diagram using PlantUML C4-PlantUML syntax."""
@@ -293,8 +318,20 @@ Generate C4 Context diagram code."""
             SystemMessage(content=system_prompt),
             HumanMessage(content=human_prompt)
         ]
-        
-        response = self.llm.invoke(messages)
+        return messages, None
+    
+    @traced
+    def generate_c4_context(self, requirement: Dict[str, Any], system_context: Dict) -> str:
+        """Генерация C4 Context диаграммы."""
+        messages, prompt = self._c4_context_messages(requirement, system_context)
+        response = self.llm.invoke(messages, prompt=prompt)
+        return response.content
+    
+    @traced
+    async def agenerate_c4_context(self, requirement: Dict[str, Any], system_context: Dict) -> str:
+        """Асинхронная генерация C4 Context диаграммы."""
+        messages, prompt = self._c4_context_messages(requirement, system_context)
+        response = await self.llm.ainvoke(messages, prompt=prompt)
         return response.content
     
     def generate_specification(
@@ -310,7 +347,7 @@ Generate C4 Context diagram code."""
             SpecificationType.USE_CASE: self.generate_use_case,
             SpecificationType.REST_API: lambda r, c: json.dumps(self.generate_rest_api(r, c), indent=2),
             SpecificationType.GRPC_API: self.generate_grpc_api,
-            SpecificationType.ASYNC_API: lambda r: json.dumps(self.generate_async_api(r), indent=2),
+            SpecificationType.ASYNC_API: lambda r, c: json.dumps(self.generate_async_api(r, c), indent=2),
         }
         
         generator = generators.get(spec_type)
@@ -318,4 +355,80 @@ Generate C4 Context diagram code."""
             return generator(requirement, context)
         else:
             return f"Specification type {spec_type} not yet implemented"
-
+    
+    async def agenerate_specification(
+        self,
+        spec_type: SpecificationType,
+        requirement: Dict[str, Any],
+        context: Optional[Dict] = None
+    ) -> str:
+        """Асинхронный универсальный метод генерации спецификации."""
+        
+        generators = {
+            SpecificationType.USER_STORY: self.agenerate_user_story,
+            SpecificationType.USE_CASE: self.agenerate_use_case,
+            SpecificationType.REST_API: self.agenerate_rest_api,
+            SpecificationType.GRPC_API: self.agenerate_grpc_api,
+            SpecificationType.ASYNC_API: self.agenerate_async_api,
+        }
+        
+        generator = generators.get(spec_type)
+        if not generator:
+            return f"Specification type {spec_type} not yet implemented"
+        
+        content = await generator(requirement, context)
+        if isinstance(content, dict):
+            return json.dumps(content, indent=2)
+        return content
+    
+    def _streaming_plan(self, spec_type: SpecificationType) -> Optional[Tuple[Callable, Any, Optional[Callable]]]:
+        """Построитель сообщений, схема и результат по умолчанию для потоковой генерации."""
+        plans = {
+            SpecificationType.USER_STORY: (self._user_story_messages, None, None),
+            SpecificationType.USE_CASE: (self._use_case_messages, None, None),
+            SpecificationType.REST_API: (self._rest_api_messages, OpenAPISpec, self._rest_api_fallback),
+            SpecificationType.GRPC_API: (lambda r, c: self._grpc_api_messages(r), None, None),
+            SpecificationType.ASYNC_API: (lambda r, c: self._async_api_messages(r), AsyncAPISpec, self._async_api_fallback),
+        }
+        return plans.get(spec_type)
+    
+    @traced
+    async def astream_specification(
+        self,
+        spec_type: SpecificationType,
+        requirement: Dict[str, Any],
+        context: Optional[Dict] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковая генерация спецификации.
+        
+        Выдает события {"event": "token", "data": "..."} по мере генерации и
+        завершающее {"event": "result", "data": {...}} с разобранным артефактом.
+        """
+        spec_format = SPEC_FORMATS.get(spec_type, "text")
+        plan = self._streaming_plan(spec_type)
+        if not plan:
+            content = f"Specification type {spec_type} not yet implemented"
+            yield {"event": "result", "data": {"content": content, "format": spec_format, "valid": False}}
+            return
+        
+        build_messages, schema, fallback = plan
+        messages, prompt = build_messages(requirement, context)
+        
+        parts: List[str] = []
+        async for text in self.llm.astream(messages, prompt=prompt, schema=schema):
+            parts.append(text)
+            yield {"event": "token", "data": text}
+        
+        content = "".join(parts)
+        valid = True
+        if schema:
+            try:
+                artifact = parse_structured(content, schema)
+            except StructuredOutputError as e:
+                llm_telemetry.record_fallback(e)
+                artifact = fallback()
+                valid = False
+            content = json.dumps(artifact, indent=2)
+        
+        yield {"event": "result", "data": {"content": content, "format": spec_format, "valid": valid}}
@@ -1,14 +1,24 @@
 """API для Генератора спецификаций."""
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import Dict, Any, Optional, List
-from shared.database import get_db
+from typing import Dict, Any, AsyncIterator, Optional, List, Tuple
+from shared.ai_config import ai_settings
+from shared.database import SessionLocal, get_db
 from shared.models import Requirement, Project
 from services.spec_generator.ai_agent import SpecificationGeneratorAgent
-from services.spec_generator.templates import SpecificationType, TemplateManager
+from services.spec_generator.templates import SpecificationType, TemplateManager, SPEC_FORMATS
+from shared.llm_cache import llm_cache
+from shared.llm_telemetry import llm_telemetry
+from shared.precompute import analysis_precompute, requirement_version
+from shared.logging_config import get_logger
+import asyncio
+import json
 import uuid
 
+logger = get_logger(__name__)
+
 router = APIRouter(prefix="/api/specs", tags=["Specification Generator"])
 
 agent = SpecificationGeneratorAgent()
@@ -20,6 +30,7 @@ class GenerateSpecRequest(BaseModel):
     spec_type: str  # user_story, use_case, rest_api, etc.
     context: Optional[Dict[str, Any]] = None
     template_customizations: Optional[Dict[str, Any]] = None
+    refresh: bool = False  # Игнорировать кэш ответов ИИ
 
 
 class GenerateSpecResponse(BaseModel):
@@ -35,12 +46,29 @@ class TemplateResponse(BaseModel):
     description: str
 
 
-@router.post("/generate", response_model=GenerateSpecResponse)
-async def generate_specification(
-    request: GenerateSpecRequest,
-    db: Session = Depends(get_db)
-):
-    """Генерировать спецификацию."""
+def _spec_requirement_data(requirement: Dict[str, Any]) -> Dict[str, Any]:
+    """Данные требования из строки Supabase, передаваемые генератору."""
+    return {
+        "id": str(requirement["id"]),
+        "identifier": requirement["identifier"],
+        "name": requirement["name"],
+        "shall": requirement["shall"],
+        "rationale": requirement["rationale"],
+        "category": requirement["category"],
+        "acceptance_criteria": requirement.get("acceptance_criteria") or []
+    }
+
+
+def _project_context(project: Optional[Project]) -> Dict[str, Any]:
+    """Контекст проекта для генерации."""
+    return {
+        "name": project.name if project else "",
+        "methodology": project.methodology if project else ""
+    }
+
+
+def _load_spec_input(request: GenerateSpecRequest, db: Session) -> Tuple[Dict[str, Any], Dict[str, Any], Requirement]:
+    """Загрузить требование, контекст и запись требования для генерации."""
     # Получить требование
     requirement = db.query(Requirement).filter(
         Requirement.id == request.requirement_id
@@ -52,51 +80,127 @@ async def generate_specification(
     # Получить проект для контекста
     project = db.query(Project).filter(Project.id == requirement.project_id).first()
     
-    req_data = {
-        "id": str(requirement.id),
-        "identifier": requirement.identifier,
-        "name": requirement.name,
-        "shall": requirement.shall,
-        "rationale": requirement.rationale,
-        "category": requirement.category,
-        "acceptance_criteria": requirement.acceptance_criteria or []
-    }
+    row = {column.name: getattr(requirement, column.name) for column in Requirement.__table__.columns}
+    req_data = _spec_requirement_data(row)
     
     context = request.context or {}
-    context["project"] = {
-        "name": project.name if project else "",
-        "methodology": project.methodology if project else ""
-    }
+    context["project"] = _project_context(project)
     
-    # Генерация спецификации
-    try:
-        spec_type = SpecificationType(request.spec_type)
-        content = agent.generate_specification(spec_type, req_data, context)
-        
-        # Определить формат
-        format_map = {
-            SpecificationType.USER_STORY: "text",
-            SpecificationType.USE_CASE: "text",
-            SpecificationType.REST_API: "json",
-            SpecificationType.GRPC_API: "text",
-            SpecificationType.ASYNC_API: "json",
-            SpecificationType.UML_SEQUENCE: "plantuml",
-            SpecificationType.UML_ER: "plantuml",
-            SpecificationType.UML_ACTIVITY: "plantuml",
-            SpecificationType.C4_CONTEXT: "plantuml",
-        }
+    return req_data, context, requirement
+
+
+def _precompute_spec(spec_type: SpecificationType):
+    """Анализ предрасчета: спецификация без пользовательского контекста."""
+    async def analysis(requirement: Dict[str, Any]) -> str:
+        if SessionLocal is None:
+            raise RuntimeError("Database session is not configured")
         
-        spec_format = format_map.get(spec_type, "text")
+        def load_project():
+            db = SessionLocal()
+            try:
+                return _project_context(db.query(Project).filter(Project.id == requirement["project_id"]).first())
+            finally:
+                db.close()
         
-        return GenerateSpecResponse(
-            specification_id=uuid.uuid4(),
-            requirement_id=request.requirement_id,
-            spec_type=request.spec_type,
-            content=content,
-            format=spec_format
-        )
+        context = {"project": await asyncio.to_thread(load_project)}
+        with llm_telemetry.project_scope(requirement.get("project_id")):
+            return await agent.agenerate_specification(spec_type, _spec_requirement_data(requirement), context)
+    
+    return analysis
+
+
+for _spec_type in ai_settings.precompute_spec_types:
+    try:
+        analysis_precompute.register(f"spec:{_spec_type}", _precompute_spec(SpecificationType(_spec_type)))
     except ValueError:
-        raise HTTPException(status_code=400, detail=f"Invalid specification type: {request.spec_type}")
+        logger.warning(f"Unknown specification type in AI_PRECOMPUTE_SPEC_TYPES skipped: {_spec_type}")
+
+
+def _parse_spec_type(value: str) -> SpecificationType:
+    """Разобрать тип спецификации из запроса."""
+    try:
+        return SpecificationType(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid specification type: {value}")
+
+
+@router.post("/generate", response_model=GenerateSpecResponse)
+async def generate_specification(
+    request: GenerateSpecRequest,
+    db: Session = Depends(get_db)
+):
+    """Генерировать спецификацию."""
+    # Пользовательский контекст меняет результат, поэтому предрасчет используется только без него
+    precomputed = not request.context and not request.template_customizations
+    req_data, context, requirement = _load_spec_input(request, db)
+    spec_type = _parse_spec_type(request.spec_type)
+    
+    async def generate() -> str:
+        with llm_telemetry.project_scope(requirement.project_id):
+            return await agent.agenerate_specification(spec_type, req_data, context)
+    
+    # Генерация спецификации
+    with llm_cache.bypass(request.refresh):
+        if precomputed:
+            content = await analysis_precompute.get_or_compute(
+                req_data["id"], f"spec:{spec_type.value}", requirement_version(requirement),
+                generate, refresh=request.refresh
+            )
+        else:
+            content = await generate()
+    
+    return GenerateSpecResponse(
+        specification_id=uuid.uuid4(),
+        requirement_id=request.requirement_id,
+        spec_type=request.spec_type,
+        content=content,
+        format=SPEC_FORMATS.get(spec_type, "text")
+    )
+
+
+def _sse(event: str, data: Any) -> str:
+    """Отформатировать событие Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/generate/stream")
+async def stream_specification(
+    request: GenerateSpecRequest,
+    db: Session = Depends(get_db)
+):
+    """Генерировать спецификацию с потоковой выдачей токенов (SSE)."""
+    req_data, context, requirement = _load_spec_input(request, db)
+    project_id = requirement.project_id
+    spec_type = _parse_spec_type(request.spec_type)
+    specification_id = uuid.uuid4()
+    
+    async def event_stream() -> AsyncIterator[str]:
+        # Контекст запроса не наследуется телом ответа, поэтому обход кэша и проект задаются здесь
+        with llm_cache.bypass(request.refresh), llm_telemetry.project_scope(project_id):
+            yield _sse("start", {
+                "specification_id": str(specification_id),
+                "requirement_id": str(request.requirement_id),
+                "spec_type": request.spec_type,
+            })
+            try:
+                async for item in agent.astream_specification(spec_type, req_data, context):
+                    if item["event"] == "result":
+                        yield _sse("result", {
+                            "specification_id": str(specification_id),
+                            "requirement_id": str(request.requirement_id),
+                            "spec_type": request.spec_type,
+                            **item["data"],
+                        })
+                    else:
+                        yield _sse(item["event"], item["data"])
+            except Exception as e:
+                yield _sse("error", {"error": str(e)})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/templates", response_model=Dict[str, TemplateResponse])
@@ -0,0 +1,20 @@
+"""Схемы машиночитаемых спецификаций, генерируемых ИИ агентом."""
+from pydantic import BaseModel
+from typing import Any, Dict
+
+
+class OpenAPISpec(BaseModel):
+    openapi: str
+    info: Dict[str, Any] = {"title": "API", "version": "1.0.0"}
+    paths: Dict[str, Any] = {}
+    
+    class Config:
+        extra = "allow"
+
+class AsyncAPISpec(BaseModel):
+    asyncapi: str
+    info: Dict[str, Any] = {"title": "API", "version": "1.0.0"}
+    channels: Dict[str, Any] = {}
+    
+    class Config:
+        extra = "allow"
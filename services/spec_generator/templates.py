@@ -19,6 +19,20 @@ class SpecificationType(str, Enum):
     C4_COMPONENT = "c4_component"
 
 
+# Формат результата для каждого типа спецификации
+SPEC_FORMATS = {
+    SpecificationType.USER_STORY: "text",
+    SpecificationType.USE_CASE: "text",
+    SpecificationType.REST_API: "json",
+    SpecificationType.GRPC_API: "text",
+    SpecificationType.ASYNC_API: "json",
+    SpecificationType.UML_SEQUENCE: "plantuml",
+    SpecificationType.UML_ER: "plantuml",
+    SpecificationType.UML_ACTIVITY: "plantuml",
+    SpecificationType.C4_CONTEXT: "plantuml",
+}
+
+
 class TemplateManager:
     """Управление шаблонами спецификаций."""
     
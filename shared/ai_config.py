@@ -1,7 +1,7 @@
 """Общая конфигурация ИИ агентов для всех сервисов."""
 from pydantic_settings import BaseSettings
 from pydantic import Field
-from typing import Optional
+from typing import Dict, List, Optional
 from enum import Enum
 
 
@@ -12,6 +12,7 @@ class ModelProvider(str, Enum):
     OLLAMA = "ollama"
     AZURE_OPENAI = "azure_openai"
     OPENROUTER = "openrouter"
+    REPLAY = "replay"
 
 
 class AISettings(BaseSettings):
@@ -50,30 +51,136 @@ class AISettings(BaseSettings):
     ollama_model: str = Field(default="llama2", validation_alias="AI_OLLAMA_MODEL")
     ollama_temperature: float = Field(default=0.7, validation_alias="AI_OLLAMA_TEMPERATURE")
     
+    # Replay: ответы из записанных кассет (нагрузочные тесты и CI без сети)
+    replay_cassette_dir: str = Field(default="./cassettes", validation_alias="AI_REPLAY_CASSETTE_DIR")
+    replay_mode: str = Field(default="replay", validation_alias="AI_REPLAY_MODE")
+    replay_record_provider: Optional[ModelProvider] = Field(default=None, validation_alias="AI_REPLAY_RECORD_PROVIDER")
+    replay_latency: str = Field(default="synthetic", validation_alias="AI_REPLAY_LATENCY")
+    replay_latency_mean: float = Field(default=1.0, validation_alias="AI_REPLAY_LATENCY_MEAN")
+    replay_latency_stddev: float = Field(default=0.3, validation_alias="AI_REPLAY_LATENCY_STDDEV")
+    replay_completion_tokens_mean: float = Field(default=300.0, validation_alias="AI_REPLAY_COMPLETION_TOKENS_MEAN")
+    replay_completion_tokens_stddev: float = Field(default=100.0, validation_alias="AI_REPLAY_COMPLETION_TOKENS_STDDEV")
+    replay_on_miss: str = Field(default="synthetic", validation_alias="AI_REPLAY_ON_MISS")
+    replay_seed: Optional[int] = Field(default=None, validation_alias="AI_REPLAY_SEED")
+    
+    # HTTP пул соединений LLM клиентов (общий на процесс)
+    http_max_connections: int = Field(default=100, validation_alias="AI_HTTP_MAX_CONNECTIONS")
+    http_max_keepalive: int = Field(default=20, validation_alias="AI_HTTP_MAX_KEEPALIVE")
+    http_keepalive_expiry: float = Field(default=60.0, validation_alias="AI_HTTP_KEEPALIVE_EXPIRY")
+    http_timeout: float = Field(default=120.0, validation_alias="AI_HTTP_TIMEOUT")
+    
+    # Кэш ответов LLM (включается отдельно для каждого агента)
+    cache_ttl: float = Field(default=3600.0, validation_alias="AI_CACHE_TTL")
+    cache_max_entries: int = Field(default=1000, validation_alias="AI_CACHE_MAX_ENTRIES")
+    cache_path: Optional[str] = Field(default=None, validation_alias="AI_CACHE_PATH")
+    
+    # Пакетная обработка (несколько элементов в одном запросе к модели)
+    batch_max_items: int = Field(default=20, validation_alias="AI_BATCH_MAX_ITEMS")
+    batch_max_input_tokens: int = Field(default=6000, validation_alias="AI_BATCH_MAX_INPUT_TOKENS")
+    
+    # Векторные представления требований: local (хэшированные n-граммы, без сети), openai, ollama
+    embedding_provider: str = Field(default="local", validation_alias="AI_EMBEDDING_PROVIDER")
+    embedding_model: Optional[str] = Field(default=None, validation_alias="AI_EMBEDDING_MODEL")
+    embedding_dimension: int = Field(default=1024, validation_alias="AI_EMBEDDING_DIMENSION")
+    embedding_remote_dimension: Optional[int] = Field(default=None, validation_alias="AI_EMBEDDING_REMOTE_DIMENSION")
+    embedding_batch_size: int = Field(default=256, validation_alias="AI_EMBEDDING_BATCH_SIZE")
+    
+    # Бюджет входных токенов агента (промпт больше бюджета не отправляется)
+    max_input_tokens: int = Field(default=16000, validation_alias="AI_MAX_INPUT_TOKENS")
+    summary_chunk_tokens: int = Field(default=3000, validation_alias="AI_SUMMARY_CHUNK_TOKENS")
+    
+    # Ограничения вызовов на пару провайдер/модель (0 - без ограничения)
+    governor_max_concurrency: int = Field(default=0, validation_alias="AI_GOVERNOR_MAX_CONCURRENCY")
+    governor_rpm: int = Field(default=0, validation_alias="AI_GOVERNOR_RPM")
+    governor_tpm: int = Field(default=0, validation_alias="AI_GOVERNOR_TPM")
+    openai_max_concurrency: Optional[int] = Field(default=None, validation_alias="AI_OPENAI_MAX_CONCURRENCY")
+    openai_rpm: Optional[int] = Field(default=None, validation_alias="AI_OPENAI_RPM")
+    openai_tpm: Optional[int] = Field(default=None, validation_alias="AI_OPENAI_TPM")
+    anthropic_max_concurrency: Optional[int] = Field(default=None, validation_alias="AI_ANTHROPIC_MAX_CONCURRENCY")
+    anthropic_rpm: Optional[int] = Field(default=None, validation_alias="AI_ANTHROPIC_RPM")
+    anthropic_tpm: Optional[int] = Field(default=None, validation_alias="AI_ANTHROPIC_TPM")
+    azure_openai_max_concurrency: Optional[int] = Field(default=None, validation_alias="AI_AZURE_OPENAI_MAX_CONCURRENCY")
+    azure_openai_rpm: Optional[int] = Field(default=None, validation_alias="AI_AZURE_OPENAI_RPM")
+    azure_openai_tpm: Optional[int] = Field(default=None, validation_alias="AI_AZURE_OPENAI_TPM")
+    openrouter_max_concurrency: Optional[int] = Field(default=None, validation_alias="AI_OPENROUTER_MAX_CONCURRENCY")
+    openrouter_rpm: Optional[int] = Field(default=None, validation_alias="AI_OPENROUTER_RPM")
+    openrouter_tpm: Optional[int] = Field(default=None, validation_alias="AI_OPENROUTER_TPM")
+    ollama_max_concurrency: Optional[int] = Field(default=None, validation_alias="AI_OLLAMA_MAX_CONCURRENCY")
+    ollama_rpm: Optional[int] = Field(default=None, validation_alias="AI_OLLAMA_RPM")
+    ollama_tpm: Optional[int] = Field(default=None, validation_alias="AI_OLLAMA_TPM")
+    
+    # Хеджирование: дублирующий запрос резервному провайдеру по сроку из перцентиля задержки
+    hedge_percentile: float = Field(default=0.95, validation_alias="AI_HEDGE_PERCENTILE")
+    hedge_min_delay: float = Field(default=1.0, validation_alias="AI_HEDGE_MIN_DELAY")
+    hedge_default_delay: float = Field(default=10.0, validation_alias="AI_HEDGE_DEFAULT_DELAY")
+    hedge_min_samples: int = Field(default=20, validation_alias="AI_HEDGE_MIN_SAMPLES")
+    
+    # Таймаут шага многошаговых эндпоинтов (/api/projects/{id}/analyze, /api/knowledge/import)
+    step_timeout: float = Field(default=120.0, validation_alias="AI_STEP_TIMEOUT")
+    
+    # Фоновый предрасчет анализов требования при создании и изменении через Supabase и после синхронизации с графом
+    precompute: bool = Field(default=False, validation_alias="AI_PRECOMPUTE")
+    precompute_concurrency: int = Field(default=2, validation_alias="AI_PRECOMPUTE_CONCURRENCY")
+    precompute_max_age: float = Field(default=86400.0, validation_alias="AI_PRECOMPUTE_MAX_AGE")
+    precompute_max_entries: int = Field(default=5000, validation_alias="AI_PRECOMPUTE_MAX_ENTRIES")
+    precompute_spec_types: List[str] = Field(default_factory=lambda: ["user_story"], validation_alias="AI_PRECOMPUTE_SPEC_TYPES")
+    
+    # Кэш промптов SupabasePromptStore: интервал проверки изменений и сброс по Supabase Realtime
+    prompt_store_ttl: float = Field(default=60.0, validation_alias="AI_PROMPT_STORE_TTL")
+    prompt_store_realtime: bool = Field(default=False, validation_alias="AI_PROMPT_STORE_REALTIME")
+    # Файл снимка промптов для быстрого старта без Supabase
+    prompt_snapshot_path: Optional[str] = Field(default=None, validation_alias="AI_PROMPT_SNAPSHOT_PATH")
+    
+    # Кэширование статического префикса промпта провайдером (Anthropic cache_control)
+    prompt_cache: bool = Field(default=True, validation_alias="AI_PROMPT_CACHE")
+    
+    # JSON режим провайдера для структурированных ответов агентов
+    structured_output: bool = Field(default=True, validation_alias="AI_STRUCTURED_OUTPUT")
+    
+    # Телеметрия вызовов LLM
+    telemetry_path: Optional[str] = Field(default=None, validation_alias="AI_TELEMETRY_PATH")
+    token_prices: Dict[str, List[float]] = Field(default_factory=dict, validation_alias="AI_MODEL_PRICES")
+    
     # Настройки для разных агентов
     # Project Admin
     project_admin_provider: Optional[ModelProvider] = Field(default=None, validation_alias="AI_PROJECT_ADMIN_PROVIDER")
     project_admin_model: Optional[str] = Field(default=None, validation_alias="AI_PROJECT_ADMIN_MODEL")
     project_admin_api_key: Optional[str] = Field(default=None, validation_alias="AI_PROJECT_ADMIN_API_KEY")
     project_admin_temperature: Optional[float] = Field(default=None, validation_alias="AI_PROJECT_ADMIN_TEMPERATURE")
+    project_admin_cache: bool = Field(default=False, validation_alias="AI_PROJECT_ADMIN_CACHE")
+    project_admin_fallback_provider: Optional[ModelProvider] = Field(default=None, validation_alias="AI_PROJECT_ADMIN_FALLBACK_PROVIDER")
+    project_admin_hedge: bool = Field(default=False, validation_alias="AI_PROJECT_ADMIN_HEDGE")
+    project_admin_max_input_tokens: Optional[int] = Field(default=None, validation_alias="AI_PROJECT_ADMIN_MAX_INPUT_TOKENS")
     
     # Requirement Processor
     requirement_processor_provider: Optional[ModelProvider] = Field(default=None, validation_alias="AI_REQUIREMENT_PROCESSOR_PROVIDER")
     requirement_processor_model: Optional[str] = Field(default=None, validation_alias="AI_REQUIREMENT_PROCESSOR_MODEL")
     requirement_processor_api_key: Optional[str] = Field(default=None, validation_alias="AI_REQUIREMENT_PROCESSOR_API_KEY")
     requirement_processor_temperature: Optional[float] = Field(default=None, validation_alias="AI_REQUIREMENT_PROCESSOR_TEMPERATURE")
+    requirement_processor_cache: bool = Field(default=False, validation_alias="AI_REQUIREMENT_PROCESSOR_CACHE")
+    requirement_processor_fallback_provider: Optional[ModelProvider] = Field(default=None, validation_alias="AI_REQUIREMENT_PROCESSOR_FALLBACK_PROVIDER")
+    requirement_processor_hedge: bool = Field(default=False, validation_alias="AI_REQUIREMENT_PROCESSOR_HEDGE")
+    requirement_processor_max_input_tokens: Optional[int] = Field(default=None, validation_alias="AI_REQUIREMENT_PROCESSOR_MAX_INPUT_TOKENS")
     
     # Knowledge Base
     knowledge_base_provider: Optional[ModelProvider] = Field(default=None, validation_alias="AI_KNOWLEDGE_BASE_PROVIDER")
     knowledge_base_model: Optional[str] = Field(default=None, validation_alias="AI_KNOWLEDGE_BASE_MODEL")
     knowledge_base_api_key: Optional[str] = Field(default=None, validation_alias="AI_KNOWLEDGE_BASE_API_KEY")
     knowledge_base_temperature: Optional[float] = Field(default=None, validation_alias="AI_KNOWLEDGE_BASE_TEMPERATURE")
+    knowledge_base_cache: bool = Field(default=False, validation_alias="AI_KNOWLEDGE_BASE_CACHE")
+    knowledge_base_fallback_provider: Optional[ModelProvider] = Field(default=None, validation_alias="AI_KNOWLEDGE_BASE_FALLBACK_PROVIDER")
+    knowledge_base_hedge: bool = Field(default=False, validation_alias="AI_KNOWLEDGE_BASE_HEDGE")
+    knowledge_base_max_input_tokens: Optional[int] = Field(default=None, validation_alias="AI_KNOWLEDGE_BASE_MAX_INPUT_TOKENS")
     
     # Spec Generator
     spec_generator_provider: Optional[ModelProvider] = Field(default=None, validation_alias="AI_SPEC_GENERATOR_PROVIDER")
     spec_generator_model: Optional[str] = Field(default=None, validation_alias="AI_SPEC_GENERATOR_MODEL")
     spec_generator_api_key: Optional[str] = Field(default=None, validation_alias="AI_SPEC_GENERATOR_API_KEY")
     spec_generator_temperature: Optional[float] = Field(default=None, validation_alias="AI_SPEC_GENERATOR_TEMPERATURE")
+    spec_generator_cache: bool = Field(default=False, validation_alias="AI_SPEC_GENERATOR_CACHE")
+    spec_generator_fallback_provider: Optional[ModelProvider] = Field(default=None, validation_alias="AI_SPEC_GENERATOR_FALLBACK_PROVIDER")
+    spec_generator_hedge: bool = Field(default=False, validation_alias="AI_SPEC_GENERATOR_HEDGE")
+    spec_generator_max_input_tokens: Optional[int] = Field(default=None, validation_alias="AI_SPEC_GENERATOR_MAX_INPUT_TOKENS")
     
     model_config = {
         "env_file": ".env",
@@ -120,12 +227,56 @@ class AISettings(BaseSettings):
         
         return config
     
+    def get_provider_config(self, provider: ModelProvider, temperature: Optional[float] = None) -> dict:
+        """Получить конфигурацию провайдера с моделью и ключом по умолчанию."""
+        config = {
+            "provider": provider,
+            "model": self._get_default_model(provider),
+            "temperature": temperature if temperature is not None else self._get_default_temperature(provider),
+            "api_key": self._get_api_key(provider),
+        }
+        base_url = self._get_base_url(provider)
+        if base_url:
+            config["base_url"] = base_url
+        config.update(self._get_extra_params(provider))
+        return config
+    
+    def get_fallback_config_for_agent(self, agent_name: str) -> Optional[dict]:
+        """Получить конфигурацию резервного провайдера агента (None - не задан)."""
+        provider = getattr(self, f"{agent_name}_fallback_provider", None)
+        if provider is None:
+            return None
+        return self.get_provider_config(provider, getattr(self, f"{agent_name}_temperature", None))
+    
+    def is_hedge_enabled(self, agent_name: str) -> bool:
+        """Включено ли хеджирование запросов агента."""
+        return bool(getattr(self, f"{agent_name}_hedge", False))
+    
+    def get_input_budget(self, agent_name: str) -> int:
+        """Получить бюджет входных токенов агента (агент-специфичный или общий)."""
+        budget = getattr(self, f"{agent_name}_max_input_tokens", None)
+        return budget if budget is not None else self.max_input_tokens
+    
+    def is_cache_enabled(self, agent_name: str) -> bool:
+        """Включен ли кэш ответов LLM для агента."""
+        return bool(getattr(self, f"{agent_name}_cache", False))
+    
+    def get_limits_for_provider(self, provider: ModelProvider) -> dict:
+        """Получить лимиты вызовов для провайдера (провайдер-специфичные или общие)."""
+        name = getattr(provider, "value", provider)
+        limits = {}
+        for limit in ("max_concurrency", "rpm", "tpm"):
+            value = getattr(self, f"{name}_{limit}", None)
+            limits[limit] = value if value is not None else getattr(self, f"governor_{limit}")
+        return limits
+    
     def _get_default_model(self, provider: ModelProvider) -> str:
         """Получить модель по умолчанию для провайдера."""
         defaults = {
             ModelProvider.OPENAI: self.openai_model,
             ModelProvider.ANTHROPIC: self.anthropic_model,
             ModelProvider.OLLAMA: self.ollama_model,
+            ModelProvider.REPLAY: "replay",
         }
         return defaults.get(provider, self.openai_model)
     
@@ -146,6 +297,7 @@ class AISettings(BaseSettings):
             ModelProvider.AZURE_OPENAI: self.azure_openai_api_key,
             ModelProvider.OPENROUTER: self.openrouter_api_key,
             ModelProvider.OLLAMA: None,  # Ollama не требует API ключ
+            ModelProvider.REPLAY: None,
         }
         return keys.get(provider)
     
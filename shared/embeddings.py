@@ -0,0 +1,153 @@
+"""Провайдеры векторных представлений текста: локальный (хэшированные n-граммы) и удаленные."""
+import asyncio
+from typing import Any, List
+
+import numpy as np
+
+from shared.ai_config import AISettings, ai_settings
+from shared.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Провайдеры
+LOCAL = "local"
+OPENAI = "openai"
+OLLAMA = "ollama"
+
+# Множители полиномиального хэша и финального перемешивания (splitmix64)
+_HASH_PRIME = np.uint64(1099511628211)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+class EmbeddingProvider:
+    """Базовый провайдер векторных представлений."""
+    
+    name = "base"
+    # Векторы - частоты признаков, хранилище взвешивает их IDF по корпусу
+    corpus_weighted = False
+    
+    def __init__(self, dimension: int, batch_size: int = 256):
+        """Инициализация провайдера."""
+        self.dimension = dimension
+        self.batch_size = batch_size
+    
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+    
+    async def _aembed_batch(self, texts: List[str]) -> np.ndarray:
+        return await asyncio.to_thread(self._embed_batch, texts)
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Векторы текстов (матрица float32 размером len(texts) x dimension), пакетами по batch_size."""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        batches = [self._embed_batch(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)]
+        return np.vstack(batches).astype(np.float32, copy=False)
+    
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        """Асинхронная версия embed."""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        batches = [await self._aembed_batch(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)]
+        return np.vstack(batches).astype(np.float32, copy=False)
+
+
+class HashingEmbeddings(EmbeddingProvider):
+    """
+    Локальные векторы: символьные n-граммы, хэшированные в фиксированное число признаков.
+    
+    Частоты сглаживаются логарифмом, IDF применяет хранилище по корпусу проекта.
+    Весь пакет считается векторно в NumPy, без словаря и обучения.
+    """
+    
+    name = LOCAL
+    corpus_weighted = True
+    
+    def __init__(self, dimension: int = 1024, batch_size: int = 256, min_n: int = 3, max_n: int = 5):
+        """Инициализация провайдера."""
+        super().__init__(dimension, batch_size)
+        self.min_n = min_n
+        self.max_n = max_n
+    
+    @staticmethod
+    def _codes(text: str) -> np.ndarray:
+        """Коды символов нормализованного текста (с пробелами по краям для n-грамм границ слов)."""
+        normalized = " " + " ".join(str(text).lower().split()) + " "
+        return np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        codes = [self._codes(text) for text in texts]
+        lengths = np.array([len(c) for c in codes])
+        chars = np.concatenate(codes)
+        # Номер текста для каждой позиции общего массива символов
+        owner = np.repeat(np.arange(len(texts)), lengths)
+        counts = np.zeros(len(texts) * self.dimension, dtype=np.float64)
+        
+        with np.errstate(over="ignore"):
+            for n in range(self.min_n, self.max_n + 1):
+                size = len(chars) - n + 1
+                if size <= 0:
+                    continue
+                hashes = np.full(size, n, dtype=np.uint64)
+                for offset in range(n):
+                    hashes = hashes * _HASH_PRIME + chars[offset:offset + size]
+                # n-граммы на стыке двух текстов не учитываются
+                inside = owner[:size] == owner[n - 1:n - 1 + size]
+                hashes = hashes[inside]
+                hashes ^= hashes >> np.uint64(31)
+                hashes *= _MIX_1
+                hashes ^= hashes >> np.uint64(29)
+                hashes *= _MIX_2
+                hashes ^= hashes >> np.uint64(32)
+                index = owner[:size][inside] * self.dimension + (hashes % np.uint64(self.dimension)).astype(np.int64)
+                counts += np.bincount(index, minlength=counts.size)
+        
+        return np.log1p(counts.reshape(len(texts), self.dimension)).astype(np.float32)
+
+
+class LangChainEmbeddings(EmbeddingProvider):
+    """Удаленный провайдер через интерфейс Embeddings LangChain."""
+    
+    def __init__(self, embeddings: Any, name: str, dimension: int, batch_size: int = 256):
+        """Инициализация провайдера."""
+        super().__init__(dimension, batch_size)
+        self.embeddings = embeddings
+        self.name = name
+    
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+    
+    async def _aembed_batch(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(await self.embeddings.aembed_documents(texts), dtype=np.float32)
+
+
+def create_embedding_provider(settings: AISettings = ai_settings) -> EmbeddingProvider:
+    """Создать провайдер векторных представлений по настройкам (при ошибке - локальный)."""
+    provider = settings.embedding_provider
+    try:
+        if provider == OPENAI:
+            from langchain_openai import OpenAIEmbeddings
+            if not settings.openai_api_key:
+                raise ValueError("OpenAI API key not configured")
+            model = settings.embedding_model or "text-embedding-3-small"
+            params = {"model": model, "api_key": settings.openai_api_key, "chunk_size": settings.embedding_batch_size}
+            if settings.embedding_remote_dimension:
+                params["dimensions"] = settings.embedding_remote_dimension
+            embeddings = OpenAIEmbeddings(**params)
+        elif provider == OLLAMA:
+            from langchain_community.embeddings import OllamaEmbeddings
+            model = settings.embedding_model or settings.ollama_model
+            embeddings = OllamaEmbeddings(base_url=settings.ollama_base_url, model=model)
+        elif provider != LOCAL:
+            raise ValueError(f"Unsupported embedding provider: {provider}")
+        else:
+            embeddings = None
+        
+        if embeddings is not None:
+            dimension = settings.embedding_remote_dimension or 0
+            return LangChainEmbeddings(embeddings, provider, dimension, settings.embedding_batch_size)
+    except (ImportError, ValueError) as e:
+        logger.warning(f"Embedding provider {provider} is not available, using local embeddings: {e}")
+    
+    return HashingEmbeddings(dimension=settings.embedding_dimension, batch_size=settings.embedding_batch_size)
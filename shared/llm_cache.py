@@ -0,0 +1,183 @@
+"""Кэш ответов LLM: in-memory LRU с TTL и опциональный SQLite уровень."""
+import contextvars
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from shared.ai_config import ai_settings
+from shared.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Флаг обхода кэша для текущего запроса (наследуется asyncio задачами)
+_bypass: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+
+def make_cache_key(config: dict, messages: List[Any], prompt_version: Optional[str] = None) -> str:
+    """Ключ кэша: хэш провайдера, модели, температуры, версии промпта и сообщений."""
+    payload = {
+        "provider": str(getattr(config.get("provider"), "value", config.get("provider"))),
+        "model": config.get("model"),
+        "temperature": config.get("temperature"),
+        "prompt_version": prompt_version or "builtin",
+        "messages": [[getattr(m, "type", "human"), getattr(m, "content", m)] for m in messages],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Двухуровневый кэш ответов LLM."""
+    
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600.0, path: Optional[str] = None):
+        """
+        Инициализация кэша.
+        
+        Args:
+            max_entries: Максимальный размер in-memory уровня
+            ttl: Время жизни записи в секундах
+            path: Путь к SQLite файлу (None - без персистентного уровня)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "bypassed": 0}
+        
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"LLM disk cache disabled: {e}")
+                self._db = None
+    
+    @staticmethod
+    def is_bypassed() -> bool:
+        """Проверить, отключен ли кэш для текущего запроса."""
+        return _bypass.get()
+    
+    @contextmanager
+    def bypass(self, enabled: bool = True):
+        """Не читать кэш внутри блока (свежие ответы все равно записываются)."""
+        token = _bypass.set(enabled)
+        try:
+            yield
+        finally:
+            _bypass.reset(token)
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Получить запись из кэша."""
+        if self.is_bypassed():
+            self._count("bypassed")
+            return None
+        
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                created_at, value = item
+                if now - created_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+        
+        value = self._disk_get(key, now)
+        if value is not None:
+            self._remember(key, value, now)
+            self._count("disk_hits")
+            return value
+        
+        self._count("misses")
+        return None
+    
+    def set(self, key: str, value: Dict[str, Any]):
+        """Записать ответ в кэш."""
+        now = time.time()
+        self._remember(key, value, now)
+        self._disk_set(key, value, now)
+        self._count("writes")
+    
+    def _remember(self, key: str, value: Dict[str, Any], created_at: float):
+        """Записать в in-memory уровень с вытеснением LRU."""
+        with self._lock:
+            self._memory[key] = (created_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+    
+    def _disk_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        """Прочитать запись из SQLite уровня."""
+        if not self._db:
+            return None
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+            if row and now - row[1] < self.ttl:
+                return json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"LLM disk cache read failed: {e}")
+        return None
+    
+    def _disk_set(self, key: str, value: Dict[str, Any], created_at: float):
+        """Записать запись в SQLite уровень."""
+        if not self._db:
+            return
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False, default=str), created_at),
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM disk cache write failed: {e}")
+    
+    def _count(self, name: str):
+        """Увеличить счетчик."""
+        with self._lock:
+            self.counters[name] += 1
+    
+    def clear(self):
+        """Очистить оба уровня кэша."""
+        with self._lock:
+            self._memory.clear()
+            if self._db:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Статистика попаданий и промахов."""
+        with self._lock:
+            counters = dict(self.counters)
+            entries = len(self._memory)
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        return {
+            **counters,
+            "memory_entries": entries,
+            "disk_enabled": self._db is not None,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Глобальный экземпляр
+llm_cache = LLMCache(
+    max_entries=ai_settings.cache_max_entries,
+    ttl=ai_settings.cache_ttl,
+    path=ai_settings.cache_path,
+)
@@ -0,0 +1,604 @@
+"""Общий реестр LLM клиентов с переиспользованием HTTP соединений."""
+import asyncio
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from langchain_anthropic import ChatAnthropic
+from langchain_community.chat_models import ChatOllama
+from langchain_core.messages import AIMessage
+from langchain_openai import ChatOpenAI
+
+from shared.ai_config import AISettings, ModelProvider, ai_settings
+from shared.llm_cache import llm_cache, make_cache_key
+from shared.llm_governor import ProviderGovernor, llm_governors
+from shared.llm_hedging import HedgePolicy, LatencyTracker, is_failover_error
+from shared.llm_replay import RECORD, CassetteStore, ReplayChatModel
+from shared.llm_telemetry import llm_telemetry, prompt_version
+from shared.prompt_cache import mark_cacheable_prefix
+from shared.structured_output import StructuredOutputError, native_json_kwargs, parse_structured
+from shared.token_budget import token_budget
+from shared.tokens import count_messages_tokens
+from shared.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+def _http_limits(settings: AISettings) -> httpx.Limits:
+    """Лимиты пула HTTP соединений."""
+    return httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive,
+        keepalive_expiry=settings.http_keepalive_expiry,
+    )
+
+
+def create_llm(config: dict, settings: AISettings = ai_settings) -> Tuple[Any, List[Any]]:
+    """
+    Создать LLM на основе конфигурации.
+    
+    Returns:
+        Кортеж (llm, http_clients) - http_clients нужно закрыть при завершении работы
+    """
+    provider = config["provider"]
+    model = config["model"]
+    temperature = config["temperature"]
+    api_key = config.get("api_key")
+    base_url = config.get("base_url")
+    
+    # OpenAI-совместимые провайдеры получают общий пул keep-alive соединений
+    http_clients: List[Any] = []
+    pool_params: Dict[str, Any] = {}
+    if provider in (ModelProvider.OPENAI, ModelProvider.AZURE_OPENAI, ModelProvider.OPENROUTER):
+        timeout = httpx.Timeout(settings.http_timeout)
+        sync_client = httpx.Client(limits=_http_limits(settings), timeout=timeout)
+        async_client = httpx.AsyncClient(limits=_http_limits(settings), timeout=timeout)
+        http_clients = [sync_client, async_client]
+        pool_params = {"http_client": sync_client, "http_async_client": async_client}
+    
+    if provider == ModelProvider.OPENAI:
+        params = {
+            "model": model,
+            "api_key": api_key,
+            "temperature": temperature,
+            **pool_params,
+        }
+        if base_url:
+            params["base_url"] = base_url
+        return ChatOpenAI(**params), http_clients
+    
+    elif provider == ModelProvider.ANTHROPIC:
+        # SDK Anthropic держит собственный пул соединений на экземпляр клиента
+        return ChatAnthropic(
+            model=model,
+            anthropic_api_key=api_key,
+            temperature=temperature,
+            default_request_timeout=settings.http_timeout,
+        ), http_clients
+    
+    elif provider == ModelProvider.AZURE_OPENAI:
+        from langchain_openai import AzureChatOpenAI
+        return AzureChatOpenAI(
+            azure_endpoint=config.get("azure_endpoint"),
+            azure_deployment=config.get("azure_deployment", model),
+            api_version=config.get("api_version", "2024-02-15-preview"),
+            api_key=api_key,
+            temperature=temperature,
+            **pool_params,
+        ), http_clients
+    
+    elif provider == ModelProvider.OPENROUTER:
+        # OpenRouter использует OpenAI-совместимый API
+        return ChatOpenAI(
+            model=model,
+            api_key=api_key,
+            base_url=base_url or "https://openrouter.ai/api/v1",
+            temperature=temperature,
+            **pool_params,
+        ), http_clients
+    
+    elif provider == ModelProvider.OLLAMA:
+        return ChatOllama(
+            model=model,
+            base_url=base_url,
+            temperature=temperature,
+        ), http_clients
+    
+    elif provider == ModelProvider.REPLAY:
+        # В режиме записи запросы уходят реальному провайдеру, ответы пишутся в кассеты
+        recorder = None
+        if settings.replay_mode == RECORD:
+            if settings.replay_record_provider in (None, ModelProvider.REPLAY):
+                raise ValueError("AI_REPLAY_RECORD_PROVIDER must name a real provider in record mode")
+            recorder, http_clients = create_llm(settings.get_provider_config(settings.replay_record_provider), settings)
+        return ReplayChatModel(
+            store=CassetteStore(settings.replay_cassette_dir),
+            mode=settings.replay_mode,
+            recorder=recorder,
+            latency=settings.replay_latency,
+            latency_mean=settings.replay_latency_mean,
+            latency_stddev=settings.replay_latency_stddev,
+            completion_tokens_mean=settings.replay_completion_tokens_mean,
+            completion_tokens_stddev=settings.replay_completion_tokens_stddev,
+            on_miss=settings.replay_on_miss,
+            seed=settings.replay_seed,
+        ), http_clients
+    
+    else:
+        return ChatOpenAI(
+            model=model or "gpt-4-turbo-preview",
+            api_key=api_key,
+            temperature=temperature,
+        ), http_clients
+
+
+def config_key(config: dict) -> Tuple:
+    """Ключ конфигурации LLM для реестра."""
+    return tuple(sorted((k, str(v)) for k, v in config.items()))
+
+
+class LLMClient:
+    """Долгоживущий LLM клиент с учетом загрузки."""
+    
+    def __init__(
+        self,
+        config: dict,
+        llm: Any,
+        http_clients: Optional[List[Any]] = None,
+        governor: Optional[ProviderGovernor] = None
+    ):
+        """Инициализация клиента."""
+        self.config = config
+        self.llm = llm
+        self.http_clients = http_clients or []
+        self.governor = governor
+        self.provider = str(getattr(config["provider"], "value", config["provider"]))
+        self.model = config["model"]
+        self.agents: set = set()
+        self.created_at = time.time()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_calls = 0
+        self.failed_calls = 0
+        self.latency = LatencyTracker()
+        self._lock = threading.Lock()
+    
+    def _enter(self) -> float:
+        """Учесть начало вызова."""
+        with self._lock:
+            self.in_flight += 1
+            self.total_calls += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return time.monotonic()
+    
+    def _exit(self, failed: bool, started: float):
+        """Учесть завершение вызова."""
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                self.failed_calls += 1
+        if not failed:
+            self.latency.record(time.monotonic() - started)
+    
+    def _slot(self, messages: List[Any]):
+        """Слот ограничителя для синхронного вызова (вызовы ждут в очереди, а не падают)."""
+        if self.governor is None:
+            return nullcontext()
+        return self.governor.slot(count_messages_tokens(messages))
+    
+    def _aslot(self, messages: List[Any]):
+        """Слот ограничителя для асинхронного вызова."""
+        if self.governor is None:
+            return nullcontext()
+        return self.governor.aslot(count_messages_tokens(messages))
+    
+    def invoke(
+        self,
+        messages: List[Any],
+        cache: bool = False,
+        prompt_version: Optional[str] = None,
+        agent: Optional[str] = None,
+        schema: Any = None,
+        **kwargs
+    ) -> Any:
+        """Синхронный вызов модели (schema - ожидаемая схема ответа для JSON режима провайдера)."""
+        key = make_cache_key(self.config, messages, prompt_version) if cache else None
+        if key:
+            cached = llm_cache.get(key)
+            if cached is not None and self._valid(cached["content"], schema):
+                self._record(messages, agent, prompt_version, cache_hit=True)
+                return self._cached_response(cached)
+        
+        with self._slot(messages):
+            started = self._enter()
+            response = None
+            failed = True
+            try:
+                response = self.llm.invoke(mark_cacheable_prefix(self.provider, messages), **self._params(messages, schema, kwargs))
+                failed = False
+            finally:
+                self._exit(failed, started)
+                self._record(messages, agent, prompt_version, started=started, response=response, failed=failed)
+        
+        # В кэш попадают только ответы, прошедшие проверку схемой (иначе исправление получало бы тот же ответ)
+        if key and self._valid(response.content, schema):
+            llm_cache.set(key, {"content": response.content})
+        return response
+    
+    async def ainvoke(
+        self,
+        messages: List[Any],
+        cache: bool = False,
+        prompt_version: Optional[str] = None,
+        agent: Optional[str] = None,
+        schema: Any = None,
+        **kwargs
+    ) -> Any:
+        """Асинхронный вызов модели."""
+        key = make_cache_key(self.config, messages, prompt_version) if cache else None
+        if key:
+            cached = await self._acache_get(key)
+            if cached is not None and self._valid(cached["content"], schema):
+                self._record(messages, agent, prompt_version, cache_hit=True)
+                return self._cached_response(cached)
+        
+        async with self._aslot(messages):
+            started = self._enter()
+            response = None
+            failed = True
+            try:
+                response = await self.llm.ainvoke(
+                    mark_cacheable_prefix(self.provider, messages), **self._params(messages, schema, kwargs)
+                )
+                failed = False
+            finally:
+                self._exit(failed, started)
+                self._record(messages, agent, prompt_version, started=started, response=response, failed=failed)
+        
+        if key and self._valid(response.content, schema):
+            await self._acache_set(key, {"content": response.content})
+        return response
+    
+    async def astream(
+        self,
+        messages: List[Any],
+        cache: bool = False,
+        prompt_version: Optional[str] = None,
+        agent: Optional[str] = None,
+        schema: Any = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """Потоковый вызов модели: выдает текстовые фрагменты по мере генерации."""
+        key = make_cache_key(self.config, messages, prompt_version) if cache else None
+        if key:
+            cached = await self._acache_get(key)
+            if cached is not None and self._valid(cached["content"], schema):
+                self._record(messages, agent, prompt_version, cache_hit=True)
+                yield cached["content"]
+                return
+        
+        parts: List[str] = []
+        async with self._aslot(messages):
+            started = self._enter()
+            failed = True
+            try:
+                async for chunk in self.llm.astream(
+                    mark_cacheable_prefix(self.provider, messages), **self._params(messages, schema, kwargs)
+                ):
+                    text = chunk.content if isinstance(chunk.content, str) else ""
+                    if text:
+                        parts.append(text)
+                        yield text
+                failed = False
+            finally:
+                self._exit(failed, started)
+                self._record(
+                    messages, agent, prompt_version,
+                    started=started, failed=failed, completion_text="".join(parts)
+                )
+        
+        content = "".join(parts)
+        if key and self._valid(content, schema):
+            await self._acache_set(key, {"content": content})
+    
+    @staticmethod
+    async def _acache_get(key: str) -> Optional[Dict[str, Any]]:
+        """Прочитать кэш (дисковый уровень - вне event loop)."""
+        if llm_cache.path:
+            return await asyncio.to_thread(llm_cache.get, key)
+        return llm_cache.get(key)
+    
+    @staticmethod
+    async def _acache_set(key: str, value: Dict[str, Any]):
+        """Записать кэш (дисковый уровень - вне event loop)."""
+        if llm_cache.path:
+            await asyncio.to_thread(llm_cache.set, key, value)
+        else:
+            llm_cache.set(key, value)
+    
+    @staticmethod
+    def _valid(content: str, schema: Any) -> bool:
+        """Ответ можно кэшировать и отдавать из кэша: без схемы - всегда, со схемой - если он разбирается."""
+        if schema is None:
+            return True
+        try:
+            parse_structured(content, schema)
+            return True
+        except StructuredOutputError:
+            return False
+    
+    def _params(self, messages: List[Any], schema: Any, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Параметры вызова с JSON режимом этого провайдера."""
+        if schema is None:
+            return kwargs
+        return {**native_json_kwargs(self.config["provider"], messages, schema), **kwargs}
+    
+    def _record(
+        self,
+        messages: List[Any],
+        agent: Optional[str],
+        prompt_version: Optional[str],
+        started: Optional[float] = None,
+        response: Any = None,
+        failed: bool = False,
+        cache_hit: bool = False,
+        completion_text: Optional[str] = None
+    ):
+        """Передать вызов в телеметрию."""
+        llm_telemetry.record_call(
+            self.provider,
+            self.model,
+            messages,
+            response=response,
+            latency=time.monotonic() - started if started is not None else 0.0,
+            agent=agent,
+            prompt_version=prompt_version,
+            cache_hit=cache_hit,
+            failed=failed,
+            completion_text=completion_text,
+        )
+    
+    @staticmethod
+    def _cached_response(cached: Dict[str, Any]) -> AIMessage:
+        """Собрать ответ модели из записи кэша."""
+        return AIMessage(content=cached["content"], response_metadata={"cache_hit": True})
+    
+    def stats(self) -> Dict[str, Any]:
+        """Статистика использования клиента."""
+        stats = {
+            "provider": self.provider,
+            "model": self.model,
+            "temperature": self.config.get("temperature"),
+            "agents": sorted(self.agents),
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "total_calls": self.total_calls,
+            "failed_calls": self.failed_calls,
+            **self.latency.stats(),
+            "uptime_seconds": round(time.time() - self.created_at, 1),
+        }
+        if isinstance(self.llm, ReplayChatModel):
+            stats["replay"] = self.llm.stats()
+        return stats
+    
+    async def aclose(self):
+        """Закрыть HTTP соединения клиента."""
+        for http_client in self.http_clients:
+            try:
+                if isinstance(http_client, httpx.AsyncClient):
+                    await http_client.aclose()
+                else:
+                    http_client.close()
+            except Exception as e:
+                logger.warning(f"Error closing LLM HTTP client: {e}")
+
+
+class AgentLLM:
+    """Общий LLM клиент, привязанный к конкретному агенту."""
+    
+    def __init__(
+        self,
+        client: LLMClient,
+        agent_name: str,
+        cache_enabled: bool = False,
+        fallback: Optional[LLMClient] = None,
+        policy: Optional[HedgePolicy] = None
+    ):
+        """
+        Инициализация привязки.
+        
+        Args:
+            client: Основной клиент
+            agent_name: Имя агента
+            cache_enabled: Использовать кэш ответов
+            fallback: Клиент резервного провайдера (None - без переключения)
+            policy: Политика хеджирования
+        """
+        self.client = client
+        self.agent_name = agent_name
+        self.cache_enabled = cache_enabled
+        self.fallback = fallback
+        self.policy = policy or HedgePolicy()
+    
+    @property
+    def config(self) -> dict:
+        """Конфигурация LLM агента."""
+        return self.client.config
+    
+    def invoke(self, messages: List[Any], prompt: Any = None, **kwargs) -> Any:
+        """Синхронный вызов модели от имени агента (без хеджирования, только переключение)."""
+        token_budget.check(self.agent_name, messages)
+        params = {
+            "cache": self.cache_enabled,
+            "prompt_version": prompt_version(prompt),
+            "agent": self.agent_name,
+            **kwargs
+        }
+        try:
+            return self.client.invoke(messages, **params)
+        except Exception as e:
+            if self.fallback is None or not is_failover_error(e):
+                raise
+            self._log_failover(e)
+            return self.fallback.invoke(messages, **params)
+    
+    async def ainvoke(self, messages: List[Any], prompt: Any = None, **kwargs) -> Any:
+        """Асинхронный вызов модели от имени агента."""
+        token_budget.check(self.agent_name, messages)
+        params = {
+            "cache": self.cache_enabled,
+            "prompt_version": prompt_version(prompt),
+            "agent": self.agent_name,
+            **kwargs
+        }
+        if self.fallback is None:
+            return await self.client.ainvoke(messages, **params)
+        
+        primary = asyncio.create_task(self.client.ainvoke(messages, **params))
+        try:
+            if self.policy.hedge:
+                done, _ = await asyncio.wait({primary}, timeout=self.policy.deadline(self.client.latency))
+                if not done:
+                    return await self._race(primary, messages, params)
+            
+            try:
+                return await primary
+            except Exception as e:
+                if not is_failover_error(e):
+                    raise
+                self._log_failover(e)
+                return await self.fallback.ainvoke(messages, **params)
+        finally:
+            if not primary.done():
+                primary.cancel()
+    
+    async def _race(self, primary: asyncio.Task, messages: List[Any], params: Dict[str, Any]) -> Any:
+        """Отправить дублирующий запрос резервному провайдеру и взять первый успешный ответ."""
+        self.policy.count("hedges")
+        secondary = asyncio.create_task(self.fallback.ainvoke(messages, **params))
+        pending = {primary, secondary}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.policy.count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Проигравший запрос отменяется
+            for task in pending:
+                task.cancel()
+    
+    async def astream(self, messages: List[Any], prompt: Any = None, **kwargs) -> AsyncIterator[str]:
+        """Потоковый вызов модели от имени агента (переключение до первого фрагмента)."""
+        token_budget.check(self.agent_name, messages)
+        params = {
+            "cache": self.cache_enabled,
+            "prompt_version": prompt_version(prompt),
+            "agent": self.agent_name,
+            **kwargs
+        }
+        started = False
+        try:
+            async for text in self.client.astream(messages, **params):
+                started = True
+                yield text
+            return
+        except Exception as e:
+            if started or self.fallback is None or not is_failover_error(e):
+                raise
+            self._log_failover(e)
+        
+        async for text in self.fallback.astream(messages, **params):
+            yield text
+    
+    def _log_failover(self, error: Exception):
+        """Учесть переключение на резервного провайдера."""
+        self.policy.count("failovers")
+        llm_telemetry.record_retry("failover", error)
+        logger.warning(
+            f"LLM failover for {self.agent_name}: {self.client.provider} -> {self.fallback.provider} ({error})"
+        )
+
+
+class LLMRegistry:
+    """Реестр LLM клиентов, общий для всего процесса."""
+    
+    def __init__(self, settings: AISettings = ai_settings):
+        """Инициализация реестра."""
+        self.settings = settings
+        self._clients: Dict[Tuple, LLMClient] = {}
+        self._policies: Dict[str, HedgePolicy] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, config: dict) -> LLMClient:
+        """Получить (или создать) клиент для конфигурации."""
+        key = config_key(config)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                llm, http_clients = create_llm(config, self.settings)
+                client = LLMClient(config, llm, http_clients, llm_governors.get(config))
+                self._clients[key] = client
+                logger.info(f"LLM client created: {client.provider}/{client.model}")
+        return client
+    
+    def get_for_agent(self, agent_name: str) -> AgentLLM:
+        """Получить клиент по конфигурации агента."""
+        client = self.get(self.settings.get_config_for_agent(agent_name))
+        client.agents.add(agent_name)
+        
+        fallback = None
+        fallback_config = self.settings.get_fallback_config_for_agent(agent_name)
+        if fallback_config:
+            fallback = self.get(fallback_config)
+            fallback.agents.add(agent_name)
+        
+        with self._lock:
+            policy = self._policies.get(agent_name)
+            if policy is None:
+                policy = HedgePolicy(
+                    hedge=self.settings.is_hedge_enabled(agent_name),
+                    percentile=self.settings.hedge_percentile,
+                    min_delay=self.settings.hedge_min_delay,
+                    default_delay=self.settings.hedge_default_delay,
+                    min_samples=self.settings.hedge_min_samples,
+                )
+                self._policies[agent_name] = policy
+        
+        return AgentLLM(client, agent_name, self.settings.is_cache_enabled(agent_name), fallback, policy)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Сводная статистика реестра."""
+        clients = [client.stats() for client in list(self._clients.values())]
+        return {
+            "clients": len(clients),
+            "in_flight": sum(c["in_flight"] for c in clients),
+            "total_calls": sum(c["total_calls"] for c in clients),
+            "items": clients,
+            "governors": llm_governors.stats(),
+            "hedging": {name: policy.stats() for name, policy in list(self._policies.items())},
+            "token_budget": token_budget.stats(),
+        }
+    
+    async def aclose(self):
+        """Закрыть все клиенты."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+
+# Глобальный экземпляр
+llm_registry = LLMRegistry()
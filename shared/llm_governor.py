@@ -0,0 +1,219 @@
+"""Ограничение параллелизма и RPM/TPM вызовов LLM по провайдеру и модели."""
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Tuple
+
+from shared.ai_config import AISettings, ai_settings
+
+# Интервал повторной проверки очереди, когда ждать приходится не токены, а слот
+POLL_INTERVAL = 0.05
+
+
+class TokenBucket:
+    """Token bucket с пополнением за минуту (0 - без ограничения)."""
+    
+    def __init__(self, per_minute: int):
+        """Инициализация ведра."""
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+    
+    @property
+    def unlimited(self) -> bool:
+        """Ограничение отключено."""
+        return self.capacity <= 0
+    
+    def _refill(self, now: float):
+        """Пополнить ведро к моменту now."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    def delay(self, amount: float, now: float) -> float:
+        """Сколько секунд ждать, пока в ведре наберется amount."""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        # Запрос больше емкости ведра ждет полного ведра, а не вечно
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+    
+    def consume(self, amount: float):
+        """Списать amount из ведра."""
+        if not self.unlimited:
+            self.tokens -= min(amount, self.capacity)
+
+
+class ProviderGovernor:
+    """Очередь вызовов одной пары провайдер/модель: слоты параллелизма, RPM и TPM."""
+    
+    def __init__(self, provider: str, model: str, max_concurrency: int = 0, rpm: int = 0, tpm: int = 0):
+        """
+        Инициализация ограничителя.
+        
+        Args:
+            provider: Провайдер
+            model: Модель
+            max_concurrency: Максимум одновременных вызовов (0 - без ограничения)
+            rpm: Запросов в минуту (0 - без ограничения)
+            tpm: Токенов промпта в минуту (0 - без ограничения)
+        """
+        self.provider = provider
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.active = 0
+        self._queue: deque = deque()
+        self._tickets = itertools.count()
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+    
+    def _try_acquire(self, ticket: int, tokens: int) -> float:
+        """Попытаться занять слот; вернуть 0 при успехе или время до следующей попытки."""
+        with self._lock:
+            # Очередь FIFO: слот получает только первый в очереди
+            if self._queue[0] != ticket:
+                return POLL_INTERVAL
+            if self.max_concurrency and self.active >= self.max_concurrency:
+                return POLL_INTERVAL
+            now = time.monotonic()
+            wait = max(self.requests.delay(1, now), self.tokens.delay(tokens, now))
+            if wait > 0:
+                return wait
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.active += 1
+            self._queue.popleft()
+            return 0.0
+    
+    def _enqueue(self) -> int:
+        """Встать в очередь."""
+        with self._lock:
+            ticket = next(self._tickets)
+            self._queue.append(ticket)
+            return ticket
+    
+    def _leave(self, ticket: int):
+        """Покинуть очередь без получения слота (отмена или ошибка)."""
+        with self._lock:
+            try:
+                self._queue.remove(ticket)
+            except ValueError:
+                pass
+    
+    def _record_wait(self, waited: float):
+        """Учесть время ожидания в очереди."""
+        with self._lock:
+            self.acquired += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            if waited > 0:
+                self.throttled += 1
+    
+    def _release(self):
+        """Освободить слот."""
+        with self._lock:
+            self.active -= 1
+    
+    @asynccontextmanager
+    async def aslot(self, tokens: int = 0):
+        """Асинхронно дождаться слота для вызова с оценкой tokens токенов промпта."""
+        ticket = self._enqueue()
+        started = time.monotonic()
+        try:
+            while True:
+                wait = self._try_acquire(ticket, tokens)
+                if not wait:
+                    break
+                await asyncio.sleep(min(wait, 1.0))
+        except BaseException:
+            self._leave(ticket)
+            raise
+        self._record_wait(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self._release()
+    
+    @contextmanager
+    def slot(self, tokens: int = 0):
+        """Синхронно дождаться слота для вызова с оценкой tokens токенов промпта."""
+        ticket = self._enqueue()
+        started = time.monotonic()
+        try:
+            while True:
+                wait = self._try_acquire(ticket, tokens)
+                if not wait:
+                    break
+                time.sleep(min(wait, 1.0))
+        except BaseException:
+            self._leave(ticket)
+            raise
+        self._record_wait(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self._release()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Метрики очереди."""
+        with self._lock:
+            return {
+                "provider": self.provider,
+                "model": self.model,
+                "max_concurrency": self.max_concurrency,
+                "rpm": int(self.requests.capacity),
+                "tpm": int(self.tokens.capacity),
+                "active": self.active,
+                "queue_depth": len(self._queue),
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "total_wait_seconds": round(self.total_wait, 3),
+                "avg_wait_seconds": round(self.total_wait / self.acquired, 3) if self.acquired else 0.0,
+                "max_wait_seconds": round(self.max_wait, 3),
+            }
+
+
+class GovernorRegistry:
+    """Ограничители вызовов, общие для всех клиентов с одинаковыми провайдером и моделью."""
+    
+    def __init__(self, settings: AISettings = ai_settings):
+        """Инициализация реестра."""
+        self.settings = settings
+        self._governors: Dict[Tuple[str, str], ProviderGovernor] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, config: dict) -> ProviderGovernor:
+        """Получить (или создать) ограничитель для конфигурации LLM."""
+        provider = config["provider"]
+        key = (str(getattr(provider, "value", provider)), str(config["model"]))
+        with self._lock:
+            governor = self._governors.get(key)
+            if governor is None:
+                limits = self.settings.get_limits_for_provider(provider)
+                governor = ProviderGovernor(key[0], key[1], **limits)
+                self._governors[key] = governor
+        return governor
+    
+    def stats(self) -> Dict[str, Any]:
+        """Сводные метрики всех ограничителей."""
+        items = [governor.stats() for governor in list(self._governors.values())]
+        return {
+            "queue_depth": sum(i["queue_depth"] for i in items),
+            "active": sum(i["active"] for i in items),
+            "items": items,
+        }
+
+
+# Глобальный экземпляр
+llm_governors = GovernorRegistry()
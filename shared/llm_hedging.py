@@ -0,0 +1,105 @@
+"""Хеджирование и переключение вызовов LLM на резервного провайдера."""
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+import httpx
+
+# Имена исключений SDK провайдеров (openai, anthropic), при которых переключаемся на резерв
+FAILOVER_ERROR_NAMES = ("APITimeoutError", "APIConnectionError", "InternalServerError", "ServiceUnavailableError")
+
+
+def is_failover_error(error: BaseException) -> bool:
+    """Ошибка провайдера, при которой запрос нужно отправить резервному провайдеру (5xx, таймаут)."""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, httpx.TimeoutException, httpx.NetworkError)):
+        return True
+    if type(error).__name__ in FAILOVER_ERROR_NAMES:
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+
+class LatencyTracker:
+    """Скользящее окно задержек успешных вызовов провайдера."""
+    
+    def __init__(self, window: int = 200):
+        """Инициализация окна."""
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+    
+    def record(self, seconds: float):
+        """Учесть задержку вызова."""
+        with self._lock:
+            self._samples.append(seconds)
+    
+    def __len__(self) -> int:
+        """Количество замеров в окне."""
+        return len(self._samples)
+    
+    def percentile(self, p: float) -> Optional[float]:
+        """Перцентиль задержки (p от 0 до 1); None, если замеров нет."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(p * (len(samples) - 1)))))
+        return samples[index]
+    
+    def stats(self) -> Dict[str, Any]:
+        """Сводка задержек."""
+        p50 = self.percentile(0.5)
+        p95 = self.percentile(0.95)
+        return {
+            "samples": len(self),
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+        }
+
+
+class HedgePolicy:
+    """Политика хеджирования агента: когда отправлять дублирующий запрос резервному провайдеру."""
+    
+    def __init__(
+        self,
+        hedge: bool = False,
+        percentile: float = 0.95,
+        min_delay: float = 1.0,
+        default_delay: float = 10.0,
+        min_samples: int = 20
+    ):
+        """
+        Инициализация политики.
+        
+        Args:
+            hedge: Отправлять дублирующий запрос, если основной провайдер не ответил к сроку
+            percentile: Перцентиль задержки основного провайдера, задающий срок
+            min_delay: Минимальный срок в секундах
+            default_delay: Срок, пока замеров задержки недостаточно
+            min_samples: Минимальное количество замеров для расчета перцентиля
+        """
+        self.hedge = hedge
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.counters = {"hedges": 0, "hedge_wins": 0, "failovers": 0}
+        self._lock = threading.Lock()
+    
+    def deadline(self, latency: LatencyTracker) -> float:
+        """Срок ожидания основного провайдера до отправки дублирующего запроса."""
+        if len(latency) < self.min_samples:
+            return self.default_delay
+        return max(self.min_delay, latency.percentile(self.percentile))
+    
+    def count(self, name: str):
+        """Увеличить счетчик."""
+        with self._lock:
+            self.counters[name] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Статистика хеджирования."""
+        with self._lock:
+            return {"hedge": self.hedge, "percentile": self.percentile, **self.counters}
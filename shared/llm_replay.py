@@ -0,0 +1,226 @@
+"""Провайдер воспроизведения записанных ответов LLM (кассеты) для нагрузочных тестов и CI без сети."""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from shared.logging_config import get_logger
+from shared.tokens import count_messages_tokens, count_tokens
+
+logger = get_logger(__name__)
+
+# Режимы работы
+REPLAY = "replay"
+RECORD = "record"
+
+# Источники задержки ответа
+LATENCY_RECORDED = "recorded"
+LATENCY_SYNTHETIC = "synthetic"
+LATENCY_NONE = "none"
+
+# Поведение при отсутствии записи
+MISS_ERROR = "error"
+MISS_SYNTHETIC = "synthetic"
+
+
+class CassetteMissError(LookupError):
+    """Для промпта нет записанного ответа."""
+
+
+def prompt_hash(messages: List[Any]) -> str:
+    """Ключ кассеты: хэш ролей и текста сообщений (не зависит от провайдера и модели)."""
+    payload = [[getattr(m, "type", "human"), getattr(m, "content", m)] for m in messages]
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def lognormal(rng: random.Random, mean: float, stddev: float) -> float:
+    """Значение логнормального распределения с заданными средним и отклонением."""
+    if mean <= 0:
+        return 0.0
+    if stddev <= 0:
+        return mean
+    sigma2 = math.log(1 + (stddev / mean) ** 2)
+    return rng.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+
+
+class CassetteStore:
+    """Каталог кассет: один JSON файл на хэш промпта, в файле - список записанных ответов."""
+    
+    def __init__(self, directory: str):
+        """Инициализация каталога."""
+        self.directory = directory
+        self._entries: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._cursor: Dict[str, int] = {}
+        self._lock = threading.Lock()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+    
+    def _load(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Загрузить индекс кассет (один раз)."""
+        if self._entries is None:
+            entries = {}
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if not name.endswith(".json"):
+                        continue
+                    try:
+                        with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                            cassette = json.load(f)
+                        entries[cassette["key"]] = cassette["responses"]
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.warning(f"Skipping broken cassette {name}: {e}")
+            self._entries = entries
+            logger.info(f"Loaded {len(entries)} cassettes from {self.directory}")
+        return self._entries
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._load())
+    
+    def next(self, key: str) -> Optional[Dict[str, Any]]:
+        """Следующий записанный ответ для ключа (по кругу, если записей несколько)."""
+        with self._lock:
+            responses = self._load().get(key)
+            if not responses:
+                return None
+            cursor = self._cursor.get(key, 0)
+            self._cursor[key] = cursor + 1
+            return responses[cursor % len(responses)]
+    
+    def append(self, key: str, messages: List[Any], response: Dict[str, Any]):
+        """Дописать ответ в кассету."""
+        with self._lock:
+            responses = self._load().setdefault(key, [])
+            responses.append(response)
+            os.makedirs(self.directory, exist_ok=True)
+            cassette = {
+                "key": key,
+                "messages": [{"role": getattr(m, "type", "human"), "content": getattr(m, "content", m)} for m in messages],
+                "responses": responses,
+            }
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cassette, f, ensure_ascii=False, indent=2, default=str)
+            os.replace(tmp_path, self._path(key))
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Модель, отвечающая записями из кассет.
+    
+    В режиме record запрос уходит реальной модели, а ответ, задержка и токены записываются.
+    """
+    
+    store: CassetteStore
+    mode: str = REPLAY
+    recorder: Optional[Any] = None
+    latency: str = LATENCY_SYNTHETIC
+    latency_mean: float = 1.0
+    latency_stddev: float = 0.3
+    completion_tokens_mean: float = 300.0
+    completion_tokens_stddev: float = 100.0
+    on_miss: str = MISS_SYNTHETIC
+    seed: Optional[int] = None
+    rng: Optional[random.Random] = None
+    counters: Dict[str, int] = {}
+    
+    class Config:
+        arbitrary_types_allowed = True
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.rng = random.Random(self.seed)
+        self.counters = {"hits": 0, "misses": 0, "recorded": 0}
+        if self.mode == RECORD and self.recorder is None:
+            raise ValueError("Record mode requires a real model to record from")
+    
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+    
+    def _delay(self, entry: Optional[Dict[str, Any]]) -> float:
+        """Задержка ответа согласно настройке."""
+        if self.latency == LATENCY_NONE:
+            return 0.0
+        if self.latency == LATENCY_RECORDED and entry and entry.get("latency") is not None:
+            return float(entry["latency"])
+        return lognormal(self.rng, self.latency_mean, self.latency_stddev)
+    
+    def _synthetic(self, key: str) -> Dict[str, Any]:
+        """Синтетический ответ для промпта без записи."""
+        tokens = max(1, int(lognormal(self.rng, self.completion_tokens_mean, self.completion_tokens_stddev)))
+        return {
+            "content": json.dumps({"synthetic": True, "key": key, "text": " ".join(["lorem"] * tokens)}),
+            "completion_tokens": tokens,
+        }
+    
+    def _lookup(self, messages: List[BaseMessage]) -> Dict[str, Any]:
+        """Найти запись для промпта."""
+        key = prompt_hash(messages)
+        entry = self.store.next(key)
+        if entry is not None:
+            self.counters["hits"] += 1
+            return entry
+        self.counters["misses"] += 1
+        if self.on_miss == MISS_ERROR:
+            raise CassetteMissError(f"No cassette for prompt {key}")
+        return self._synthetic(key)
+    
+    def _result(self, messages: List[BaseMessage], entry: Dict[str, Any]) -> ChatResult:
+        """Собрать ответ с учетом токенов (записанных или посчитанных)."""
+        content = entry["content"]
+        usage = {
+            "prompt_tokens": entry.get("prompt_tokens") or count_messages_tokens(messages),
+            "completion_tokens": entry.get("completion_tokens") or count_tokens(content),
+        }
+        message = AIMessage(content=content, response_metadata={"token_usage": usage, "replay": True})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    def _record(self, messages: List[BaseMessage], response: Any, latency: float) -> Dict[str, Any]:
+        """Записать ответ реальной модели."""
+        meta = getattr(response, "response_metadata", None) or {}
+        usage = meta.get("token_usage") or meta.get("usage") or {}
+        entry = {
+            "content": response.content,
+            "latency": round(latency, 4),
+            "prompt_tokens": usage.get("prompt_tokens", usage.get("input_tokens")),
+            "completion_tokens": usage.get("completion_tokens", usage.get("output_tokens")),
+            "recorded_at": datetime.utcnow().isoformat(),
+        }
+        self.store.append(prompt_hash(messages), messages, entry)
+        self.counters["recorded"] += 1
+        return entry
+    
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs) -> ChatResult:
+        if self.mode == RECORD:
+            started = time.monotonic()
+            response = self.recorder.invoke(messages, stop=stop, **kwargs)
+            return self._result(messages, self._record(messages, response, time.monotonic() - started))
+        entry = self._lookup(messages)
+        time.sleep(self._delay(entry))
+        return self._result(messages, entry)
+    
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs) -> ChatResult:
+        if self.mode == RECORD:
+            started = time.monotonic()
+            response = await self.recorder.ainvoke(messages, stop=stop, **kwargs)
+            return self._result(messages, self._record(messages, response, time.monotonic() - started))
+        entry = self._lookup(messages)
+        await asyncio.sleep(self._delay(entry))
+        return self._result(messages, entry)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики воспроизведения."""
+        return {"mode": self.mode, "cassettes": len(self.store), **self.counters}
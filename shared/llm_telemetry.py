@@ -0,0 +1,538 @@
+"""Телеметрия вызовов LLM: задержка, токены, стоимость, кэш и fallback по агентам, проектам и версиям промптов."""
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from shared.ai_config import ai_settings
+from shared.logging_config import get_logger
+from shared.tokens import count_messages_tokens, count_tokens
+
+logger = get_logger(__name__)
+
+# Цены по умолчанию, USD за 1K токенов (промпт, ответ); переопределяются AI_MODEL_PRICES
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4-turbo-preview": (0.01, 0.03),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.005, 0.015),
+    "gpt-4": (0.03, 0.06),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "claude-3-opus-20240229": (0.015, 0.075),
+    "claude-3-sonnet-20240229": (0.003, 0.015),
+    "claude-3-haiku-20240307": (0.00025, 0.00125),
+}
+
+# Доля цены промпта для токенов, прочитанных из кэша префикса провайдера
+CACHED_PROMPT_PRICE_RATIO: Dict[str, float] = {"anthropic": 0.1}
+DEFAULT_CACHED_PROMPT_PRICE_RATIO = 0.5
+
+# Границы гистограммы задержки в секундах
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Сколько последних задержек хранить на версию промпта для p95
+PROMPT_LATENCY_SAMPLES = 1000
+
+
+@dataclass
+class Operation:
+    """Вызов метода агента, внутри которого выполняются запросы к модели."""
+    agent: Optional[str]
+    method: str
+    calls: int = 0
+    # Повторы, отмеченные явно (исправление ответа, переключение провайдера, повтор пакета)
+    retries: int = 0
+    # Версия промпта ("id@version"), с которой выполнялся метод
+    prompt_version: Optional[str] = None
+
+
+@dataclass
+class PromptVersionStats:
+    """Накопленные метрики одной версии промпта."""
+    calls: int = 0
+    cache_hits: int = 0
+    errors: int = 0
+    operations: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_sum: float = 0.0
+    latency_count: int = 0
+    parse_failures: int = 0
+    fallbacks: int = 0
+    latency: deque = field(default_factory=lambda: deque(maxlen=PROMPT_LATENCY_SAMPLES))
+    
+    def summary(self) -> Dict[str, Any]:
+        """Сводка: средние значения и доли."""
+        samples = sorted(self.latency)
+        responses = self.calls - self.errors
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "errors": self.errors,
+            "operations": self.operations,
+            "mean_latency": round(self.latency_sum / self.latency_count, 4) if self.latency_count else None,
+            "p95_latency": round(samples[min(len(samples) - 1, int(0.95 * len(samples)))], 4) if samples else None,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.calls, 1) if self.calls else None,
+            "avg_completion_tokens": round(self.completion_tokens / self.calls, 1) if self.calls else None,
+            "parse_failures": self.parse_failures,
+            "parse_failure_rate": round(self.parse_failures / responses, 4) if responses else None,
+            "fallbacks": self.fallbacks,
+            "fallback_rate": round(self.fallbacks / self.operations, 4) if self.operations else None,
+        }
+
+
+# Метрики, по которым сравниваются версии промпта
+PROMPT_COMPARISON_METRICS = (
+    "mean_latency", "p95_latency", "avg_prompt_tokens", "avg_completion_tokens", "parse_failure_rate", "fallback_rate"
+)
+
+
+_operation: contextvars.ContextVar[Optional[Operation]] = contextvars.ContextVar("llm_operation", default=None)
+_project: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_project", default=None)
+
+
+def _method_name(func: Any) -> str:
+    """Имя метода без префикса асинхронной версии (aformalize_requirement -> formalize_requirement)."""
+    name = func.__name__
+    if (inspect.iscoroutinefunction(func) or inspect.isasyncgenfunction(func)) and name.startswith("a"):
+        return name[1:]
+    return name
+
+
+def prompt_version(prompt: Any) -> Optional[str]:
+    """Версия промпта из хранилища в виде "id@version"."""
+    if prompt is None:
+        return None
+    return f"{prompt.id}@{prompt.version}"
+
+
+def traced(func):
+    """Декоратор метода агента: запросы к модели внутри учитываются под его именем."""
+    method = _method_name(func)
+    
+    def start(agent_self) -> Operation:
+        return Operation(getattr(getattr(agent_self, "llm", None), "agent_name", None), method)
+    
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def stream_wrapper(self, *args, **kwargs):
+            token = _operation.set(start(self))
+            try:
+                async for item in func(self, *args, **kwargs):
+                    yield item
+            finally:
+                try:
+                    _operation.reset(token)
+                except ValueError:
+                    # Генератор закрыт из другого контекста (aclose при сборке мусора) - его значение там не выставлялось
+                    pass
+        return stream_wrapper
+    
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, *args, **kwargs):
+            token = _operation.set(start(self))
+            try:
+                return await func(self, *args, **kwargs)
+            finally:
+                _operation.reset(token)
+        return async_wrapper
+    
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        token = _operation.set(start(self))
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            _operation.reset(token)
+    return wrapper
+
+
+def response_usage(response: Any) -> Optional[Tuple[int, int]]:
+    """Токены промпта и ответа из метаданных ответа провайдера."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return int(usage.get("input_tokens", 0)), int(usage.get("output_tokens", 0))
+    
+    meta = getattr(response, "response_metadata", None) or {}
+    # OpenAI: token_usage, Anthropic: usage, Ollama: prompt_eval_count/eval_count
+    raw = meta.get("token_usage") or meta.get("usage") or {}
+    prompt = raw.get("prompt_tokens", raw.get("input_tokens", meta.get("prompt_eval_count")))
+    completion = raw.get("completion_tokens", raw.get("output_tokens", meta.get("eval_count")))
+    if prompt is None and completion is None:
+        return None
+    if "prompt_tokens" not in raw:
+        # Anthropic считает токены, прочитанные из кэша и записанные в кэш, отдельно от input_tokens
+        prompt = (prompt or 0) + (raw.get("cache_read_input_tokens") or 0) + (raw.get("cache_creation_input_tokens") or 0)
+    return int(prompt or 0), int(completion or 0)
+
+
+def cached_prompt_tokens(response: Any) -> int:
+    """Токены промпта, прочитанные из кэша префикса провайдера."""
+    details = (getattr(response, "usage_metadata", None) or {}).get("input_token_details") or {}
+    if details.get("cache_read"):
+        return int(details["cache_read"])
+    
+    meta = getattr(response, "response_metadata", None) or {}
+    # OpenAI: prompt_tokens_details.cached_tokens, Anthropic: cache_read_input_tokens
+    raw = meta.get("token_usage") or meta.get("usage") or {}
+    cached = (raw.get("prompt_tokens_details") or {}).get("cached_tokens") or raw.get("cache_read_input_tokens")
+    return int(cached or 0)
+
+
+def _labels(**labels: Any) -> str:
+    """Метки метрики в формате Prometheus."""
+    parts = []
+    for key, value in labels.items():
+        text = str(value if value is not None else "").replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+        parts.append(f'{key}="{text}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class LLMTelemetry:
+    """Сбор метрик вызовов LLM и запись событий в JSONL."""
+    
+    def __init__(self, prices: Optional[Dict[str, Any]] = None, sink_path: Optional[str] = None):
+        """
+        Инициализация телеметрии.
+        
+        Args:
+            prices: Цены моделей, USD за 1K токенов (промпт, ответ)
+            sink_path: Путь к JSONL файлу событий (None - без записи)
+        """
+        self.prices = {**DEFAULT_PRICES, **{k: tuple(v) for k, v in (prices or {}).items()}}
+        self.sink_path = sink_path
+        self._lock = threading.Lock()
+        self._sink = None
+        self.reset()
+    
+    def reset(self):
+        """Сбросить накопленные метрики."""
+        with self._lock:
+            self.calls: Dict[tuple, int] = defaultdict(int)
+            self.prompt_tokens: Dict[tuple, int] = defaultdict(int)
+            self.completion_tokens: Dict[tuple, int] = defaultdict(int)
+            self.cached_tokens: Dict[tuple, int] = defaultdict(int)
+            self.cost: Dict[tuple, float] = defaultdict(float)
+            self.latency: Dict[tuple, List[float]] = {}
+            self.retries: Dict[tuple, int] = defaultdict(int)
+            self.fallbacks: Dict[tuple, int] = defaultdict(int)
+            self.cost_by_project: Dict[str, float] = defaultdict(float)
+            self.prompt_versions: Dict[str, PromptVersionStats] = defaultdict(PromptVersionStats)
+    
+    @contextmanager
+    def project_scope(self, project_id: Any):
+        """Относить стоимость вызовов внутри блока к проекту."""
+        token = _project.set(str(project_id) if project_id is not None else None)
+        try:
+            yield
+        finally:
+            _project.reset(token)
+    
+    def price_for(self, model: str) -> Tuple[float, float]:
+        """Цена модели (точное совпадение или самый длинный префикс)."""
+        if model in self.prices:
+            return self.prices[model]
+        matches = [name for name in self.prices if model and model.startswith(name)]
+        return self.prices[max(matches, key=len)] if matches else (0.0, 0.0)
+    
+    def record_call(
+        self,
+        provider: str,
+        model: str,
+        messages: List[Any],
+        response: Any = None,
+        latency: float = 0.0,
+        agent: Optional[str] = None,
+        prompt_version: Optional[str] = None,
+        cache_hit: bool = False,
+        failed: bool = False,
+        completion_text: Optional[str] = None
+    ):
+        """Учесть один запрос к модели."""
+        operation = _operation.get()
+        if operation is not None:
+            operation.calls += 1
+        method = operation.method if operation else "unknown"
+        agent = agent or (operation.agent if operation else None) or "unknown"
+        retry = operation.retries if operation else 0
+        project_id = _project.get()
+        
+        usage = None if cache_hit or failed else response_usage(response)
+        estimated = usage is None and not cache_hit and not failed
+        if cache_hit or failed:
+            prompt_tokens, completion_tokens = 0, 0
+        elif usage is not None:
+            prompt_tokens, completion_tokens = usage
+        else:
+            text = completion_text if completion_text is not None else str(getattr(response, "content", ""))
+            prompt_tokens, completion_tokens = count_messages_tokens(messages), count_tokens(text)
+        
+        cached_tokens = min(prompt_tokens, cached_prompt_tokens(response)) if usage is not None else 0
+        
+        prompt_price, completion_price = self.price_for(model)
+        cached_price = prompt_price * CACHED_PROMPT_PRICE_RATIO.get(provider, DEFAULT_CACHED_PROMPT_PRICE_RATIO)
+        cost = (
+            (prompt_tokens - cached_tokens) * prompt_price
+            + cached_tokens * cached_price
+            + completion_tokens * completion_price
+        ) / 1000
+        
+        key = (agent, method, provider, model)
+        status = "error" if failed else "ok"
+        with self._lock:
+            self.calls[key + (str(cache_hit).lower(), status)] += 1
+            self.prompt_tokens[key] += prompt_tokens
+            self.completion_tokens[key] += completion_tokens
+            self.cached_tokens[key] += cached_tokens
+            self.cost[key] += cost
+            if not cache_hit:
+                self._observe(key, latency)
+            if project_id:
+                self.cost_by_project[project_id] += cost
+            if prompt_version:
+                self._observe_prompt(prompt_version, operation, prompt_tokens, completion_tokens, latency, cache_hit, failed)
+        
+        prompt_id, _, version = (prompt_version or "").partition("@")
+        self._emit({
+            "event": "llm_call",
+            "agent": agent,
+            "method": method,
+            "prompt_id": prompt_id or None,
+            "prompt_version": version or None,
+            "provider": provider,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_prompt_tokens": cached_tokens,
+            "tokens_estimated": estimated,
+            "latency": round(latency, 4),
+            "cache_hit": cache_hit,
+            "retry": retry,
+            "status": status,
+            "cost_usd": round(cost, 6),
+            "project_id": project_id,
+        })
+    
+    def record_retry(self, reason: str, error: Optional[BaseException] = None):
+        """Учесть повтор внутри метода агента (параллельные и хеджированные запросы повторами не считаются)."""
+        operation = _operation.get()
+        agent = (operation.agent if operation else None) or "unknown"
+        method = operation.method if operation else "unknown"
+        if operation is not None:
+            operation.retries += 1
+        with self._lock:
+            self.retries[(agent, method)] += 1
+        self._emit({
+            "event": "llm_retry",
+            "agent": agent,
+            "method": method,
+            "reason": reason,
+            "error": str(error)[:200] if error else None,
+            "project_id": _project.get(),
+        })
+    
+    def record_fallback(self, error: Optional[BaseException] = None):
+        """Учесть, что метод агента вернул результат по умолчанию вместо ответа модели."""
+        operation = _operation.get()
+        agent = (operation.agent if operation else None) or "unknown"
+        method = operation.method if operation else "unknown"
+        version = operation.prompt_version if operation else None
+        with self._lock:
+            self.fallbacks[(agent, method)] += 1
+            if version:
+                self.prompt_versions[version].fallbacks += 1
+        self._emit({
+            "event": "llm_fallback",
+            "agent": agent,
+            "method": method,
+            "prompt_version": version,
+            "error": str(error) if error else None,
+            "project_id": _project.get(),
+        })
+    
+    def record_parse_failure(self, version: Optional[str] = None, error: Optional[BaseException] = None):
+        """Учесть ответ модели, который не удалось разобрать по схеме."""
+        operation = _operation.get()
+        version = version or (operation.prompt_version if operation else None)
+        if version:
+            with self._lock:
+                self.prompt_versions[version].parse_failures += 1
+        self._emit({
+            "event": "llm_parse_failure",
+            "agent": (operation.agent if operation else None) or "unknown",
+            "method": operation.method if operation else "unknown",
+            "prompt_version": version,
+            "error": str(error)[:200] if error else None,
+        })
+    
+    def _observe_prompt(
+        self,
+        version: str,
+        operation: Optional[Operation],
+        prompt_tokens: int,
+        completion_tokens: int,
+        latency: float,
+        cache_hit: bool,
+        failed: bool
+    ):
+        """Учесть вызов в метриках версии промпта (вызывается под блокировкой)."""
+        stats = self.prompt_versions[version]
+        stats.calls += 1
+        stats.cache_hits += int(cache_hit)
+        stats.errors += int(failed)
+        stats.prompt_tokens += prompt_tokens
+        stats.completion_tokens += completion_tokens
+        # Повторы внутри метода агента (исправление, переключение) относятся к той же операции
+        if operation is None or operation.prompt_version != version:
+            stats.operations += 1
+            if operation is not None:
+                operation.prompt_version = version
+        if not cache_hit and not failed:
+            stats.latency_sum += latency
+            stats.latency_count += 1
+            stats.latency.append(latency)
+    
+    def prompt_stats(self, prompt_id: str) -> Dict[str, Any]:
+        """Метрики версий промпта (новые первыми) и сравнение двух последних версий."""
+        with self._lock:
+            versions = []
+            for key, stats in self.prompt_versions.items():
+                item_id, _, version = key.rpartition("@")
+                if item_id == prompt_id:
+                    versions.append({"version": int(version) if version.isdigit() else version, **stats.summary()})
+        versions.sort(key=lambda item: str(item["version"]).zfill(12), reverse=True)
+        
+        comparison = None
+        if len(versions) >= 2:
+            candidate, baseline = versions[0], versions[1]
+            comparison = {
+                "candidate": candidate["version"],
+                "baseline": baseline["version"],
+                "delta": {
+                    metric: (
+                        round(candidate[metric] - baseline[metric], 4)
+                        if candidate[metric] is not None and baseline[metric] is not None else None
+                    )
+                    for metric in PROMPT_COMPARISON_METRICS
+                },
+            }
+        return {"prompt_id": prompt_id, "versions": versions, "comparison": comparison}
+    
+    def _observe(self, key: tuple, latency: float):
+        """Добавить значение в гистограмму задержки (вызывается под блокировкой)."""
+        histogram = self.latency.get(key)
+        if histogram is None:
+            # Счетчики по границам, затем сумма и количество
+            histogram = self.latency[key] = [0.0] * (len(LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                histogram[i] += 1
+        histogram[-2] += latency
+        histogram[-1] += 1
+    
+    def _emit(self, event: Dict[str, Any]):
+        """Записать событие в JSONL файл."""
+        if not self.sink_path:
+            return
+        event = {"ts": time.time(), **event}
+        try:
+            with self._lock:
+                if self._sink is None:
+                    self._sink = open(self.sink_path, "a", encoding="utf-8")
+                self._sink.write(json.dumps(event, ensure_ascii=False) + "\n")
+                self._sink.flush()
+        except OSError as e:
+            logger.warning(f"LLM telemetry sink write failed: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Сводка по агентам и проектам."""
+        methods: Dict[str, Dict[str, Any]] = {}
+        
+        def entry(agent: str, method: str) -> Dict[str, Any]:
+            return methods.setdefault(f"{agent}.{method}", {
+                "calls": 0, "cache_hits": 0, "errors": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0,
+                "completion_tokens": 0, "cost_usd": 0.0, "retries": 0, "fallbacks": 0,
+            })
+        
+        with self._lock:
+            for (agent, method, _, _, cache_hit, status), count in self.calls.items():
+                item = entry(agent, method)
+                item["calls"] += count
+                item["cache_hits"] += count if cache_hit == "true" else 0
+                item["errors"] += count if status == "error" else 0
+            for (agent, method, _, _), value in self.prompt_tokens.items():
+                entry(agent, method)["prompt_tokens"] += value
+            for (agent, method, _, _), value in self.completion_tokens.items():
+                entry(agent, method)["completion_tokens"] += value
+            for (agent, method, _, _), value in self.cached_tokens.items():
+                entry(agent, method)["cached_prompt_tokens"] += value
+            for (agent, method, _, _), value in self.cost.items():
+                item = entry(agent, method)
+                item["cost_usd"] = round(item["cost_usd"] + value, 6)
+            for (agent, method), value in self.retries.items():
+                entry(agent, method)["retries"] = value
+            for (agent, method), value in self.fallbacks.items():
+                entry(agent, method)["fallbacks"] = value
+            return {
+                "methods": methods,
+                "cost_by_project": {k: round(v, 6) for k, v in self.cost_by_project.items()},
+                "total_cost_usd": round(sum(self.cost.values()), 6),
+            }
+    
+    def prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus."""
+        lines: List[str] = []
+        
+        def family(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        
+        with self._lock:
+            family("llm_calls_total", "counter", "LLM calls by agent, method, provider, model, cache hit and status")
+            for (agent, method, provider, model, cache_hit, status), value in self.calls.items():
+                labels = _labels(agent=agent, method=method, provider=provider, model=model, cache_hit=cache_hit, status=status)
+                lines.append(f"llm_calls_total{labels} {value}")
+            
+            for name, source, help_text in (
+                ("llm_prompt_tokens_total", self.prompt_tokens, "Prompt tokens sent to the provider"),
+                ("llm_cached_prompt_tokens_total", self.cached_tokens, "Prompt tokens served from the provider prefix cache"),
+                ("llm_completion_tokens_total", self.completion_tokens, "Completion tokens returned by the provider"),
+                ("llm_cost_usd_total", self.cost, "Estimated LLM cost in USD"),
+            ):
+                family(name, "counter", help_text)
+                for (agent, method, provider, model), value in source.items():
+                    labels = _labels(agent=agent, method=method, provider=provider, model=model)
+                    lines.append(f"{name}{labels} {round(value, 6)}")
+            
+            family("llm_call_latency_seconds", "histogram", "LLM call latency (cache hits excluded)")
+            for (agent, method, provider, model), histogram in self.latency.items():
+                base = dict(agent=agent, method=method, provider=provider, model=model)
+                for bound, count in zip(LATENCY_BUCKETS, histogram):
+                    lines.append(f"llm_call_latency_seconds_bucket{_labels(**base, le=bound)} {int(count)}")
+                lines.append(f"llm_call_latency_seconds_bucket{_labels(**base, le='+Inf')} {int(histogram[-1])}")
+                lines.append(f"llm_call_latency_seconds_sum{_labels(**base)} {round(histogram[-2], 6)}")
+                lines.append(f"llm_call_latency_seconds_count{_labels(**base)} {int(histogram[-1])}")
+            
+            for name, source, help_text in (
+                ("llm_retries_total", self.retries, "Retries within one agent method (repairs, failovers, batch re-attempts)"),
+                ("llm_fallbacks_total", self.fallbacks, "Agent methods that returned a default result instead of a model answer"),
+            ):
+                family(name, "counter", help_text)
+                for (agent, method), value in source.items():
+                    lines.append(f"{name}{_labels(agent=agent, method=method)} {value}")
+            
+            family("llm_project_cost_usd_total", "counter", "Estimated LLM cost in USD per project")
+            for project_id, value in self.cost_by_project.items():
+                lines.append(f"llm_project_cost_usd_total{_labels(project_id=project_id)} {round(value, 6)}")
+        
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный экземпляр
+llm_telemetry = LLMTelemetry(prices=ai_settings.token_prices, sink_path=ai_settings.telemetry_path)
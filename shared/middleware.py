@@ -26,7 +26,7 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         client_ip = request.client.host if request.client else "unknown"
         
         # Пропустить health check и другие системные endpoints
-        if request.url.path in ["/health", "/", "/docs", "/openapi.json", "/redoc"]:
+        if request.url.path in ["/health", "/metrics", "/", "/docs", "/openapi.json", "/redoc"]:
             return await call_next(request)
         
         current_time = time.time()
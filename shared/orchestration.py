@@ -0,0 +1,197 @@
+"""Параллельное выполнение шагов агентов и графа с зависимостями, таймаутами и частичными результатами."""
+import asyncio
+import inspect
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from shared.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Статусы шагов
+OK = "ok"
+FAILED = "failed"
+TIMEOUT = "timeout"
+SKIPPED = "skipped"
+
+
+@dataclass
+class Step:
+    """
+    Шаг конвейера.
+    
+    Функция шага получает результаты зависимостей именованными аргументами.
+    Синхронные функции (вызовы Neo4j, Supabase) выполняются в пуле потоков.
+    """
+    name: str
+    func: Callable[..., Any]
+    depends_on: Tuple[str, ...] = ()
+    timeout: Optional[float] = None
+    required: bool = True
+    default: Any = None
+
+
+@dataclass
+class StepResult:
+    """Результат шага."""
+    name: str
+    status: str
+    value: Any = None
+    error: Optional[str] = None
+    duration: float = 0.0
+
+
+@dataclass
+class PipelineResult:
+    """Результаты всех шагов конвейера."""
+    steps: Dict[str, StepResult] = field(default_factory=dict)
+    
+    def __getitem__(self, name: str) -> Any:
+        """Значение шага (значение по умолчанию, если шаг не выполнен)."""
+        return self.steps[name].value
+    
+    def __contains__(self, name: str) -> bool:
+        return name in self.steps
+    
+    @property
+    def failed(self) -> List[str]:
+        """Имена невыполненных шагов."""
+        return [name for name, result in self.steps.items() if result.status != OK]
+    
+    @property
+    def partial(self) -> bool:
+        """Часть шагов не выполнена."""
+        return bool(self.failed)
+
+
+class PipelineError(Exception):
+    """Обязательный шаг конвейера не выполнен."""
+    
+    def __init__(self, step: StepResult, result: PipelineResult):
+        super().__init__(f"Step '{step.name}' {step.status}: {step.error}")
+        self.step = step
+        self.result = result
+
+
+class Pipeline:
+    """Конвейер шагов: независимые шаги выполняются параллельно, общее время - самая длинная цепочка."""
+    
+    def __init__(self, name: str, default_timeout: Optional[float] = None):
+        """
+        Инициализация конвейера.
+        
+        Args:
+            name: Имя конвейера (для логов)
+            default_timeout: Таймаут шага в секундах, если у шага свой не задан (None - без таймаута)
+        """
+        self.name = name
+        self.default_timeout = default_timeout
+        self._steps: Dict[str, Step] = {}
+    
+    def step(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        depends_on: Tuple[str, ...] = (),
+        timeout: Optional[float] = None,
+        required: bool = True,
+        default: Any = None
+    ) -> "Pipeline":
+        """
+        Объявить шаг.
+        
+        Args:
+            name: Имя шага
+            func: Функция (синхронная или асинхронная), получающая результаты зависимостей
+            depends_on: Имена шагов, результаты которых нужны этому шагу
+            timeout: Таймаут шага в секундах
+            required: Ошибка шага прерывает конвейер (иначе используется default)
+            default: Значение необязательного шага при ошибке, таймауте или пропуске
+        """
+        if name in self._steps:
+            raise ValueError(f"Step '{name}' is already declared in pipeline '{self.name}'")
+        self._steps[name] = Step(name, func, tuple(depends_on), timeout, required, default)
+        return self
+    
+    def _validate(self):
+        """Проверить, что зависимости объявлены и не образуют цикл."""
+        for step in self._steps.values():
+            for dependency in step.depends_on:
+                if dependency not in self._steps:
+                    raise ValueError(f"Step '{step.name}' depends on unknown step '{dependency}'")
+        
+        visiting, done = set(), set()
+        
+        def visit(name: str):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle in pipeline '{self.name}' at step '{name}'")
+            visiting.add(name)
+            for dependency in self._steps[name].depends_on:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+        
+        for name in self._steps:
+            visit(name)
+    
+    @staticmethod
+    async def _call(step: Step, kwargs: Dict[str, Any]) -> Any:
+        """Вызвать функцию шага."""
+        if inspect.iscoroutinefunction(step.func):
+            return await step.func(**kwargs)
+        # to_thread копирует contextvars (проект и метод телеметрии)
+        value = await asyncio.to_thread(step.func, **kwargs)
+        if inspect.isawaitable(value):
+            value = await value
+        return value
+    
+    async def _execute(self, step: Step, tasks: Dict[str, asyncio.Task]) -> StepResult:
+        """Дождаться зависимостей и выполнить шаг."""
+        dependencies = [await tasks[name] for name in step.depends_on]
+        not_ready = [d.name for d in dependencies if d.status != OK]
+        if not_ready:
+            return StepResult(step.name, SKIPPED, step.default, f"dependencies not completed: {', '.join(not_ready)}")
+        
+        kwargs = {d.name: d.value for d in dependencies}
+        timeout = step.timeout if step.timeout is not None else self.default_timeout
+        started = time.monotonic()
+        try:
+            value = await asyncio.wait_for(self._call(step, kwargs), timeout)
+            return StepResult(step.name, OK, value, duration=time.monotonic() - started)
+        except asyncio.TimeoutError:
+            logger.warning(f"Pipeline {self.name}: step {step.name} timed out after {timeout}s")
+            return StepResult(step.name, TIMEOUT, step.default, f"timed out after {timeout}s", time.monotonic() - started)
+        except Exception as e:
+            logger.warning(f"Pipeline {self.name}: step {step.name} failed: {e}")
+            return StepResult(step.name, FAILED, step.default, str(e), time.monotonic() - started)
+    
+    async def run(self) -> PipelineResult:
+        """
+        Выполнить конвейер.
+        
+        Raises:
+            PipelineError: Обязательный шаг не выполнен (остальные шаги отменяются)
+        """
+        self._validate()
+        tasks: Dict[str, asyncio.Task] = {}
+        for step in self._steps.values():
+            tasks[step.name] = asyncio.ensure_future(self._execute(step, tasks))
+        
+        result = PipelineResult()
+        try:
+            for future in asyncio.as_completed(list(tasks.values())):
+                step_result = await future
+                result.steps[step_result.name] = step_result
+                if step_result.status != OK and self._steps[step_result.name].required:
+                    raise PipelineError(step_result, result)
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+        
+        # Порядок объявления шагов
+        result.steps = {name: result.steps[name] for name in self._steps}
+        return result
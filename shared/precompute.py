@@ -0,0 +1,276 @@
+"""Фоновый предрасчет ИИ анализов требования при создании и изменении."""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from shared.ai_config import ai_settings
+from shared.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Поля требования, от которых зависят анализы
+VERSION_FIELDS = ("identifier", "name", "shall", "rationale", "category", "priority", "acceptance_criteria")
+
+# Результат неудачного фонового расчета
+_FAILED = object()
+
+Analysis = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+# Загрузка требований по id из того же источника, что читают эндпоинты анализов
+Loader = Callable[[List[str]], List[Dict[str, Any]]]
+
+
+def requirement_version(requirement: Any) -> str:
+    """
+    Версия требования (строка Supabase или модель БД) для ключа предрасчета.
+    
+    Номер версии дополняется хэшем анализируемых полей: номер не всегда увеличивается при изменении.
+    """
+    if isinstance(requirement, dict):
+        value = requirement.get
+    else:
+        value = lambda name: getattr(requirement, name, None)
+    fields = {name: value(name) for name in VERSION_FIELDS}
+    raw = json.dumps(fields, ensure_ascii=False, sort_keys=True, default=str)
+    digest = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+    return f"{value('version') or 1}-{digest}"
+
+
+class AnalysisPrecomputer:
+    """Хранилище предрасчитанных анализов по (требование, анализ) с версией требования."""
+    
+    def __init__(self, enabled: bool = False, max_entries: int = 5000, max_age: float = 86400.0, concurrency: int = 2):
+        """
+        Инициализация.
+        
+        Args:
+            enabled: Запускать предрасчет при создании и изменении требований
+            max_entries: Максимальное число хранимых результатов
+            max_age: Возраст результата в секундах, после которого он пересчитывается при запросе
+            concurrency: Число одновременных фоновых анализов
+        """
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.concurrency = concurrency
+        self.analyses: Dict[str, Analysis] = {}
+        # Анализы, зависящие от других требований проекта в графе (дубликаты, противоречия)
+        self.graph_analyses: set = set()
+        self.loader: Optional[Loader] = None
+        # Проект требования и поколение графа проекта (растет при каждой синхронизации проекта с графом)
+        self._projects: Dict[str, str] = {}
+        self._generations: Dict[str, int] = {}
+        self._results: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str], Tuple[str, asyncio.Task]] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self.counters = {
+            "scheduled": 0, "computed": 0, "failed": 0, "hits": 0, "stale": 0, "misses": 0, "invalidated": 0
+        }
+    
+    def register(self, name: str, analysis: Analysis, graph: bool = False):
+        """Зарегистрировать анализ: корутина от данных требования (graph - результат зависит от графа проекта)."""
+        self.analyses[name] = analysis
+        if graph:
+            self.graph_analyses.add(name)
+    
+    def register_loader(self, loader: Loader):
+        """Зарегистрировать загрузку требований по id (синхронная функция, выполняется вне event loop)."""
+        self.loader = loader
+    
+    async def schedule_ids(self, requirement_ids: Iterable[str]) -> int:
+        """Загрузить требования загрузчиком и запустить предрасчет их текущих версий."""
+        requirement_ids = [str(req_id) for req_id in requirement_ids]
+        if not self.enabled or not self.analyses or self.loader is None or not requirement_ids:
+            return 0
+        try:
+            requirements = await asyncio.to_thread(self.loader, requirement_ids)
+        except Exception as e:
+            logger.warning(f"Loading requirements for precompute failed: {e}")
+            return 0
+        return sum(self.schedule(requirement) for requirement in requirements)
+    
+    def schedule(self, requirement: Dict[str, Any]) -> int:
+        """Запустить фоновый расчет всех анализов для текущей версии требования."""
+        if not self.enabled or not self.analyses or not requirement.get("id"):
+            return 0
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return 0
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        
+        requirement_id = str(requirement["id"])
+        self._track(requirement_id, requirement.get("project_id"))
+        version = requirement_version(requirement)
+        scheduled = 0
+        for name, analysis in self.analyses.items():
+            key = (requirement_id, name)
+            if self._fresh(key, version) is not None:
+                continue
+            pending = self._pending.get(key)
+            if pending is not None:
+                if pending[0] == version:
+                    continue
+                # Расчет для устаревшей версии больше не нужен
+                pending[1].cancel()
+            task = loop.create_task(self._run(key, version, analysis, requirement))
+            self._pending[key] = (version, task)
+            scheduled += 1
+        self.counters["scheduled"] += scheduled
+        return scheduled
+    
+    async def _run(self, key: Tuple[str, str], version: str, analysis: Analysis, requirement: Dict[str, Any]) -> Any:
+        """Фоновый расчет одного анализа."""
+        try:
+            async with self._semaphore:
+                generation = self._generation(key[0])
+                result = await analysis(requirement)
+            self.store(key[0], key[1], version, result, generation)
+            self.counters["computed"] += 1
+            return result
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.counters["failed"] += 1
+            logger.warning(f"Precompute of {key[1]} for requirement {key[0]} failed: {e}")
+            return _FAILED
+        finally:
+            pending = self._pending.get(key)
+            if pending is not None and pending[1] is asyncio.current_task():
+                del self._pending[key]
+    
+    def _fresh(self, key: Tuple[str, str], version: str) -> Optional[tuple]:
+        """Запись для версии требования, если она не старше max_age."""
+        with self._lock:
+            item = self._results.get(key)
+            if item is None or item[0] != version or time.time() - item[1] >= self.max_age:
+                return None
+            self._results.move_to_end(key)
+            return item
+    
+    def _track(self, requirement_id: str, project_id: Any):
+        """Запомнить проект требования (для сброса анализов проекта после синхронизации с графом)."""
+        if project_id:
+            with self._lock:
+                self._projects[requirement_id] = str(project_id)
+    
+    def _generation(self, requirement_id: str) -> int:
+        """Поколение графа проекта требования."""
+        with self._lock:
+            return self._generations.get(self._projects.get(requirement_id), 0)
+    
+    def store(self, requirement_id: str, name: str, version: str, result: Any, generation: Optional[int] = None):
+        """Сохранить результат анализа для версии требования (не сохраняется, если граф проекта изменился во время расчета)."""
+        with self._lock:
+            project_id = self._projects.get(requirement_id)
+            if generation is not None and name in self.graph_analyses and self._generations.get(project_id, 0) != generation:
+                return
+            self._results[(requirement_id, name)] = (version, time.time(), result)
+            self._results.move_to_end((requirement_id, name))
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+    
+    def get(self, requirement_id: str, name: str, version: str) -> Optional[Any]:
+        """Предрасчитанный результат для версии требования (None - нет или устарел)."""
+        key = (str(requirement_id), name)
+        item = self._fresh(key, version)
+        if item is not None:
+            self.counters["hits"] += 1
+            return item[2]
+        with self._lock:
+            self.counters["stale" if key in self._results else "misses"] += 1
+        return None
+    
+    async def get_or_compute(
+        self,
+        requirement_id: str,
+        name: str,
+        version: str,
+        compute: Callable[[], Awaitable[Any]],
+        refresh: bool = False,
+        project_id: Optional[str] = None
+    ) -> Any:
+        """
+        Отдать предрасчитанный результат или посчитать его сейчас.
+        
+        Если фоновый расчет этой версии уже идет, ожидается он; устаревший результат пересчитывается.
+        """
+        key = (str(requirement_id), name)
+        self._track(key[0], project_id)
+        generation = self._generation(key[0])
+        if not refresh:
+            result = self.get(key[0], name, version)
+            if result is not None:
+                return result
+            pending = self._pending.get(key)
+            if pending is not None and pending[0] == version:
+                try:
+                    result = await asyncio.shield(pending[1])
+                except asyncio.CancelledError:
+                    # Отменен фоновый расчет (новая версия), а не текущий запрос
+                    if not pending[1].cancelled():
+                        raise
+                    result = _FAILED
+                if result is not _FAILED:
+                    return result
+        
+        result = await compute()
+        self.store(key[0], name, version, result, generation)
+        return result
+    
+    def invalidate(self, requirement_id: str):
+        """Удалить результаты и отменить расчеты требования."""
+        requirement_id = str(requirement_id)
+        for key in [k for k in self._pending if k[0] == requirement_id]:
+            self._pending.pop(key)[1].cancel()
+        with self._lock:
+            self._projects.pop(requirement_id, None)
+            for key in [k for k in self._results if k[0] == requirement_id]:
+                del self._results[key]
+    
+    def invalidate_project(self, project_id: Any) -> int:
+        """
+        Сбросить зависящие от графа анализы требований проекта (вызывается после синхронизации проекта с графом).
+        
+        Потокобезопасен: идущие расчеты не отменяются, но их результат не сохраняется.
+        """
+        if project_id is None or not self.graph_analyses:
+            return 0
+        project_id = str(project_id)
+        with self._lock:
+            self._generations[project_id] = self._generations.get(project_id, 0) + 1
+            keys = [
+                key for key in self._results
+                if key[1] in self.graph_analyses and self._projects.get(key[0]) == project_id
+            ]
+            for key in keys:
+                del self._results[key]
+            self.counters["invalidated"] += len(keys)
+        return len(keys)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Статистика предрасчета."""
+        with self._lock:
+            entries = len(self._results)
+        return {
+            "enabled": self.enabled,
+            "analyses": list(self.analyses),
+            "entries": entries,
+            "pending": len(self._pending),
+            **self.counters,
+        }
+
+
+# Глобальный экземпляр
+analysis_precompute = AnalysisPrecomputer(
+    enabled=ai_settings.precompute,
+    max_entries=ai_settings.precompute_max_entries,
+    max_age=ai_settings.precompute_max_age,
+    concurrency=ai_settings.precompute_concurrency
+)
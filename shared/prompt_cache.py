@@ -0,0 +1,44 @@
+"""Пометка статического префикса промпта для кэширования на стороне провайдера."""
+from functools import lru_cache
+from typing import Any, List
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from shared.ai_config import ModelProvider, ai_settings
+from shared.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+@lru_cache(maxsize=1)
+def anthropic_supports_cache_control() -> bool:
+    """Передает ли установленный langchain-anthropic cache_control в системном сообщении."""
+    try:
+        from langchain_anthropic.chat_models import _format_messages
+        system, _ = _format_messages([
+            SystemMessage(content=[{"type": "text", "text": "probe", "cache_control": CACHE_CONTROL}]),
+            HumanMessage(content="probe"),
+        ])
+    except Exception as e:
+        logger.info(f"Anthropic prompt caching is not supported by installed langchain-anthropic: {e}")
+        return False
+    return isinstance(system, list) and bool(system) and system[0].get("cache_control") == CACHE_CONTROL
+
+
+def mark_cacheable_prefix(provider: Any, messages: List[Any]) -> List[Any]:
+    """
+    Пометить системное сообщение (статический префикс) для кэширования провайдером.
+
+    OpenAI кэширует общий префикс автоматически, Anthropic - только помеченные блоки.
+    """
+    if not ai_settings.prompt_cache or provider != ModelProvider.ANTHROPIC or not messages:
+        return messages
+    first = messages[0]
+    if not isinstance(first, SystemMessage) or not isinstance(first.content, str) or not first.content:
+        return messages
+    if not anthropic_supports_cache_control():
+        return messages
+    block = {"type": "text", "text": first.content, "cache_control": CACHE_CONTROL}
+    return [SystemMessage(content=[block]), *messages[1:]]
@@ -0,0 +1,94 @@
+"""Неизменяемый индексированный снимок промптов с экспортом в файл."""
+import json
+import os
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple, Type
+
+from shared.prompt_templates import compile_template
+
+# Версия формата файла снимка
+SNAPSHOT_FORMAT = 1
+
+
+class PromptSnapshot:
+    """
+    Снимок промптов, построенный один раз на изменение.
+    
+    Читатели берут ссылку на снимок без блокировок; писатели собирают новый снимок и подменяют ссылку.
+    """
+    
+    __slots__ = ("prompts", "active", "_by_type", "_by_agent")
+    
+    def __init__(self, prompts: Iterable[Any] = ()):
+        """Построить индексы: промпты по id, активные по агенту и (агент, тип), активная версия по (агент, тип)."""
+        by_id = {prompt.id: prompt for prompt in prompts}
+        by_type: Dict[Tuple[str, str], List[Any]] = {}
+        for prompt in by_id.values():
+            # Шаблоны разбираются при построении снимка, рендер использует готовый разбор
+            compile_template(prompt.template)
+            if prompt.is_active:
+                by_type.setdefault((prompt.agent_type, prompt.prompt_type), []).append(prompt)
+        
+        by_agent: Dict[str, List[Any]] = {}
+        for key, items in by_type.items():
+            items.sort(key=lambda p: p.version, reverse=True)
+            by_agent.setdefault(key[0], []).extend(items)
+        
+        self.prompts: Mapping[str, Any] = MappingProxyType(by_id)
+        self.active: Mapping[Tuple[str, str], Any] = MappingProxyType({key: items[0] for key, items in by_type.items()})
+        self._by_type = {key: tuple(items) for key, items in by_type.items()}
+        self._by_agent = {agent: tuple(items) for agent, items in by_agent.items()}
+    
+    def __len__(self) -> int:
+        return len(self.prompts)
+    
+    def get(self, prompt_id: str) -> Optional[Any]:
+        """Промпт по id."""
+        return self.prompts.get(prompt_id)
+    
+    def by_agent(self, agent_type: str, prompt_type: Optional[str] = None) -> List[Any]:
+        """Активные промпты агента (последние версии первыми)."""
+        if prompt_type:
+            return list(self._by_type.get((agent_type, prompt_type), ()))
+        return list(self._by_agent.get(agent_type, ()))
+    
+    def get_active(self, agent_type: str, prompt_type: str) -> Optional[Any]:
+        """Активная (последняя) версия промпта агента."""
+        return self.active.get((agent_type, prompt_type))
+    
+    def replace(self, prompt: Any) -> "PromptSnapshot":
+        """Новый снимок с добавленным или замененным промптом (текущий снимок не меняется)."""
+        prompts = dict(self.prompts)
+        prompts[prompt.id] = prompt
+        return PromptSnapshot(prompts.values())
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Снимок в виде словаря для JSON."""
+        return {
+            "format": SNAPSHOT_FORMAT,
+            "created_at": datetime.utcnow().isoformat(),
+            "prompts": [prompt.dict() for prompt in self.prompts.values()],
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], model: Type[Any]) -> "PromptSnapshot":
+        """Восстановить снимок из словаря."""
+        if data.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported prompt snapshot format: {data.get('format')}")
+        return cls(model(**item) for item in data["prompts"])
+    
+    def export(self, path: str):
+        """Записать снимок в JSON файл (атомарно)."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str, model: Type[Any]) -> "PromptSnapshot":
+        """Прочитать снимок из JSON файла."""
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f), model)
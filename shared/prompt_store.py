@@ -1,9 +1,14 @@
 """Хранилище промптов для ИИ агентов."""
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Mapping, Tuple
 from pydantic import BaseModel
 from datetime import datetime
+import os
+import threading
 import uuid
 import json
+from shared.ai_config import ai_settings
+from shared.prompt_snapshot import PromptSnapshot
+from shared.prompt_templates import compile_template, validate_template
 
 
 class PromptTemplate(BaseModel):
@@ -23,18 +28,48 @@ class PromptTemplate(BaseModel):
 
 
 class PromptStore:
-    """Хранилище промптов."""
+    """Хранилище промптов в памяти (неизменяемый снимок, подменяемый при записи)."""
     
-    def __init__(self):
-        """Инициализация хранилища."""
-        self.prompts: Dict[str, PromptTemplate] = {}
+    def __init__(self, snapshot_path: Optional[str] = None):
+        """
+        Инициализация хранилища.
+        
+        Args:
+            snapshot_path: Файл снимка промптов; его промпты заменяют промпты по умолчанию с тем же id
+        """
+        self._write_lock = threading.Lock()
+        self._snapshot = PromptSnapshot()
         self._load_default_prompts()
+        path = ai_settings.prompt_snapshot_path if snapshot_path is None else snapshot_path
+        if path and os.path.exists(path):
+            self.import_snapshot(path)
+    
+    @property
+    def prompts(self) -> Mapping[str, PromptTemplate]:
+        """Промпты текущего снимка по id (только чтение)."""
+        return self._snapshot.prompts
     
     def _load_default_prompts(self):
         """Загрузить промпты по умолчанию."""
         default_prompts = self._get_default_prompts()
         for prompt in default_prompts:
-            self.prompts[prompt["id"]] = PromptTemplate(**prompt)
+            validate_template(prompt["template"], prompt["variables"])
+        self._snapshot = PromptSnapshot(PromptTemplate(**prompt) for prompt in default_prompts)
+    
+    def snapshot(self) -> PromptSnapshot:
+        """Текущий снимок промптов."""
+        return self._snapshot
+    
+    def export_snapshot(self, path: str):
+        """Сохранить снимок в файл (для быстрого старта без Supabase)."""
+        self._snapshot.export(path)
+    
+    def import_snapshot(self, path: str):
+        """Загрузить промпты из файла снимка поверх текущих."""
+        loaded = PromptSnapshot.load(path, PromptTemplate)
+        with self._write_lock:
+            prompts = {**self._snapshot.prompts, **loaded.prompts}
+            self._snapshot = PromptSnapshot(prompts.values())
     
     def _get_default_prompts(self) -> List[Dict[str, Any]]:
         """Получить промпты по умолчанию."""
@@ -56,9 +91,6 @@ Your task is to analyze project parameters and provide recommendations for:
 5. Risk identification
 6. Requirements management workflow
 
-Project data:
-{project_data}
-
 Return the analysis as JSON with structure:
 {{
     "recommendations": ["recommendation1", "recommendation2"],
@@ -66,7 +98,10 @@ Return the analysis as JSON with structure:
     "risks": ["risk1", "risk2"],
     "methodology_suggestions": "...",
     "team_roles": ["role1", "role2"]
-}}""",
+}}
+
+Project data:
+{project_data}""",
                 "variables": ["project_data"],
                 "version": 1,
                 "is_active": True,
@@ -122,19 +157,19 @@ Return the formalized requirement as a JSON object.""",
 Analyze if the new requirement is a duplicate of any existing requirements.
 Consider semantic similarity, not just exact text matches.
 
-New requirement:
-{new_requirement}
-
-Existing requirements:
-{existing_requirements}
-
 Return JSON:
 {{
     "is_duplicate": true/false,
     "duplicate_of": ["requirement_id1", "requirement_id2"],
     "similarity_score": 0.0-1.0,
     "reason": "explanation"
-}}""",
+}}
+
+New requirement:
+{new_requirement}
+
+Existing requirements:
+{existing_requirements}""",
                 "variables": ["new_requirement", "existing_requirements"],
                 "version": 1,
                 "is_active": True,
@@ -151,12 +186,6 @@ Return JSON:
                 "template": """You are an expert in requirement analysis.
 Identify conflicts and contradictions between requirements.
 
-Requirement to check:
-{requirement}
-
-Other requirements:
-{other_requirements}
-
 Return JSON:
 {{
     "has_conflicts": true/false,
@@ -168,7 +197,13 @@ Return JSON:
             "severity": "low|medium|high|critical"
         }}
     ]
-}}""",
+}}
+
+Requirement to check:
+{requirement}
+
+Other requirements:
+{other_requirements}""",
                 "variables": ["requirement", "other_requirements"],
                 "version": 1,
                 "is_active": True,
@@ -228,27 +263,15 @@ Generate OpenAPI 3.0 specification in JSON format.""",
     
     def get_prompt(self, prompt_id: str) -> Optional[PromptTemplate]:
         """Получить промпт по ID."""
-        return self.prompts.get(prompt_id)
+        return self._snapshot.get(prompt_id)
     
     def get_prompts_by_agent(self, agent_type: str, prompt_type: Optional[str] = None) -> List[PromptTemplate]:
         """Получить промпты для агента."""
-        prompts = [
-            p for p in self.prompts.values()
-            if p.agent_type == agent_type and p.is_active
-        ]
-        
-        if prompt_type:
-            prompts = [p for p in prompts if p.prompt_type == prompt_type]
-        
-        return prompts
+        return self._snapshot.by_agent(agent_type, prompt_type)
     
     def get_active_prompt(self, agent_type: str, prompt_type: str) -> Optional[PromptTemplate]:
         """Получить активный промпт для агента и типа."""
-        prompts = self.get_prompts_by_agent(agent_type, prompt_type)
-        if prompts:
-            # Возвращаем последнюю версию
-            return max(prompts, key=lambda p: p.version)
-        return None
+        return self._snapshot.get_active(agent_type, prompt_type)
     
     def render_prompt(self, prompt_id: str, variables: Dict[str, Any]) -> str:
         """Отрендерить промпт с переменными."""
@@ -256,35 +279,43 @@ Generate OpenAPI 3.0 specification in JSON format.""",
         if not prompt:
             raise ValueError(f"Prompt {prompt_id} not found")
         
-        try:
-            return prompt.template.format(**variables)
-        except KeyError as e:
-            raise ValueError(f"Missing variable in prompt: {e}")
+        return compile_template(prompt.template).render(variables)
+    
+    def render_parts(self, prompt_id: str, variables: Dict[str, Any]) -> Tuple[str, str]:
+        """Отрендерить промпт в пару (статический префикс, динамический суффикс)."""
+        prompt = self.get_prompt(prompt_id)
+        if not prompt:
+            raise ValueError(f"Prompt {prompt_id} not found")
+        return compile_template(prompt.template).render_parts(variables)
     
     def add_prompt(self, prompt: PromptTemplate):
-        """Добавить новый промпт."""
-        self.prompts[prompt.id] = prompt
+        """Добавить новый промпт (TemplateError, если шаблон не совпадает с переменными)."""
+        validate_template(prompt.template, prompt.variables)
+        with self._write_lock:
+            self._snapshot = self._snapshot.replace(prompt)
     
     def update_prompt(self, prompt_id: str, updates: Dict[str, Any]) -> Optional[PromptTemplate]:
-        """Обновить промпт."""
-        prompt = self.get_prompt(prompt_id)
-        if not prompt:
-            return None
-        
-        # Создать новую версию
-        prompt_dict = prompt.dict()
-        prompt_dict.update(updates)
-        prompt_dict["version"] = prompt.version + 1
-        prompt_dict["updated_at"] = datetime.utcnow().isoformat()
-        
-        updated_prompt = PromptTemplate(**prompt_dict)
-        self.prompts[prompt_id] = updated_prompt
+        """Обновить промпт (TemplateError, если шаблон не совпадает с переменными)."""
+        with self._write_lock:
+            prompt = self.get_prompt(prompt_id)
+            if not prompt:
+                return None
+            
+            # Создать новую версию
+            prompt_dict = prompt.dict()
+            prompt_dict.update(updates)
+            prompt_dict["version"] = prompt.version + 1
+            prompt_dict["updated_at"] = datetime.utcnow().isoformat()
+            validate_template(prompt_dict["template"], prompt_dict["variables"])
+            
+            updated_prompt = PromptTemplate(**prompt_dict)
+            self._snapshot = self._snapshot.replace(updated_prompt)
         
         return updated_prompt
     
     def list_prompts(self) -> List[PromptTemplate]:
         """Получить список всех промптов."""
-        return list(self.prompts.values())
+        return list(self._snapshot.prompts.values())
 
 
 # Глобальный экземпляр (будет переопределен если Supabase доступен)
@@ -1,9 +1,15 @@
 """Хранилище промптов в Supabase."""
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from pydantic import BaseModel
 from datetime import datetime
+import os
+import threading
+import time
 import uuid
 import json
+from shared.ai_config import ai_settings
+from shared.prompt_snapshot import PromptSnapshot
+from shared.prompt_templates import compile_template, validate_template
 from shared.supabase_config import SupabaseClient
 
 
@@ -24,14 +30,35 @@ class PromptTemplate(BaseModel):
 
 
 class SupabasePromptStore:
-    """Хранилище промптов в Supabase."""
+    """Хранилище промптов в Supabase с кэшем активных промптов в памяти процесса."""
     
-    def __init__(self):
-        """Инициализация хранилища."""
+    def __init__(self, cache_ttl: Optional[float] = None, realtime: Optional[bool] = None):
+        """
+        Инициализация хранилища.
+        
+        Args:
+            cache_ttl: Через сколько секунд проверять, изменились ли промпты в Supabase
+            realtime: Сбрасывать кэш по событиям Supabase Realtime таблицы prompts.prompts
+        """
         self.supabase = SupabaseClient.get_service_client()
         self.schema = "prompts"  # Отдельная схема для промптов
+        self.cache_ttl = ai_settings.prompt_store_ttl if cache_ttl is None else cache_ttl
+        # Кэш: снимок последних активных версий и метка изменений таблицы
+        self._snapshot = PromptSnapshot()
+        self._marker: Optional[Tuple[Any, Any]] = None
+        self._checked_at: Optional[float] = None
+        self._cache_lock = threading.Lock()
+        self.cache_counters = {"hits": 0, "loads": 0, "polls": 0, "invalidations": 0}
+        # Снимок из файла отдается, пока Supabase недоступен
+        if ai_settings.prompt_snapshot_path and os.path.exists(ai_settings.prompt_snapshot_path):
+            try:
+                self._snapshot = PromptSnapshot.load(ai_settings.prompt_snapshot_path, PromptTemplate)
+            except Exception as e:
+                print(f"Error loading prompt snapshot: {e}")
         self._ensure_schema_exists()
         self._load_default_prompts()
+        if ai_settings.prompt_store_realtime if realtime is None else realtime:
+            self._subscribe_to_changes()
     
     def _ensure_schema_exists(self):
         """Создать схему prompts если не существует."""
@@ -96,9 +123,6 @@ Your task is to analyze project parameters and provide recommendations for:
 5. Risk identification
 6. Requirements management workflow
 
-Project data:
-{project_data}
-
 Return the analysis as JSON with structure:
 {{
     "recommendations": ["recommendation1", "recommendation2"],
@@ -106,7 +130,10 @@ Return the analysis as JSON with structure:
     "risks": ["risk1", "risk2"],
     "methodology_suggestions": "...",
     "team_roles": ["role1", "role2"]
-}}""",
+}}
+
+Project data:
+{project_data}""",
                 "variables": ["project_data"],
                 "version": 1,
                 "is_active": True,
@@ -162,19 +189,19 @@ Return the formalized requirement as a JSON object.""",
 Analyze if the new requirement is a duplicate of any existing requirements.
 Consider semantic similarity, not just exact text matches.
 
-New requirement:
-{new_requirement}
-
-Existing requirements:
-{existing_requirements}
-
 Return JSON:
 {{
     "is_duplicate": true/false,
     "duplicate_of": ["requirement_id1", "requirement_id2"],
     "similarity_score": 0.0-1.0,
     "reason": "explanation"
-}}""",
+}}
+
+New requirement:
+{new_requirement}
+
+Existing requirements:
+{existing_requirements}""",
                 "variables": ["new_requirement", "existing_requirements"],
                 "version": 1,
                 "is_active": True,
@@ -191,12 +218,6 @@ Return JSON:
                 "template": """You are an expert in requirement analysis.
 Identify conflicts and contradictions between requirements.
 
-Requirement to check:
-{requirement}
-
-Other requirements:
-{other_requirements}
-
 Return JSON:
 {{
     "has_conflicts": true/false,
@@ -208,7 +229,13 @@ Return JSON:
             "severity": "low|medium|high|critical"
         }}
     ]
-}}""",
+}}
+
+Requirement to check:
+{requirement}
+
+Other requirements:
+{other_requirements}""",
                 "variables": ["requirement", "other_requirements"],
                 "version": 1,
                 "is_active": True,
@@ -266,70 +293,91 @@ Generate OpenAPI 3.0 specification in JSON format.""",
             },
         ]
     
-    def get_prompt(self, prompt_id: str) -> Optional[PromptTemplate]:
-        """Получить промпт по ID."""
-        if not self.supabase:
-            return None
+    def _change_marker(self) -> Optional[Tuple[Any, Any]]:
+        """Метка изменений таблицы: число строк и последнее updated_at (одна строка ответа)."""
+        result = self.supabase.table(f"{self.schema}.prompts").select(
+            "updated_at", count="exact"
+        ).order("updated_at", desc=True).limit(1).execute()
+        return result.count, result.data[0]["updated_at"] if result.data else None
+    
+    def _load_cache(self):
+        """Загрузить активные промпты одним запросом и построить индексы."""
+        result = self.supabase.table(f"{self.schema}.prompts").select("*").eq(
+            "is_active", True
+        ).order("version", desc=True).execute()
+        
+        # Группировать по id и взять последнюю версию
+        by_id: Dict[str, PromptTemplate] = {}
+        for item in result.data:
+            if item["id"] not in by_id or item["version"] > by_id[item["id"]].version:
+                by_id[item["id"]] = PromptTemplate(**item)
         
+        self._snapshot = PromptSnapshot(by_id.values())
+        self.cache_counters["loads"] += 1
+    
+    def _ensure_cache(self):
+        """Обновить кэш, если истек TTL и метка изменений в Supabase сменилась."""
+        if self._checked_at is not None and time.monotonic() - self._checked_at < self.cache_ttl:
+            self.cache_counters["hits"] += 1
+            return
+        
+        with self._cache_lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < self.cache_ttl:
+                self.cache_counters["hits"] += 1
+                return
+            marker = self._change_marker()
+            self.cache_counters["polls"] += 1
+            if marker != self._marker or self._checked_at is None:
+                self._load_cache()
+                self._marker = marker
+            self._checked_at = time.monotonic()
+    
+    def invalidate_cache(self, *args: Any):
+        """Сбросить кэш (следующее чтение проверит Supabase)."""
+        self._checked_at = None
+        self.cache_counters["invalidations"] += 1
+    
+    def _subscribe_to_changes(self):
+        """Подписаться на изменения prompts.prompts через Supabase Realtime."""
         try:
-            result = self.supabase.table(f"{self.schema}.prompts").select("*").eq(
-                "id", prompt_id
-            ).eq("is_active", True).order("version", desc=True).limit(1).execute()
-            
-            if result.data:
-                return PromptTemplate(**result.data[0])
-            return None
+            from shared.realtime import realtime_manager
+            realtime_manager.subscribe_to_table(self.schema, "prompts", self.invalidate_cache)
         except Exception as e:
-            print(f"Error getting prompt {prompt_id}: {e}")
+            print(f"Prompt cache realtime invalidation disabled: {e}")
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Статистика кэша промптов."""
+        return {"prompts": len(self._snapshot), "ttl": self.cache_ttl, **self.cache_counters}
+    
+    def snapshot(self) -> PromptSnapshot:
+        """Текущий снимок промптов (обновляется, если истек TTL)."""
+        try:
+            self._ensure_cache()
+        except Exception as e:
+            print(f"Error refreshing prompts: {e}")
+        return self._snapshot
+    
+    def export_snapshot(self, path: str):
+        """Сохранить снимок в файл (для быстрого старта без Supabase)."""
+        self.snapshot().export(path)
+    
+    def get_prompt(self, prompt_id: str) -> Optional[PromptTemplate]:
+        """Получить промпт по ID (при ошибке Supabase - из последнего снимка)."""
+        if not self.supabase:
             return None
+        return self.snapshot().get(prompt_id)
     
     def get_prompts_by_agent(self, agent_type: str, prompt_type: Optional[str] = None) -> List[PromptTemplate]:
         """Получить промпты для агента."""
         if not self.supabase:
             return []
-        
-        try:
-            # Использовать функцию для получения промптов агента
-            result = self.supabase.rpc(
-                "get_agent_prompts",
-                {
-                    "agent_type_param": agent_type,
-                    "prompt_type_param": prompt_type
-                }
-            ).execute()
-            
-            if result.data:
-                return [PromptTemplate(**p) for p in result.data]
-            
-            # Fallback на прямой запрос
-            query = self.supabase.table(f"{self.schema}.prompts").select("*").eq(
-                "agent_type", agent_type
-            ).eq("is_active", True)
-            
-            if prompt_type:
-                query = query.eq("prompt_type", prompt_type)
-            
-            result = query.order("version", desc=True).execute()
-            
-            # Группировать по id и взять последнюю версию каждого
-            prompts_dict = {}
-            for item in result.data:
-                prompt_id = item["id"]
-                if prompt_id not in prompts_dict or item["version"] > prompts_dict[prompt_id]["version"]:
-                    prompts_dict[prompt_id] = item
-            
-            return [PromptTemplate(**p) for p in prompts_dict.values()]
-        except Exception as e:
-            print(f"Error getting prompts for agent {agent_type}: {e}")
-            return []
+        return self.snapshot().by_agent(agent_type, prompt_type)
     
     def get_active_prompt(self, agent_type: str, prompt_type: str) -> Optional[PromptTemplate]:
         """Получить активный промпт для агента и типа."""
-        prompts = self.get_prompts_by_agent(agent_type, prompt_type)
-        if prompts:
-            # Возвращаем последнюю версию
-            return max(prompts, key=lambda p: p.version)
-        return None
+        if not self.supabase:
+            return None
+        return self.snapshot().get_active(agent_type, prompt_type)
     
     def render_prompt(self, prompt_id: str, variables: Dict[str, Any]) -> str:
         """Отрендерить промпт с переменными."""
@@ -337,15 +385,20 @@ Generate OpenAPI 3.0 specification in JSON format.""",
         if not prompt:
             raise ValueError(f"Prompt {prompt_id} not found")
         
-        try:
-            return prompt.template.format(**variables)
-        except KeyError as e:
-            raise ValueError(f"Missing variable in prompt: {e}")
+        return compile_template(prompt.template).render(variables)
+    
+    def render_parts(self, prompt_id: str, variables: Dict[str, Any]) -> Tuple[str, str]:
+        """Отрендерить промпт в пару (статический префикс, динамический суффикс)."""
+        prompt = self.get_prompt(prompt_id)
+        if not prompt:
+            raise ValueError(f"Prompt {prompt_id} not found")
+        return compile_template(prompt.template).render_parts(variables)
     
     def add_prompt(self, prompt: PromptTemplate):
-        """Добавить новый промпт."""
+        """Добавить новый промпт (TemplateError, если шаблон не совпадает с переменными)."""
         if not self.supabase:
             return
+        validate_template(prompt.template, prompt.variables)
         
         try:
             prompt_dict = prompt.dict()
@@ -356,12 +409,13 @@ Generate OpenAPI 3.0 specification in JSON format.""",
                 prompt_dict["metadata"] = prompt_dict["metadata"]
             
             self.supabase.table(f"{self.schema}.prompts").insert(prompt_dict).execute()
+            self.invalidate_cache()
         except Exception as e:
             print(f"Error adding prompt: {e}")
             raise
     
     def update_prompt(self, prompt_id: str, updates: Dict[str, Any]) -> Optional[PromptTemplate]:
-        """Обновить промпт (создает новую версию)."""
+        """Обновить промпт (создает новую версию; TemplateError, если шаблон не совпадает с переменными)."""
         if not self.supabase:
             return None
         
@@ -376,9 +430,11 @@ Generate OpenAPI 3.0 specification in JSON format.""",
         new_version["version"] = current.version + 1
         new_version["updated_at"] = datetime.utcnow().isoformat()
         new_version["created_at"] = current.created_at  # Сохранить оригинальную дату создания
+        validate_template(new_version["template"], new_version["variables"])
         
         try:
             self.supabase.table(f"{self.schema}.prompts").insert(new_version).execute()
+            self.invalidate_cache()
             return PromptTemplate(**new_version)
         except Exception as e:
             print(f"Error updating prompt: {e}")
@@ -388,23 +444,7 @@ Generate OpenAPI 3.0 specification in JSON format.""",
         """Получить список всех промптов."""
         if not self.supabase:
             return []
-        
-        try:
-            result = self.supabase.table(f"{self.schema}.prompts").select("*").eq(
-                "is_active", True
-            ).order("version", desc=True).execute()
-            
-            # Группировать по id и взять последнюю версию
-            prompts_dict = {}
-            for item in result.data:
-                prompt_id = item["id"]
-                if prompt_id not in prompts_dict or item["version"] > prompts_dict[prompt_id]["version"]:
-                    prompts_dict[prompt_id] = item
-            
-            return [PromptTemplate(**p) for p in prompts_dict.values()]
-        except Exception as e:
-            print(f"Error listing prompts: {e}")
-            return []
+        return list(self.snapshot().prompts.values())
 
 
 # Глобальный экземпляр (использует Supabase если доступен, иначе in-memory)
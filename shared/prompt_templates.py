@@ -0,0 +1,124 @@
+"""Шаблоны промптов: разбор один раз при загрузке, статический префикс (кэшируемый провайдером) и суффикс с данными."""
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+# Токены шаблона: {{ и }} - экранированные скобки, {name} - переменная; остальные скобки (примеры JSON) - текст
+_TOKEN = re.compile(r"\{\{|\}\}|\{([A-Za-z_][A-Za-z0-9_]*)\}")
+
+# Часть шаблона: текст или имя переменной (кортеж из одного элемента)
+Part = Union[str, Tuple[str]]
+
+
+class TemplateError(ValueError):
+    """Шаблон промпта не соответствует объявленным переменным."""
+
+
+def _tokenize(template: str) -> Tuple[List[Part], Optional[int]]:
+    """Разобрать шаблон на части; вернуть также позицию первой переменной в исходном тексте."""
+    parts: List[Part] = []
+    text: List[str] = []
+    first_variable = None
+    position = 0
+    for match in _TOKEN.finditer(template):
+        text.append(template[position:match.start()])
+        token = match.group(0)
+        if token == "{{":
+            text.append("{")
+        elif token == "}}":
+            text.append("}")
+        else:
+            if first_variable is None:
+                first_variable = match.start()
+            if text:
+                parts.append("".join(text))
+                text = []
+            parts.append((match.group(1),))
+        position = match.end()
+    text.append(template[position:])
+    if any(text):
+        parts.append("".join(text))
+    return [p for p in parts if p != ""], first_variable
+
+
+class CompiledTemplate:
+    """Разобранный шаблон: рендер склеивает готовые части без повторного разбора."""
+    
+    __slots__ = ("source", "variables", "prefix", "_parts", "_suffix")
+    
+    def __init__(self, source: str):
+        """Разобрать шаблон."""
+        self.source = source
+        self._parts, first_variable = _tokenize(source)
+        self.variables: Tuple[str, ...] = tuple(dict.fromkeys(p[0] for p in self._parts if isinstance(p, tuple)))
+        
+        # Префикс - абзацы до абзаца с первой переменной
+        prefix_source, suffix_source = _split(source, first_variable)
+        self.prefix = "".join(p for p in _tokenize(prefix_source)[0] if isinstance(p, str))
+        self._suffix = _tokenize(suffix_source)[0]
+    
+    @staticmethod
+    def _join(parts: List[Part], variables: Dict[str, Any]) -> str:
+        try:
+            return "".join(p if isinstance(p, str) else str(variables[p[0]]) for p in parts)
+        except KeyError as e:
+            raise ValueError(f"Missing variable in prompt: {e}")
+    
+    def render(self, variables: Dict[str, Any]) -> str:
+        """Отрендерить шаблон целиком."""
+        return self._join(self._parts, variables)
+    
+    def render_parts(self, variables: Dict[str, Any]) -> Tuple[str, str]:
+        """Отрендерить шаблон в пару (статический префикс, динамический суффикс)."""
+        return self.prefix, self._join(self._suffix, variables)
+    
+    def validate(self, declared: Iterable[str]):
+        """Проверить, что объявленные переменные совпадают с переменными шаблона."""
+        declared = set(declared)
+        undeclared = [name for name in self.variables if name not in declared]
+        unused = sorted(declared.difference(self.variables))
+        if undeclared or unused:
+            problems = []
+            if undeclared:
+                problems.append(f"undeclared variables {undeclared}")
+            if unused:
+                problems.append(f"declared variables not used in template {unused}")
+            raise TemplateError("Invalid prompt template: " + ", ".join(problems))
+
+
+def _split(template: str, first_variable: Optional[int]) -> Tuple[str, str]:
+    """Разделить исходный текст по абзацу с первой переменной."""
+    if first_variable is None:
+        return template, ""
+    paragraph = template.rfind("\n\n", 0, first_variable)
+    if paragraph < 0:
+        return "", template
+    return template[:paragraph].rstrip(), template[paragraph:].lstrip("\n")
+
+
+@lru_cache(maxsize=1024)
+def compile_template(template: str) -> CompiledTemplate:
+    """Разобранный шаблон (разбор выполняется один раз на текст шаблона)."""
+    return CompiledTemplate(template)
+
+
+def validate_template(template: str, variables: Iterable[str]) -> CompiledTemplate:
+    """Разобрать шаблон и проверить объявленные переменные (TemplateError при несовпадении)."""
+    compiled = compile_template(template)
+    compiled.validate(variables)
+    return compiled
+
+
+def split_template(template: str) -> Tuple[str, str]:
+    """
+    Разделить шаблон на статический префикс и динамический суффикс.
+    
+    Префикс - абзацы до абзаца с первой переменной; он одинаков для всех вызовов
+    и отправляется отдельным системным сообщением, которое провайдер может кэшировать.
+    """
+    return _split(template, _tokenize(template)[1])
+
+
+def render_parts(template: str, variables: Dict[str, Any]) -> Tuple[str, str]:
+    """Отрендерить шаблон в пару (статический префикс, динамический суффикс)."""
+    return compile_template(template).render_parts(variables)
@@ -1,5 +1,5 @@
 """Supabase Realtime для обновлений в реальном времени."""
-from typing import Callable, Optional
+from typing import Callable, Dict, Optional
 try:
     from shared.supabase_config import SupabaseClient
     from supabase import Client
@@ -73,6 +73,33 @@ class RealtimeManager:
             print(f"Error subscribing to projects: {e}")
             return None
     
+    def subscribe_to_table(self, schema: str, table: str, callback: Callable[[Dict], None]) -> Optional[str]:
+        """Подписаться на все изменения таблицы."""
+        if not self.client:
+            return None
+        
+        channel_id = f"{schema}.{table}"
+        try:
+            channel = self.client.realtime.channel(channel_id)
+            
+            channel.on(
+                "postgres_changes",
+                {
+                    "event": "*",
+                    "schema": schema,
+                    "table": table
+                },
+                callback
+            )
+            
+            channel.subscribe()
+            self.subscriptions[channel_id] = channel
+            
+            return channel_id
+        except Exception as e:
+            print(f"Error subscribing to {channel_id}: {e}")
+            return None
+    
     def unsubscribe(self, channel_id: str):
         """Отписаться от канала."""
         if channel_id in self.subscriptions:
@@ -0,0 +1,148 @@
+"""Структурированные ответы LLM: JSON режим провайдера, устойчивый разбор и проверка схемой."""
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage
+from pydantic import TypeAdapter, ValidationError
+
+from shared.ai_config import ModelProvider, ai_settings
+from shared.llm_telemetry import llm_telemetry, prompt_version
+
+# Висячая запятая перед закрывающей скобкой - частая ошибка моделей
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_JSON_FENCE = re.compile(r"```json\s*(.*?)(?:```|$)", re.DOTALL)
+
+# Сколько символов ошибки проверки передавать модели при исправлении
+REPAIR_ERROR_LIMIT = 1500
+
+
+class StructuredOutputError(ValueError):
+    """Ответ модели не удалось разобрать или он не соответствует схеме."""
+    
+    def __init__(self, message: str, content: str = ""):
+        super().__init__(message)
+        self.content = content
+
+
+@lru_cache(maxsize=None)
+def _adapter(schema: Any) -> TypeAdapter:
+    """TypeAdapter для схемы (Pydantic модель или тип вида List[str])."""
+    return TypeAdapter(schema)
+
+
+def _scan(text: str) -> Any:
+    """Найти первый JSON объект или массив в тексте, пропуская окружающий текст."""
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"[\[{]", text):
+        start = match.start()
+        for source, offset in ((text, start), (_TRAILING_COMMA.sub(r"\1", text[start:]), 0)):
+            try:
+                value, _ = decoder.raw_decode(source, offset)
+            except ValueError:
+                continue
+            if isinstance(value, (dict, list)):
+                return value
+    raise StructuredOutputError("No JSON object or array found in model response", text)
+
+
+def extract_json(content: str) -> Any:
+    """
+    Извлечь JSON из ответа модели.
+    
+    Понимает блоки ```json, текст до и после JSON и висячие запятые.
+    """
+    text = content or ""
+    # Сначала блоки ```json, затем весь ответ
+    for candidate in [m.group(1) for m in _JSON_FENCE.finditer(text)] + [text]:
+        try:
+            return _scan(candidate)
+        except StructuredOutputError:
+            continue
+    raise StructuredOutputError("No JSON object or array found in model response", text)
+
+
+def validate_output(data: Any, schema: Any) -> Any:
+    """Проверить данные схемой и вернуть нормализованный JSON-совместимый результат."""
+    adapter = _adapter(schema)
+    try:
+        value = adapter.validate_python(data)
+    except ValidationError as e:
+        raise StructuredOutputError(str(e), json.dumps(data, ensure_ascii=False, default=str)) from e
+    return adapter.dump_python(value, mode="json")
+
+
+def parse_structured(content: str, schema: Any) -> Any:
+    """Разобрать ответ модели и проверить его схемой."""
+    try:
+        return validate_output(extract_json(content), schema)
+    except StructuredOutputError as e:
+        e.content = content
+        raise
+
+
+def native_json_kwargs(provider: Any, messages: List[Any], schema: Any) -> Dict[str, Any]:
+    """
+    Параметры JSON режима провайдера (если провайдер его поддерживает).
+    
+    Считаются для каждого клиента отдельно: резервный провайдер не принимает параметры основного.
+    """
+    if not ai_settings.structured_output:
+        return {}
+    
+    if provider in (ModelProvider.OPENAI, ModelProvider.AZURE_OPENAI, ModelProvider.OPENROUTER):
+        # json_object допускает только объект верхнего уровня и требует слово "JSON" в промпте
+        is_object = _adapter(schema).json_schema().get("type") == "object"
+        mentions_json = any("json" in str(getattr(m, "content", "")).lower() for m in messages)
+        if is_object and mentions_json:
+            return {"response_format": {"type": "json_object"}}
+    elif provider == ModelProvider.OLLAMA:
+        return {"format": "json"}
+    return {}
+
+
+def repair_messages(messages: List[Any], error: StructuredOutputError, schema: Any) -> List[Any]:
+    """Сообщения для одной точечной попытки исправить ответ модели."""
+    schema_text = json.dumps(_adapter(schema).json_schema(), ensure_ascii=False)
+    return [
+        *messages,
+        AIMessage(content=error.content),
+        HumanMessage(content=f"""Your previous reply could not be used: {str(error)[:REPAIR_ERROR_LIMIT]}
+
+Return only the corrected JSON, without explanations, matching this JSON schema:
+{schema_text}"""),
+    ]
+
+
+def _parse_repaired(content: str, schema: Any, prompt: Optional[Any]) -> Any:
+    """Разобрать исправленный ответ (неудача тоже учитывается в телеметрии промпта)."""
+    try:
+        return parse_structured(content, schema)
+    except StructuredOutputError as e:
+        llm_telemetry.record_parse_failure(prompt_version(prompt), e)
+        raise
+
+
+def invoke_structured(llm: Any, messages: List[Any], schema: Any, prompt: Optional[Any] = None) -> Any:
+    """Синхронный вызов модели со структурированным ответом и одной попыткой исправления."""
+    response = llm.invoke(messages, prompt=prompt, schema=schema)
+    try:
+        return parse_structured(response.content, schema)
+    except StructuredOutputError as e:
+        llm_telemetry.record_parse_failure(prompt_version(prompt), e)
+        llm_telemetry.record_retry("repair", e)
+        repaired = llm.invoke(repair_messages(messages, e, schema), prompt=prompt, schema=schema)
+        return _parse_repaired(repaired.content, schema, prompt)
+
+
+async def ainvoke_structured(llm: Any, messages: List[Any], schema: Any, prompt: Optional[Any] = None) -> Any:
+    """Асинхронный вызов модели со структурированным ответом и одной попыткой исправления."""
+    response = await llm.ainvoke(messages, prompt=prompt, schema=schema)
+    try:
+        return parse_structured(response.content, schema)
+    except StructuredOutputError as e:
+        llm_telemetry.record_parse_failure(prompt_version(prompt), e)
+        llm_telemetry.record_retry("repair", e)
+        repaired = await llm.ainvoke(repair_messages(messages, e, schema), prompt=prompt, schema=schema)
+        return _parse_repaired(repaired.content, schema, prompt)
@@ -1,13 +1,77 @@
 """Менеджер синхронизации между Supabase и Neo4j."""
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 try:
     from shared.supabase_config import SupabaseClient
 except ImportError:
     SupabaseClient = None
 
-from services.knowledge_base.graph_rag import KnowledgeBaseGraph
+from services.knowledge_base.graph_rag import KnowledgeBaseGraph, neo4j_settings
+from shared.precompute import analysis_precompute
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from dataclasses import dataclass, field
 import asyncio
-from datetime import datetime
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Статусы массовой синхронизации проекта
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Сколько id передавать в одном фильтре in_ (ограничение длины URL PostgREST)
+IN_FILTER_CHUNK = 200
+
+# Режимы синхронизации проекта: полная (все требования) и инкрементальная (изменения после водяного знака)
+FULL = "full"
+INCREMENTAL = "incremental"
+
+
+def _shift_timestamp(value: str, seconds: float) -> str:
+    """Сдвинуть ISO метку времени на seconds секунд."""
+    return (datetime.fromisoformat(value.replace("Z", "+00:00")) + timedelta(seconds=seconds)).isoformat()
+
+
+@dataclass
+class SyncProgress:
+    """Ход массовой синхронизации проекта."""
+    project_id: str
+    mode: str = FULL
+    status: str = RUNNING
+    total: Optional[int] = None
+    processed: int = 0
+    synced: int = 0
+    failed: int = 0
+    deleted: int = 0
+    # Последнее требование (по id), до которого все страницы записаны - точка возобновления
+    last_id: Optional[str] = None
+    resumed_from: Optional[str] = None
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Прогресс и скорость синхронизации."""
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "project_id": self.project_id,
+            "mode": self.mode,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "synced": self.synced,
+            "failed": self.failed,
+            "deleted": self.deleted,
+            "percent": round(100 * self.processed / self.total, 1) if self.total else None,
+            "last_id": self.last_id,
+            "resumed_from": self.resumed_from,
+            "elapsed_seconds": round(elapsed, 2),
+            "requirements_per_second": round(self.processed / elapsed, 1) if elapsed > 0 else None,
+            "error": self.error,
+        }
 
 
 class SyncManager:
@@ -17,6 +81,10 @@ class SyncManager:
         """Инициализация менеджера синхронизации."""
         self.supabase = SupabaseClient.get_service_client()
         self.graph = KnowledgeBaseGraph()
+        self.jobs: Dict[str, SyncProgress] = {}
+        self._jobs_lock = threading.Lock()
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.outbox_counters = {"drains": 0, "claimed": 0, "coalesced": 0, "written": 0, "deleted": 0, "failures": 0}
     
     def sync_requirement_to_graph(self, requirement_data: Dict[str, Any], project_id: str) -> bool:
         """Синхронизировать требование из Supabase в Neo4j."""
@@ -26,6 +94,7 @@ class SyncManager:
         try:
             # Импорт требования в граф
             req_id = self.graph.import_requirement(requirement_data, project_id)
+            analysis_precompute.invalidate_project(project_id)
             
             # Обновить метаданные синхронизации в Supabase (если есть таблица sync_status)
             if self.supabase:
@@ -69,39 +138,410 @@ class SyncManager:
             print(f"Error syncing from graph: {e}")
             return None
     
-    def batch_sync_requirements(self, project_id: str) -> Dict[str, Any]:
-        """Пакетная синхронизация всех требований проекта."""
+    def _start_job(self, project_id: str, mode: str) -> Tuple[Optional[SyncProgress], Optional[SyncProgress]]:
+        """Зарегистрировать синхронизацию проекта; вернуть (новая, уже идущая) - одновременно идет одна."""
+        with self._jobs_lock:
+            current = self.jobs.get(project_id)
+            if current is not None and current.status == RUNNING:
+                return None, current
+            progress = self.jobs[project_id] = SyncProgress(project_id, mode)
+            return progress, None
+    
+    def _fetch_page(self, project_id: str, after_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        """Страница требований проекта после after_id (keyset пагинация по id)."""
+        query = self.supabase.table("requirements").select("*").eq("project_id", project_id).order("id")
+        if after_id:
+            query = query.gt("id", after_id)
+        return query.limit(limit).execute().data or []
+    
+    def _count_requirements(self, project_id: str, after_id: Optional[str] = None) -> Optional[int]:
+        """Число требований проекта после after_id (None, если подсчет недоступен)."""
+        try:
+            query = self.supabase.table("requirements").select("id", count="exact").eq("project_id", project_id)
+            if after_id:
+                query = query.gt("id", after_id)
+            return query.limit(1).execute().count
+        except Exception as e:
+            print(f"Error counting requirements: {e}")
+            return None
+    
+    def _load_checkpoint(self, project_id: str) -> Optional[Dict[str, Any]]:
+        """Точка возобновления прерванной синхронизации проекта."""
+        try:
+            result = self.supabase.table("graph_sync_checkpoints").select("*").eq("project_id", project_id).execute()
+            return result.data[0] if result.data else None
+        except Exception as e:
+            print(f"Error loading sync checkpoint: {e}")  # Таблица может не существовать
+            return None
+    
+    def _save_checkpoint(self, progress: SyncProgress):
+        """Сохранить точку возобновления."""
+        try:
+            self.supabase.table("graph_sync_checkpoints").upsert({
+                "project_id": progress.project_id,
+                "last_requirement_id": progress.last_id,
+                "status": progress.status,
+                "synced": progress.synced,
+                "failed": progress.failed,
+                "updated_at": datetime.utcnow().isoformat()
+            }, on_conflict="project_id").execute()
+        except Exception as e:
+            print(f"Error saving sync checkpoint: {e}")
+    
+    def _upsert_sync_status(self, requirements: List[Dict[str, Any]], synced: bool, error: Optional[str] = None):
+        """Обновить статус синхронизации пачки требований одним запросом."""
+        now = datetime.utcnow().isoformat()
+        try:
+            self.supabase.table("requirement_sync_status").upsert([
+                {
+                    "requirement_id": req.get("id"),
+                    "synced_to_graph": synced,
+                    "synced_at": now,
+                    "graph_node_id": req.get("id") if synced else None,
+                    "error_message": error
+                }
+                for req in requirements
+            ], on_conflict="requirement_id").execute()
+        except Exception as e:
+            print(f"Error updating sync status: {e}")  # Таблица может не существовать
+    
+    def _sync_page(self, requirements: List[Dict[str, Any]], project_id: str) -> Tuple[int, int]:
+        """Записать страницу в Neo4j одной транзакцией; вернуть (успешно, с ошибкой)."""
+        try:
+            self.graph.import_requirements(requirements, project_id, batch_size=len(requirements))
+        except Exception as e:
+            print(f"Error syncing {len(requirements)} requirements to graph: {e}")
+            self._upsert_sync_status(requirements, False, str(e))
+            return 0, len(requirements)
+        # Предрасчитанные дубликаты и противоречия требований проекта могли устареть
+        analysis_precompute.invalidate_project(project_id)
+        self._upsert_sync_status(requirements, True)
+        return len(requirements), 0
+    
+    def _complete_page(self, progress: SyncProgress, future: Future, last_id: str):
+        """Дождаться записи страницы и сдвинуть точку возобновления (не дальше первой неудачной страницы)."""
+        synced, failed = future.result()
+        # Точка возобновления стоит перед первой неудачной страницей: возобновление повторит ее и последующие
+        if not failed and not progress.failed:
+            progress.last_id = last_id
+        progress.synced += synced
+        progress.failed += failed
+        progress.processed += synced + failed
+        self._save_checkpoint(progress)
+    
+    def bulk_sync_project(
+        self,
+        project_id: str,
+        resume: bool = True,
+        page_size: Optional[int] = None,
+        workers: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Массовая синхронизация проекта в Neo4j.
+        
+        Страницы читаются keyset пагинацией по id и пишутся пачками UNWIND пулом из workers потоков
+        (в работе не больше workers страниц). Страницы завершаются по порядку, поэтому сохраненная
+        точка возобновления никогда не пропускает незаписанные требования.
+        
+        Args:
+            project_id: ID проекта
+            resume: Продолжить с точки возобновления прерванной синхронизации
+            page_size: Требований на страницу (None - GRAPH_SYNC_PAGE_SIZE)
+            workers: Параллельных записей в Neo4j (None - GRAPH_SYNC_WORKERS)
+        """
         if not self.supabase:
             return {"success": False, "error": "Supabase not available"}
+        if not self.graph.available:
+            return {"success": False, "error": "Neo4j not available"}
         
+        progress, current = self._start_job(project_id, FULL)
+        if progress is None:
+            return {"success": False, "error": "Sync already running", **current.to_dict()}
+        
+        page_size = page_size or neo4j_settings.graph_sync_page_size
+        workers = workers or neo4j_settings.graph_sync_workers
+        
+        checkpoint = self._load_checkpoint(project_id) if resume else None
+        if checkpoint and checkpoint.get("status") != COMPLETED and checkpoint.get("last_requirement_id"):
+            progress.last_id = progress.resumed_from = checkpoint["last_requirement_id"]
+        progress.total = self._count_requirements(project_id, progress.last_id)
+        
+        pending: deque = deque()
         try:
-            # Получить все требования проекта из Supabase
-            response = self.supabase.table("requirements").select("*").eq(
-                "project_id", project_id
-            ).execute()
-            
-            requirements = response.data if response.data else []
-            
-            synced = 0
-            failed = 0
-            
-            for req in requirements:
-                if self.sync_requirement_to_graph(req, project_id):
-                    synced += 1
-                else:
-                    failed += 1
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="graph-sync") as pool:
+                after_id = progress.last_id
+                while True:
+                    page = self._fetch_page(project_id, after_id, page_size)
+                    if not page:
+                        break
+                    after_id = str(page[-1]["id"])
+                    pending.append((pool.submit(self._sync_page, page, project_id), after_id))
+                    # Чтение следующей страницы идет параллельно с записью предыдущих
+                    while len(pending) >= workers:
+                        self._complete_page(progress, *pending.popleft())
+                    if len(page) < page_size:
+                        break
+                while pending:
+                    self._complete_page(progress, *pending.popleft())
+            if progress.failed:
+                raise RuntimeError(f"Failed to sync {progress.failed} requirements")
+            progress.status = COMPLETED
+        except Exception as e:
+            progress.status = FAILED
+            progress.error = str(e)
+            print(f"Error in bulk sync of project {project_id}: {e}")
+        finally:
+            progress.finished_at = time.time()
+            self._save_checkpoint(progress)
+        
+        return {"success": progress.status == COMPLETED, **progress.to_dict()}
+    
+    def _load_watermark(self, project_id: str) -> Dict[str, Any]:
+        """Водяные знаки проекта: (updated_at, id) последнего синхронизированного изменения и время последнего удаления."""
+        try:
+            result = self.supabase.table("graph_sync_watermarks").select("*").eq("project_id", project_id).execute()
+            return result.data[0] if result.data else {}
+        except Exception as e:
+            print(f"Error loading sync watermark: {e}")  # Таблица может не существовать
+            return {}
+    
+    def _save_watermark(self, project_id: str, changed: Optional[Tuple[str, str]], deleted_at: Optional[str]):
+        """Сохранить водяные знаки проекта (changed - (updated_at, id) последнего синхронизированного изменения)."""
+        try:
+            self.supabase.table("graph_sync_watermarks").upsert({
+                "project_id": project_id,
+                "changed_at": changed[0] if changed else None,
+                "changed_id": changed[1] if changed else None,
+                "deleted_at": deleted_at,
+                "synced_at": datetime.utcnow().isoformat()
+            }, on_conflict="project_id").execute()
+        except Exception as e:
+            print(f"Error saving sync watermark: {e}")
+    
+    def _fetch_changes(
+        self,
+        project_id: str,
+        since: Optional[str],
+        after: Optional[Tuple[str, str]],
+        limit: int
+    ) -> List[Dict[str, Any]]:
+        """Страница измененных требований по (updated_at, id): с since на первой странице, затем после after."""
+        query = self.supabase.table("requirements").select("*").eq("project_id", project_id)
+        if after:
+            updated_at, req_id = after
+            query = query.or_(f'updated_at.gt."{updated_at}",and(updated_at.eq."{updated_at}",id.gt."{req_id}")')
+        elif since:
+            query = query.gte("updated_at", since)
+        return query.order("updated_at").order("id").limit(limit).execute().data or []
+    
+    def _fetch_deletions(self, project_id: str, since: Optional[str]) -> List[Dict[str, Any]]:
+        """Удаления требований проекта из change_history после since."""
+        query = self.supabase.table("change_history").select("entity_id, changed_at").eq(
+            "entity_type", "requirement"
+        ).eq("action", "deleted").eq("old_values->>project_id", project_id)
+        if since:
+            query = query.gt("changed_at", since)
+        return query.order("changed_at").execute().data or []
+    
+    def incremental_sync_project(self, project_id: str, page_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Инкрементальная синхронизация проекта: только требования, измененные после водяного знака.
+        
+        Изменения читаются по (updated_at, id) начиная с водяного знака минус GRAPH_SYNC_OVERLAP_SECONDS
+        (повторная запись идемпотентна; без перекрытия - строго после водяного знака), удаления - из change_history. Водяной знак сохраняется после
+        каждой страницы, поэтому стоимость запуска пропорциональна числу изменений, а не размеру проекта.
+        """
+        if not self.supabase:
+            return {"success": False, "error": "Supabase not available"}
+        if not self.graph.available:
+            return {"success": False, "error": "Neo4j not available"}
+        
+        progress, current = self._start_job(project_id, INCREMENTAL)
+        if progress is None:
+            return {"success": False, "error": "Sync already running", **current.to_dict()}
+        
+        page_size = page_size or neo4j_settings.graph_sync_page_size
+        overlap = neo4j_settings.graph_sync_overlap_seconds
+        watermark = self._load_watermark(project_id)
+        changed = (watermark["changed_at"], watermark.get("changed_id") or "") if watermark.get("changed_at") else None
+        deleted_at = watermark.get("deleted_at")
+        progress.resumed_from = changed[0] if changed else None
+        
+        try:
+            since, after = None, None
+            if changed and overlap > 0:
+                since = _shift_timestamp(changed[0], -overlap)
+            elif changed and changed[1]:
+                after = changed
+            elif changed:
+                since = changed[0]
+            while True:
+                page = self._fetch_changes(project_id, since, after, page_size)
+                if not page:
+                    break
+                synced, failed = self._sync_page(page, project_id)
+                progress.synced += synced
+                progress.failed += failed
+                progress.processed += synced + failed
+                after = (page[-1]["updated_at"], str(page[-1]["id"]))
+                progress.last_id = after[1]
+                if failed:
+                    # Водяной знак не сдвигается за неудачную страницу: следующий запуск повторит ее
+                    raise RuntimeError(f"Failed to sync {failed} changed requirements")
+                changed = max(changed or after, after)
+                self._save_watermark(project_id, changed, deleted_at)
+                if len(page) < page_size:
+                    break
             
-            return {
-                "success": True,
-                "synced": synced,
-                "failed": failed,
-                "total": len(requirements)
-            }
+            deletions = self._fetch_deletions(project_id, deleted_at)
+            if deletions:
+                progress.deleted = self.graph.delete_requirements([str(d["entity_id"]) for d in deletions])
+                analysis_precompute.invalidate_project(project_id)
+                deleted_at = deletions[-1]["changed_at"]
+                self._save_watermark(project_id, changed, deleted_at)
+            progress.status = COMPLETED
         except Exception as e:
-            return {
-                "success": False,
-                "error": str(e)
-            }
+            progress.status = FAILED
+            progress.error = str(e)
+            print(f"Error in incremental sync of project {project_id}: {e}")
+        finally:
+            progress.finished_at = time.time()
+        
+        return {"success": progress.status == COMPLETED, "watermark": changed[0] if changed else None, **progress.to_dict()}
+    
+    def _list_projects(self) -> List[str]:
+        """ID всех проектов."""
+        result = self.supabase.table("projects").select("id").execute()
+        return [str(row["id"]) for row in result.data or []]
+    
+    async def run_incremental_schedule(self, interval: Optional[float] = None):
+        """Периодическая инкрементальная синхронизация всех проектов (до отмены задачи)."""
+        interval = interval or neo4j_settings.graph_sync_interval
+        while True:
+            try:
+                for project_id in await asyncio.to_thread(self._list_projects):
+                    await asyncio.to_thread(self.incremental_sync_project, project_id)
+            except Exception as e:
+                print(f"Error in scheduled graph sync: {e}")
+            await asyncio.sleep(interval)
+    
+    def _fetch_requirements(self, requirement_ids: List[str]) -> List[Dict[str, Any]]:
+        """Текущие версии требований по id."""
+        rows: List[Dict[str, Any]] = []
+        for start in range(0, len(requirement_ids), IN_FILTER_CHUNK):
+            chunk = requirement_ids[start:start + IN_FILTER_CHUNK]
+            rows.extend(self.supabase.table("requirements").select("*").in_("id", chunk).execute().data or [])
+        return rows
+    
+    def drain_outbox(self, batch_size: Optional[int] = None) -> Dict[str, int]:
+        """
+        Обработать пачку записей очереди graph_sync_outbox.
+        
+        Записи одного требования сливаются в одну запись графа по последней операции; требования
+        пишутся текущими версиями из Supabase одним пакетом UNWIND, удаления - одним запросом.
+        При ошибке записи возвращаются в очередь с увеличенным счетчиком попыток.
+        """
+        batch_size = batch_size or neo4j_settings.graph_outbox_batch_size
+        claimed = self.supabase.rpc("claim_graph_sync_outbox", {
+            "batch_size": batch_size,
+            "worker": self.worker_id,
+            "max_attempts": neo4j_settings.graph_outbox_max_attempts
+        }).execute().data or []
+        self.outbox_counters["drains"] += 1
+        if not claimed:
+            return {"claimed": 0, "written": 0, "deleted": 0}
+        
+        entry_ids = [entry["id"] for entry in claimed]
+        latest: Dict[str, str] = {}
+        for entry in sorted(claimed, key=lambda e: e["id"]):
+            latest[str(entry["requirement_id"])] = entry["operation"]
+        
+        try:
+            rows = self._fetch_requirements([req_id for req_id, op in latest.items() if op != "delete"])
+            found = {str(row["id"]) for row in rows}
+            # Требование, которого уже нет в Supabase, удаляется и из графа
+            delete_ids = [req_id for req_id in latest if req_id not in found]
+            if rows:
+                self.graph.import_requirements(rows)
+            if delete_ids:
+                self.graph.delete_requirements(delete_ids)
+        except Exception as e:
+            print(f"Error draining graph sync outbox: {e}")
+            self.outbox_counters["failures"] += 1
+            try:
+                self.supabase.rpc("release_graph_sync_outbox", {"ids": entry_ids, "error": str(e)[:1000]}).execute()
+            except Exception as release_error:
+                print(f"Error releasing graph sync outbox entries: {release_error}")  # Будут выданы повторно по таймауту
+            return {"claimed": len(claimed), "written": 0, "deleted": 0}
+        
+        for project_id in {str(entry["project_id"]) for entry in claimed if entry.get("project_id")}:
+            analysis_precompute.invalidate_project(project_id)
+        if rows:
+            self._upsert_sync_status(rows, True)
+        try:
+            for start in range(0, len(entry_ids), IN_FILTER_CHUNK):
+                self.supabase.table("graph_sync_outbox").delete().in_("id", entry_ids[start:start + IN_FILTER_CHUNK]).execute()
+        except Exception as e:
+            print(f"Error acknowledging graph sync outbox entries: {e}")  # Повторная запись идемпотентна
+        
+        self.outbox_counters["claimed"] += len(claimed)
+        self.outbox_counters["coalesced"] += len(claimed) - len(latest)
+        self.outbox_counters["written"] += len(rows)
+        self.outbox_counters["deleted"] += len(delete_ids)
+        return {
+            "claimed": len(claimed),
+            "written": len(rows),
+            "deleted": len(delete_ids),
+            "requirement_ids": [str(row["id"]) for row in rows]
+        }
+    
+    def check_outbox(self):
+        """Проверить, что миграция очереди применена (таблица и функции claim/release); иначе RuntimeError."""
+        try:
+            self.supabase.table("graph_sync_outbox").select("id").limit(1).execute()
+            self.supabase.rpc("claim_graph_sync_outbox", {
+                "batch_size": 0,
+                "worker": self.worker_id,
+                "max_attempts": neo4j_settings.graph_outbox_max_attempts
+            }).execute()
+        except Exception as e:
+            raise RuntimeError(
+                "GRAPH_OUTBOX_ENABLED is set but graph_sync_outbox is not migrated "
+                f"(apply migrations/create_graph_sync_outbox.sql): {e}"
+            ) from e
+    
+    async def run_outbox_worker(self, poll_interval: Optional[float] = None):
+        """Обрабатывать очередь graph_sync_outbox до отмены задачи (без паузы, пока очередь не опустеет)."""
+        poll_interval = poll_interval or neo4j_settings.graph_outbox_poll_interval
+        batch_size = neo4j_settings.graph_outbox_batch_size
+        while True:
+            try:
+                result = await asyncio.to_thread(self.drain_outbox, batch_size)
+                # Анализы считаются по графу, в который уже записаны новые версии требований
+                await analysis_precompute.schedule_ids(result.get("requirement_ids", []))
+            except Exception as e:
+                print(f"Error in graph sync outbox worker: {e}")
+                result = {"claimed": 0}
+            if result["claimed"] < batch_size:
+                await asyncio.sleep(poll_interval)
+    
+    def outbox_stats(self) -> Dict[str, Any]:
+        """Счетчики обработчика очереди и число ожидающих записей."""
+        pending = None
+        try:
+            pending = self.supabase.table("graph_sync_outbox").select("id", count="exact").limit(1).execute().count
+        except Exception as e:
+            print(f"Error counting graph sync outbox: {e}")
+        return {"worker": self.worker_id, "pending": pending, **self.outbox_counters}
+    
+    def sync_progress(self, project_id: str) -> Optional[Dict[str, Any]]:
+        """Ход последней массовой синхронизации проекта."""
+        progress = self.jobs.get(project_id)
+        return progress.to_dict() if progress else None
+    
+    def batch_sync_requirements(self, project_id: str) -> Dict[str, Any]:
+        """Пакетная синхронизация всех требований проекта."""
+        return self.bulk_sync_project(project_id)
 
 
 # Глобальный экземпляр
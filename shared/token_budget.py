@@ -0,0 +1,213 @@
+"""Бюджет входных токенов агентов: урезание по релевантности и приоритету, иерархическое резюмирование."""
+import asyncio
+import re
+import threading
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from shared.ai_config import AISettings, ai_settings
+from shared.tokens import count_messages_tokens, count_tokens
+
+# Доля бюджета для урезания и резюмирования - остаток нужен повторному запросу исправления
+FIT_RATIO = 0.9
+
+# Максимум уровней иерархического резюмирования
+MAX_SUMMARY_LEVELS = 3
+
+# Вес приоритета требования (1 - наивысший, 5 - низший) относительно релевантности
+PRIORITY_WEIGHT = 0.25
+
+SUMMARY_PROMPT = """You compress lists of software requirements for further analysis.
+Summarize the requirements below into a short bullet list (at most 10 lines).
+Group them by functional area and category, keep requirement identifiers as ranges
+where possible, and do not drop areas that are mentioned.
+Return only the bullet list, one item per line."""
+
+_WORD = re.compile(r"\w{3,}")
+
+
+class PromptTooLargeError(ValueError):
+    """Промпт превышает бюджет входных токенов агента и не отправляется."""
+    
+    def __init__(self, agent: str, tokens: int, budget: int):
+        super().__init__(f"Prompt for {agent} has {tokens} tokens, budget is {budget}")
+        self.agent = agent
+        self.tokens = tokens
+        self.budget = budget
+
+
+def _terms(text: str) -> set:
+    """Значимые слова текста."""
+    return set(_WORD.findall(text.lower()))
+
+
+def relevance(query: str, text: str) -> float:
+    """Доля слов запроса, встречающихся в тексте (0.0 - 1.0)."""
+    query_terms = _terms(query)
+    if not query_terms:
+        return 0.0
+    return len(query_terms & _terms(text)) / len(query_terms)
+
+
+def requirement_priority(item: Dict) -> int:
+    """Приоритет требования (1 - наивысший, по умолчанию 3)."""
+    try:
+        return min(5, max(1, int(item.get("priority") or 3)))
+    except (TypeError, ValueError):
+        return 3
+
+
+class TokenBudget:
+    """Подсчет и соблюдение бюджета входных токенов агентов."""
+    
+    def __init__(self, settings: AISettings = ai_settings):
+        """Инициализация."""
+        self.settings = settings
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+    
+    def _count(self, agent: str, name: str, amount: int = 1):
+        """Увеличить счетчик агента."""
+        with self._lock:
+            counters = self.counters.setdefault(agent, {"trimmed_items": 0, "summaries": 0, "rejected": 0})
+            counters[name] += amount
+    
+    def limit(self, agent: str) -> int:
+        """Бюджет входных токенов агента."""
+        return self.settings.get_input_budget(agent)
+    
+    def target(self, agent: str) -> int:
+        """Размер промпта, до которого урезаются входные данные."""
+        return int(self.limit(agent) * FIT_RATIO)
+    
+    def check(self, agent: str, messages: List[Any]) -> int:
+        """Проверить промпт перед отправкой; вернуть количество токенов."""
+        tokens = count_messages_tokens(messages)
+        budget = self.limit(agent)
+        if tokens > budget:
+            self._count(agent, "rejected")
+            raise PromptTooLargeError(agent, tokens, budget)
+        return tokens
+    
+    def fits(self, agent: str, messages: List[Any]) -> bool:
+        """Помещается ли промпт в бюджет урезания."""
+        return count_messages_tokens(messages) <= self.target(agent)
+    
+    @staticmethod
+    def rank(
+        items: Sequence[Dict],
+        text_of: Callable[[Dict], str],
+        query: str = ""
+    ) -> List[Dict]:
+        """Упорядочить элементы по релевантности запросу и приоритету (самые важные первыми)."""
+        def score(item: Dict) -> float:
+            weight = PRIORITY_WEIGHT * (5 - requirement_priority(item)) / 4
+            return relevance(query, text_of(item)) + weight
+        
+        return sorted(items, key=score, reverse=True)
+    
+    def fit(
+        self,
+        agent: str,
+        items: Sequence[Any],
+        build: Callable[[Sequence[Any]], Any]
+    ) -> Tuple[Any, int]:
+        """
+        Взять наибольший префикс элементов, при котором промпт укладывается в бюджет.
+        
+        Args:
+            agent: Имя агента
+            items: Элементы в порядке важности
+            build: Функция, строящая (messages, ...) или messages по списку элементов
+        
+        Returns:
+            Кортеж (результат build, количество вошедших элементов)
+        """
+        def size(result: Any) -> int:
+            messages = result[0] if isinstance(result, tuple) else result
+            return count_messages_tokens(messages)
+        
+        target = self.target(agent)
+        result = build(items)
+        if size(result) <= target:
+            return result, len(items)
+        
+        # Двоичный поиск наибольшего подходящего префикса
+        low, high = 0, len(items) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if size(build(items[:middle])) <= target:
+                low = middle
+            else:
+                high = middle - 1
+        self._count(agent, "trimmed_items", len(items) - low)
+        return build(items[:low]), low
+    
+    def chunk(self, lines: Sequence[str]) -> List[List[str]]:
+        """Разбить строки на части не больше summary_chunk_tokens."""
+        chunks: List[List[str]] = []
+        current: List[str] = []
+        size = 0
+        for line in lines:
+            cost = count_tokens(line) + 1
+            if current and size + cost > self.settings.summary_chunk_tokens:
+                chunks.append(current)
+                current, size = [], 0
+            current.append(line)
+            size += cost
+        if current:
+            chunks.append(current)
+        return chunks
+    
+    @staticmethod
+    def _summary_messages(chunk: Sequence[str]) -> List[Any]:
+        """Сообщения для резюмирования части списка."""
+        return [SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content="\n".join(chunk))]
+    
+    @staticmethod
+    def _summary_lines(content: str) -> List[str]:
+        """Строки резюме без маркеров списка."""
+        return [line.strip().lstrip("-*• ").strip() for line in (content or "").splitlines() if line.strip()]
+    
+    def _should_summarize(self, lines: List[str], fits: Callable[[List[str]], bool], level: int) -> bool:
+        """Нужен ли следующий уровень резюмирования."""
+        return len(lines) > 1 and level < MAX_SUMMARY_LEVELS and not fits(lines)
+    
+    def summarize(self, llm: Any, agent: str, lines: List[str], fits: Callable[[List[str]], bool]) -> List[str]:
+        """
+        Иерархически резюмировать строки, пока они не поместятся в промпт.
+        
+        Каждый уровень резюмирует части списка по отдельности и объединяет резюме.
+        """
+        level = 0
+        while self._should_summarize(lines, fits, level):
+            chunks = self.chunk(lines)
+            lines = [
+                line
+                for chunk in chunks
+                for line in self._summary_lines(llm.invoke(self._summary_messages(chunk)).content)
+            ]
+            self._count(agent, "summaries", len(chunks))
+            level += 1
+        return lines
+    
+    async def asummarize(self, llm: Any, agent: str, lines: List[str], fits: Callable[[List[str]], bool]) -> List[str]:
+        """Асинхронное иерархическое резюмирование (части одного уровня резюмируются параллельно)."""
+        level = 0
+        while self._should_summarize(lines, fits, level):
+            chunks = self.chunk(lines)
+            responses = await asyncio.gather(*[llm.ainvoke(self._summary_messages(chunk)) for chunk in chunks])
+            lines = [line for response in responses for line in self._summary_lines(response.content)]
+            self._count(agent, "summaries", len(chunks))
+            level += 1
+        return lines
+    
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики урезания, резюмирования и отклоненных промптов по агентам."""
+        with self._lock:
+            return {agent: dict(counters) for agent, counters in self.counters.items()}
+
+
+# Глобальный экземпляр
+token_budget = TokenBudget()
@@ -0,0 +1,47 @@
+"""Подсчет количества токенов в промптах локальным токенизатором."""
+from functools import lru_cache
+from typing import Any, List, Optional
+
+from shared.logging_config import get_logger
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken входит в requirements.txt
+    tiktoken = None
+
+logger = get_logger(__name__)
+
+# Кодировка токенизатора (cl100k_base близка к токенизаторам всех поддерживаемых моделей)
+TOKENIZER_ENCODING = "cl100k_base"
+
+# Среднее число символов на токен для англо-русского текста (если токенизатор недоступен)
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Optional[Any]:
+    """Загрузить токенизатор (None - недоступен, используется оценка по символам)."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        # Без сети и без TIKTOKEN_CACHE_DIR файл кодировки не загрузить
+        logger.warning(f"Tokenizer {TOKENIZER_ENCODING} unavailable, falling back to character estimate: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Количество токенов в тексте."""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return max(1, len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_messages_tokens(messages: List[Any]) -> int:
+    """Количество токенов в списке сообщений."""
+    # Небольшая надбавка на служебную разметку каждого сообщения
+    return sum(count_tokens(str(getattr(m, "content", m))) + 4 for m in messages)
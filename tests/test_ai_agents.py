@@ -0,0 +1,247 @@
+"""Тесты асинхронного пути ИИ агентов."""
+import json
+import pytest
+from types import SimpleNamespace
+from services.knowledge_base.ai_agent import KnowledgeBaseAgent
+from services.requirement_processor.ai_agent import RequirementProcessorAgent
+from services.spec_generator.ai_agent import SpecificationGeneratorAgent
+from services.spec_generator.templates import SpecificationType
+from shared.llm_telemetry import llm_telemetry
+from shared.token_budget import PromptTooLargeError
+
+
+class StubLLM:
+    """LLM-заглушка: синхронный вызов запрещен, асинхронный возвращает ответ."""
+    
+    def __init__(self, content: str = "", error: Exception = None):
+        self.content = content
+        self.error = error
+        self.calls = 0
+    
+    def invoke(self, messages, **kwargs):
+        raise AssertionError("Blocking invoke must not be used on the async path")
+    
+    async def ainvoke(self, messages, **kwargs):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return SimpleNamespace(content=self.content)
+    
+    async def astream(self, messages, **kwargs):
+        self.calls += 1
+        for i in range(0, len(self.content), 4):
+            yield self.content[i:i + 4]
+
+
+def make_agent(agent_cls, llm):
+    """Создать агента без подключения к провайдеру."""
+    agent = agent_cls.__new__(agent_cls)
+    agent.llm = llm
+    return agent
+
+
+@pytest.mark.asyncio
+async def test_aanalyze_duplicates_uses_ainvoke():
+    """Тест асинхронного анализа дубликатов."""
+    payload = {"is_duplicate": True, "duplicate_of": ["REQ-2"], "similarity_score": 0.9, "reason": "same"}
+    llm = StubLLM(f"```json\n{json.dumps(payload)}\n```")
+    agent = make_agent(KnowledgeBaseAgent, llm)
+    
+    result = await agent.aanalyze_duplicates({"name": "Login"}, [{"name": "Sign in"}])
+    
+    assert result == payload
+    assert llm.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_aanalyze_completeness_fallback_on_error():
+    """Тест значения по умолчанию при ошибке провайдера."""
+    agent = make_agent(KnowledgeBaseAgent, StubLLM(error=RuntimeError("provider down")))
+    
+    result = await agent.aanalyze_completeness([], {})
+    
+    assert result["completeness_score"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_aformalize_requirement_fallback_keeps_text():
+    """Тест fallback формализации."""
+    agent = make_agent(RequirementProcessorAgent, StubLLM("not json"))
+    
+    result = await agent.aformalize_requirement("Users log in")
+    
+    assert result["identifier"] == "REQ-UNKNOWN"
+    assert result["shall"] == "Users log in"
+
+
+@pytest.mark.asyncio
+async def test_agenerate_specification_serializes_json_specs():
+    """Тест генерации JSON спецификации через асинхронный путь."""
+    agent = make_agent(SpecificationGeneratorAgent, StubLLM('{"asyncapi": "2.0.0", "channels": {}}'))
+    
+    content = await agent.agenerate_specification(SpecificationType.ASYNC_API, {"name": "Events"})
+    
+    assert json.loads(content)["asyncapi"] == "2.0.0"
+
+
+@pytest.mark.asyncio
+async def test_astream_specification_emits_tokens_then_result():
+    """Тест потоковой генерации: токены и финальное событие с артефактом."""
+    openapi = '{"openapi": "3.0.0", "paths": {"/login": {}}}'
+    agent = make_agent(SpecificationGeneratorAgent, StubLLM(openapi))
+    
+    events = [e async for e in agent.astream_specification(SpecificationType.REST_API, {"name": "Login"})]
+    
+    tokens = [e["data"] for e in events if e["event"] == "token"]
+    result = events[-1]
+    assert "".join(tokens) == openapi
+    assert result["event"] == "result"
+    assert result["data"]["format"] == "json"
+    assert result["data"]["valid"] is True
+    assert "/login" in json.loads(result["data"]["content"])["paths"]
+
+
+def test_pack_batches_respects_item_limit(monkeypatch):
+    """Тест разбиения на пакеты по количеству элементов."""
+    monkeypatch.setattr("services.requirement_processor.ai_agent.ai_settings.batch_max_items", 2)
+    agent = make_agent(RequirementProcessorAgent, StubLLM())
+    items = [{"informal_text": f"Requirement {i}"} for i in range(5)]
+    
+    assert agent._pack_batches(items, list(range(5))) == [[0, 1], [2, 3], [4]]
+
+
+@pytest.mark.asyncio
+async def test_aformalize_batch_retries_only_failed_items():
+    """Тест пакетной формализации: повторяется только невалидный элемент."""
+    prompts = []
+    
+    class BatchLLM(StubLLM):
+        async def ainvoke(self, messages, **kwargs):
+            prompts.append(messages[-1].content)
+            if len(prompts) == 1:
+                return SimpleNamespace(content=json.dumps([
+                    {"index": 0, "identifier": "REQ-001", "name": "Login", "shall": "The system shall log in",
+                     "entities": [{"name": "User", "type": "actor"}]},
+                    {"index": 1, "identifier": "REQ-002", "name": ""},
+                ]))
+            return SimpleNamespace(content=json.dumps([
+                {"index": 1, "identifier": "REQ-002", "name": "Logout", "shall": "The system shall log out"},
+            ]))
+    
+    agent = make_agent(RequirementProcessorAgent, BatchLLM())
+    
+    results = await agent.aformalize_batch([
+        {"informal_text": "Users log in"},
+        {"informal_text": "Users log out"},
+    ])
+    
+    assert [r["identifier"] for r in results] == ["REQ-001", "REQ-002"]
+    assert results[0]["entities"] == [{"name": "User", "type": "actor"}]
+    assert results[1]["entities"] == []
+    assert len(prompts) == 2
+    assert "Users log in" not in prompts[1]
+
+
+@pytest.mark.asyncio
+async def test_aformalize_batch_falls_back_to_single_item_call():
+    """Тест: элемент, невалидный во всех пакетных попытках, формализуется отдельным запросом."""
+    prompts = []
+    
+    class BatchLLM(StubLLM):
+        async def ainvoke(self, messages, **kwargs):
+            prompts.append(messages[-1].content)
+            if "JSON array" in messages[-1].content:
+                return SimpleNamespace(content=json.dumps([
+                    {"index": 0, "identifier": "REQ-001", "name": "Login", "shall": "The system shall log in"},
+                    {"index": 1, "identifier": "REQ-002", "name": ""},
+                ]))
+            return SimpleNamespace(content=json.dumps(
+                {"identifier": "REQ-002", "name": "Logout", "shall": "The system shall log out"}
+            ))
+    
+    agent = make_agent(RequirementProcessorAgent, BatchLLM())
+    
+    results = await agent.aformalize_batch([
+        {"informal_text": "Users log in"},
+        {"informal_text": "Users log out"},
+    ])
+    
+    assert [r["identifier"] for r in results] == ["REQ-001", "REQ-002"]
+    assert "error" not in results[1]
+    assert len(prompts) == 3
+    assert "Users log out" in prompts[2] and "JSON array" not in prompts[2]
+
+
+@pytest.mark.asyncio
+async def test_aformalize_batch_propagates_non_transient_errors():
+    """Тест: ошибка бюджета промпта в пакетном вызове не скрывается результатом по умолчанию."""
+    agent = make_agent(RequirementProcessorAgent, StubLLM(error=PromptTooLargeError("requirement_processor", 900, 100)))
+    
+    with pytest.raises(PromptTooLargeError):
+        await agent.aformalize_batch([{"informal_text": "Users log in"}])
+
+
+@pytest.mark.asyncio
+async def test_aformalize_batch_records_fallback_on_transient_error(monkeypatch):
+    """Тест: временная ошибка провайдера учитывается, и элемент формализуется отдельным запросом."""
+    fallbacks = []
+    monkeypatch.setattr(llm_telemetry, "record_fallback", lambda error=None: fallbacks.append(error))
+    
+    class FlakyBatchLLM(StubLLM):
+        async def ainvoke(self, messages, **kwargs):
+            if "JSON array" in messages[-1].content:
+                raise ServiceUnavailable()
+            return SimpleNamespace(content=json.dumps(
+                {"identifier": "REQ-001", "name": "Login", "shall": "The system shall log in"}
+            ))
+    
+    class ServiceUnavailable(Exception):
+        status_code = 503
+    
+    agent = make_agent(RequirementProcessorAgent, FlakyBatchLLM())
+    
+    results = await agent.aformalize_batch([{"informal_text": "Users log in"}])
+    
+    assert results[0]["identifier"] == "REQ-001"
+    assert fallbacks and isinstance(fallbacks[0], ServiceUnavailable)
+
+
+class SequenceLLM(StubLLM):
+    """LLM-заглушка, возвращающая ответы по очереди."""
+    
+    def __init__(self, *contents: str):
+        super().__init__()
+        self.contents = list(contents)
+    
+    async def ainvoke(self, messages, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(content=self.contents.pop(0))
+
+
+@pytest.mark.asyncio
+async def test_aprocess_requirement_single_call_with_entities():
+    """Тест совмещенной формализации: сущности из того же ответа, без второго вызова."""
+    formalized = {
+        "identifier": "REQ-001", "name": "Login", "shall": "The system shall log in users",
+        "entities": [{"name": "User", "type": "Actor"}, {"name": "user", "type": "actor"}, {"name": "Session", "type": "data object"}],
+    }
+    llm = SequenceLLM(json.dumps(formalized))
+    agent = make_agent(RequirementProcessorAgent, llm)
+    
+    result = await agent.aprocess_requirement("Users log in")
+    
+    assert llm.calls == 1
+    assert result["entities"] == [{"name": "User", "type": "actor"}, {"name": "Session", "type": "data_object"}]
+
+
+@pytest.mark.asyncio
+async def test_aprocess_requirement_extracts_when_no_entities():
+    """Тест отдельного извлечения сущностей, если совмещенный ответ их не содержит."""
+    formalized = {"identifier": "REQ-001", "name": "Login", "shall": "The system shall log in users"}
+    llm = SequenceLLM(json.dumps(formalized), json.dumps([{"name": "User", "type": "actor"}]))
+    agent = make_agent(RequirementProcessorAgent, llm)
+    
+    result = await agent.aprocess_requirement("Users log in")
+    
+    assert llm.calls == 2
+    assert result["entities"] == [{"name": "User", "type": "actor"}]
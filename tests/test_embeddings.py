@@ -0,0 +1,112 @@
+"""Тесты локальных векторных представлений и векторного хранилища."""
+import time
+import numpy as np
+import pytest
+from services.knowledge_base.vector_store import VectorStore
+from shared.ai_config import AISettings
+from shared.embeddings import EmbeddingProvider, HashingEmbeddings, LangChainEmbeddings, create_embedding_provider
+
+
+REQUIREMENTS = [
+    {"id": "login", "project_id": "p1", "name": "User login", "shall": "The system shall allow users to log in with email and password"},
+    {"id": "export", "project_id": "p1", "name": "Report export", "shall": "The system shall export monthly reports to PDF"},
+    {"id": "notify", "project_id": "p1", "name": "Notifications", "shall": "The system shall notify users about overdue invoices by email"},
+    {"id": "other", "project_id": "p2", "name": "Sign in", "shall": "The system shall let users sign in with email and password"},
+]
+
+
+class FixedEmbeddings:
+    """Заглушка Embeddings LangChain."""
+    
+    def embed_documents(self, texts):
+        return [[1.0, 0.0] if "login" in t.lower() else [0.0, 1.0] for t in texts]
+    
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+
+def test_hashing_embeddings_are_deterministic_and_batched():
+    """Тест: вектор текста не зависит от пакета и его соседей."""
+    provider = HashingEmbeddings(dimension=256, batch_size=2)
+    texts = ["Вход в систему по паролю", "Export reports", "", "Вход в систему по паролю"]
+    
+    vectors = provider.embed(texts)
+    
+    assert vectors.shape == (4, 256)
+    assert vectors.dtype == np.float32
+    assert np.array_equal(vectors[0], vectors[3])
+    assert np.array_equal(vectors[1], provider.embed(["Export reports"])[0])
+    assert vectors[0].sum() > 0
+
+
+def test_similar_requirements_ranked_by_cosine():
+    """Тест поиска: близкое по смыслу требование выше, фильтр по проекту и исключение самого требования."""
+    store = VectorStore(HashingEmbeddings())
+    store.batch_update(REQUIREMENTS)
+    
+    results = store.search("Users must be able to log in using their email and password", threshold=0.0)
+    
+    assert results[0]["requirement_id"] in ("login", "other")
+    assert results[-1]["requirement_id"] == "export"
+    assert all(-1.0 <= r["similarity"] <= 1.0 + 1e-6 for r in results)
+    
+    in_project = store.search(REQUIREMENTS[0]["name"] + " " + REQUIREMENTS[0]["shall"], threshold=0.0, project_id="p1", exclude="login")
+    assert [r["requirement_id"] for r in in_project][0] == "notify"
+    assert "other" not in [r["requirement_id"] for r in in_project]
+
+
+def test_update_and_remove_keep_index_consistent():
+    """Тест замены и удаления векторов."""
+    store = VectorStore(HashingEmbeddings(dimension=128))
+    store.batch_update(REQUIREMENTS)
+    store.batch_update([{"id": "export", "project_id": "p1", "name": "Password reset", "shall": "The system shall reset passwords"}])
+    
+    assert len(store) == 4
+    assert store.remove("login")
+    assert not store.remove("login")
+    assert len(store) == 3
+    
+    results = store.search("reset passwords", threshold=0.0)
+    assert results[0]["requirement_id"] == "export"
+    assert {r["requirement_id"] for r in results} == {"export", "notify", "other"}
+
+
+@pytest.mark.asyncio
+async def test_remote_provider_vectors_are_normalized():
+    """Тест удаленного провайдера: пакетный асинхронный расчет и косинусное сходство."""
+    store = VectorStore(LangChainEmbeddings(FixedEmbeddings(), "fake", dimension=2, batch_size=1))
+    await store.abatch_update(REQUIREMENTS)
+    
+    results = store.find_similar([3.0, 0.0], threshold=0.5)
+    
+    assert [r["requirement_id"] for r in results] == ["login"]
+    assert results[0]["similarity"] == pytest.approx(1.0)
+    with pytest.raises(ValueError):
+        store.update_embeddings("bad", "text", [1.0, 0.0, 0.0])
+
+
+def test_unavailable_provider_falls_back_to_local():
+    """Тест: удаленный провайдер без ключа заменяется локальным."""
+    provider = create_embedding_provider(AISettings(AI_EMBEDDING_PROVIDER="openai", OPENAI_API_KEY=""))
+    
+    assert isinstance(provider, HashingEmbeddings)
+    assert isinstance(provider, EmbeddingProvider)
+
+
+def test_project_of_10k_requirements_embeds_in_seconds():
+    """Тест производительности: 10 тысяч требований векторизуются за секунды."""
+    words = "user system shall login password report export data access order payment invoice email account".split()
+    rng = np.random.default_rng(1)
+    requirements = [{
+        "id": f"REQ-{i}",
+        "name": " ".join(rng.choice(words, 3)),
+        "shall": "The system shall " + " ".join(rng.choice(words, 20))
+    } for i in range(10000)]
+    store = VectorStore(HashingEmbeddings())
+    
+    started = time.monotonic()
+    store.batch_update(requirements)
+    store.search("user login password")
+    
+    assert time.monotonic() - started < 10
+    assert len(store) == 10000
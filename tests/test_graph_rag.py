@@ -1,7 +1,19 @@
 """Тесты для Graph RAG."""
 import pytest
+from contextlib import contextmanager
 from unittest.mock import Mock, patch, MagicMock
-from services.knowledge_base.graph_rag import KnowledgeBaseGraph, Neo4jSettings
+import asyncio
+from types import SimpleNamespace
+from contextlib import asynccontextmanager
+from neo4j.exceptions import ClientError, ServiceUnavailable, TransientError
+from services.knowledge_base.graph_rag import (
+    AsyncKnowledgeBaseGraph,
+    KnowledgeBaseGraph,
+    Neo4jSettings,
+    IMPORT_REQUIREMENTS_QUERY,
+    DELETE_REQUIREMENTS_QUERY,
+    FIND_DUPLICATES_QUERY
+)
 from shared.exceptions import ExternalServiceError, DatabaseError
 
 
@@ -88,3 +100,269 @@ def test_close_connection(mock_neo4j_driver, mock_env_vars):
         
         mock_neo4j_driver.close.assert_called_once()
 
+
+
+class RecordingDriver:
+    """Драйвер Neo4j, записывающий транзакции и запросы."""
+    
+    def __init__(self):
+        self.transactions = []
+        self.failures = []
+    
+    def verify_connectivity(self):
+        return True
+    
+    def run(self, query, **params):
+        """Запросы схемы (ограничения и индексы)."""
+    
+    @contextmanager
+    def session(self):
+        yield self
+    
+    @contextmanager
+    def begin_transaction(self):
+        if self.failures:
+            raise self.failures.pop(0)
+        queries = []
+        self.transactions.append(queries)
+        tx = Mock()
+        tx.run.side_effect = lambda query, **params: (
+            queries.append((query, params)) or Mock(single=lambda: {
+                "imported": len(params.get("rows", [])), "deleted": len(params.get("ids", []))
+            })
+        )
+        yield tx
+
+
+@pytest.fixture
+def recording_graph(mock_env_vars):
+    driver = RecordingDriver()
+    with patch('services.knowledge_base.graph_rag.GraphDatabase.driver', return_value=driver):
+        graph = KnowledgeBaseGraph()
+    return graph, driver
+
+
+def test_import_requirement_single_statement(recording_graph):
+    """Тест: требование с сущностями записывается одним запросом в одной транзакции."""
+    graph, driver = recording_graph
+    requirement = {
+        "id": "req-1",
+        "name": "Login",
+        "entities": [{"name": f"Entity {i}", "type": "actor"} for i in range(15)]
+    }
+    
+    assert graph.import_requirement(requirement, "proj-1") == "req-1"
+    
+    assert len(driver.transactions) == 1
+    [(query, params)] = driver.transactions[0]
+    assert query == IMPORT_REQUIREMENTS_QUERY
+    [row] = params["rows"]
+    assert row["project_id"] == "proj-1"
+    assert len(row["entities"]) == 15
+    assert row["entities"][0]["id"] == "entity_req-1_Entity_0"
+
+
+def test_import_requirements_in_chunks(recording_graph):
+    """Тест: пакетный импорт - одна транзакция на пачку требований."""
+    graph, driver = recording_graph
+    requirements = [{"id": f"req-{i}", "project_id": "proj-1", "name": f"R{i}"} for i in range(2500)]
+    
+    assert graph.import_requirements(requirements, batch_size=1000) == 2500
+    
+    assert [len(tx) for tx in driver.transactions] == [1, 1, 1]
+    assert [len(tx[0][1]["rows"]) for tx in driver.transactions] == [1000, 1000, 500]
+    assert driver.transactions[0][0][1]["rows"][0]["project_id"] == "proj-1"
+
+
+def test_import_chunk_retried_on_transient_error(recording_graph, monkeypatch):
+    """Тест: временная ошибка Neo4j повторяет пачку, после исчерпания попыток - ExternalServiceError."""
+    monkeypatch.setattr("shared.retry.time", SimpleNamespace(sleep=lambda delay: None))
+    graph, driver = recording_graph
+    driver.failures = [TransientError("deadlock")]
+    
+    assert graph.import_requirements([{"id": "req-1", "project_id": "proj-1"}]) == 1
+    assert len(driver.transactions) == 1
+    
+    driver.failures = [TransientError("deadlock")] * 3
+    with pytest.raises(ExternalServiceError):
+        graph.import_requirement({"id": "req-2"}, "proj-1")
+
+
+def test_delete_retried_on_transient_error(recording_graph, monkeypatch):
+    """Тест: удаление из графа повторяется при временной ошибке Neo4j."""
+    monkeypatch.setattr("shared.retry.time", SimpleNamespace(sleep=lambda delay: None))
+    graph, driver = recording_graph
+    driver.failures = [ServiceUnavailable("leader switch")]
+    
+    assert graph.delete_requirements(["req-1", "req-2"]) == 2
+    assert driver.transactions[0][0][0] == DELETE_REQUIREMENTS_QUERY
+
+
+class FakeAsyncResult:
+    """Результат запроса асинхронного драйвера."""
+    
+    def __init__(self, records):
+        self.records = records
+    
+    async def single(self):
+        return self.records[0] if self.records else None
+    
+    async def data(self):
+        return self.records
+
+
+class FakeAsyncTransaction:
+    """Транзакция асинхронного драйвера, записывающая запросы."""
+    
+    def __init__(self, driver):
+        self.driver = driver
+        self.queries = []
+        self.committed = False
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        return False
+    
+    async def run(self, query, parameters=None, **kwparameters):
+        params = {**(parameters or {}), **kwparameters}
+        self.queries.append((query, params))
+        if self.driver.failures:
+            raise self.driver.failures.pop(0)
+        await asyncio.sleep(0.01)
+        if "rows" in params:
+            return FakeAsyncResult([{"imported": len(params["rows"])}])
+        return FakeAsyncResult(self.driver.records)
+    
+    async def commit(self):
+        self.committed = True
+
+
+class FakeAsyncDriver:
+    """Асинхронный драйвер Neo4j с ограниченным пулом соединений."""
+    
+    def __init__(self, pool_size=2, records=None):
+        self.pool_size = pool_size
+        self.records = records or []
+        self.in_use = 0
+        self.transactions = []
+        self.schema_queries = []
+        self.failures = []
+        self.closed = False
+    
+    async def verify_connectivity(self):
+        return True
+    
+    async def run(self, query, **params):
+        self.schema_queries.append(query)
+    
+    async def begin_transaction(self):
+        tx = FakeAsyncTransaction(self)
+        self.transactions.append(tx)
+        return tx
+    
+    @asynccontextmanager
+    async def session(self):
+        if self.in_use >= self.pool_size:
+            raise ClientError("failed to obtain a connection from the pool within 0.0s")
+        self.in_use += 1
+        try:
+            yield self
+        finally:
+            self.in_use -= 1
+    
+    async def close(self):
+        self.closed = True
+
+
+def async_graph(driver, **settings):
+    """Асинхронный граф с фейковым драйвером."""
+    with patch('services.knowledge_base.graph_rag.AsyncGraphDatabase.driver', return_value=driver) as factory:
+        graph = AsyncKnowledgeBaseGraph(Neo4jSettings(**settings))
+    return graph, factory
+
+
+@pytest.mark.asyncio
+async def test_async_graph_connects_lazily_with_pool_settings(mock_env_vars):
+    """Тест: подключение при первом запросе с размером пула и таймаутом получения соединения из настроек."""
+    driver = FakeAsyncDriver(records=[{"id": "req-2", "name": "Login", "score": 0.9}])
+    graph, _ = async_graph(driver, neo4j_max_pool_size=7, neo4j_acquisition_timeout=2.5)
+    
+    with patch('services.knowledge_base.graph_rag.AsyncGraphDatabase.driver', return_value=driver) as factory:
+        duplicates = await graph.find_duplicates({"name": "Login", "shall": "allow login"})
+    
+    assert duplicates == [{"id": "req-2", "name": "Login", "score": 0.9}]
+    assert factory.call_args.kwargs["max_connection_pool_size"] == 7
+    assert factory.call_args.kwargs["connection_acquisition_timeout"] == 2.5
+    assert graph.available is True
+    assert driver.schema_queries
+    [(query, params)] = driver.transactions[0].queries
+    assert query == FIND_DUPLICATES_QUERY
+    assert params["query"] == "Login allow login"
+    
+    await graph.close()
+    assert driver.closed is True
+    assert graph.available is False
+
+
+@pytest.mark.asyncio
+async def test_async_graph_import_and_pool_metrics(mock_env_vars):
+    """Тест: импорт в явной транзакции, параллельные запросы учитываются в метриках пула."""
+    driver = FakeAsyncDriver(pool_size=3)
+    graph, _ = async_graph(driver, neo4j_max_pool_size=3)
+    with patch('services.knowledge_base.graph_rag.AsyncGraphDatabase.driver', return_value=driver):
+        assert await graph.connect() is True
+    
+    ids = await asyncio.gather(*(graph.import_requirement({"id": f"req-{i}"}, "proj-1") for i in range(3)))
+    
+    assert ids == ["req-0", "req-1", "req-2"]
+    assert all(tx.committed for tx in driver.transactions)
+    stats = graph.stats()
+    assert stats["peak_in_use"] == 3
+    assert stats["in_use"] == 0
+    assert stats["sessions"] == 3
+    assert "neo4j_pool_peak_in_use 3" in graph.metrics.prometheus()
+
+
+@pytest.mark.asyncio
+async def test_async_graph_counts_acquisition_timeouts(mock_env_vars):
+    """Тест: исчерпание пула считается таймаутом получения соединения."""
+    driver = FakeAsyncDriver(pool_size=1)
+    graph, _ = async_graph(driver, neo4j_max_pool_size=1)
+    with patch('services.knowledge_base.graph_rag.AsyncGraphDatabase.driver', return_value=driver):
+        await graph.connect()
+    
+    results = await asyncio.gather(
+        graph.find_conflicts("req-1"),
+        graph.find_conflicts("req-2"),
+        return_exceptions=True
+    )
+    
+    assert results[0] == []
+    assert isinstance(results[1], DatabaseError)
+    assert graph.metrics.acquisition_timeouts == 1
+    assert graph.metrics.errors == 1
+    assert graph.metrics.in_use == 0
+
+
+@pytest.mark.asyncio
+async def test_async_graph_retries_transient_errors(mock_env_vars, monkeypatch):
+    """Тест: временные ошибки Neo4j повторяются для каждой пачки, после исчерпания попыток - ExternalServiceError."""
+    async def no_sleep(delay):
+        return None
+    
+    monkeypatch.setattr("shared.retry.asyncio", SimpleNamespace(sleep=no_sleep))
+    driver = FakeAsyncDriver(pool_size=5)
+    graph, _ = async_graph(driver)
+    with patch('services.knowledge_base.graph_rag.AsyncGraphDatabase.driver', return_value=driver):
+        await graph.connect()
+    
+    driver.failures = [TransientError("deadlock"), TransientError("deadlock")]
+    requirements = [{"id": f"req-{i}"} for i in range(4)]
+    assert await graph.import_requirements(requirements, batch_size=2) == 4
+    assert len(driver.transactions) == 4
+    
+    driver.failures = [TransientError("deadlock")] * 3
+    with pytest.raises(ExternalServiceError):
+        await graph.find_conflicts("req-1")
@@ -0,0 +1,133 @@
+"""Тесты кэша ответов LLM."""
+import pytest
+import time
+from types import SimpleNamespace
+from langchain_core.messages import HumanMessage, SystemMessage
+from shared.ai_config import ModelProvider
+from shared.llm_cache import LLMCache, make_cache_key, llm_cache
+from shared.llm_client import LLMClient
+from services.knowledge_base.schemas import DuplicateAnalysis
+
+
+CONFIG = {"provider": ModelProvider.OPENAI, "model": "gpt-4", "temperature": 0.0}
+MESSAGES = [SystemMessage(content="Extract entities"), HumanMessage(content="Users log in")]
+
+
+def test_cache_key_depends_on_prompt_version_and_messages():
+    """Тест ключа кэша."""
+    key = make_cache_key(CONFIG, MESSAGES, "kb@1")
+    
+    assert key == make_cache_key(dict(CONFIG), list(MESSAGES), "kb@1")
+    assert key != make_cache_key(CONFIG, MESSAGES, "kb@2")
+    assert key != make_cache_key({**CONFIG, "temperature": 0.7}, MESSAGES, "kb@1")
+    assert key != make_cache_key(CONFIG, MESSAGES[:1], "kb@1")
+
+
+def test_memory_tier_lru_and_ttl(monkeypatch):
+    """Тест вытеснения LRU и истечения TTL."""
+    cache = LLMCache(max_entries=2, ttl=10)
+    cache.set("a", {"content": "1"})
+    cache.set("b", {"content": "2"})
+    cache.get("a")
+    cache.set("c", {"content": "3"})
+    
+    assert cache.get("b") is None
+    assert cache.get("a") == {"content": "1"}
+    
+    now = time.time()
+    monkeypatch.setattr("shared.llm_cache.time.time", lambda: now + 11)
+    assert cache.get("a") is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    """Тест персистентного уровня."""
+    path = str(tmp_path / "llm_cache.sqlite")
+    LLMCache(path=path).set("key", {"content": "cached"})
+    
+    restarted = LLMCache(path=path)
+    
+    assert restarted.get("key") == {"content": "cached"}
+    assert restarted.stats()["disk_hits"] == 1
+
+
+def test_bypass_skips_read():
+    """Тест обхода кэша для запроса."""
+    cache = LLMCache()
+    cache.set("key", {"content": "cached"})
+    
+    with cache.bypass():
+        assert cache.get("key") is None
+    
+    assert cache.get("key") == {"content": "cached"}
+    assert cache.stats()["bypassed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_client_serves_repeat_call_from_cache():
+    """Тест повторного вызова без обращения к провайдеру."""
+    llm_cache.clear()
+    calls = []
+    
+    class CountingLLM:
+        async def ainvoke(self, messages, **kwargs):
+            calls.append(messages)
+            return SimpleNamespace(content='{"ok": true}')
+    
+    client = LLMClient(dict(CONFIG), CountingLLM())
+    
+    first = await client.ainvoke(MESSAGES, cache=True, prompt_version="kb@1")
+    second = await client.ainvoke(MESSAGES, cache=True, prompt_version="kb@1")
+    
+    assert first.content == second.content
+    assert second.response_metadata["cache_hit"] is True
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_client_does_not_cache_reply_failing_schema():
+    """Тест: ответ, не прошедший проверку схемой, не кэшируется и не мешает исправлению."""
+    llm_cache.clear()
+    replies = ['{"is_duplicate": "maybe"}', '{"is_duplicate": true}']
+    calls = []
+    
+    class RepairLLM:
+        async def ainvoke(self, messages, **kwargs):
+            calls.append(messages)
+            return SimpleNamespace(content=replies[min(len(calls), 2) - 1])
+    
+    client = LLMClient(dict(CONFIG), RepairLLM())
+    
+    bad = await client.ainvoke(MESSAGES, cache=True, prompt_version="kb@1", schema=DuplicateAnalysis)
+    good = await client.ainvoke(MESSAGES, cache=True, prompt_version="kb@1", schema=DuplicateAnalysis)
+    cached = await client.ainvoke(MESSAGES, cache=True, prompt_version="kb@1", schema=DuplicateAnalysis)
+    
+    assert bad.content == replies[0]
+    assert good.content == replies[1]
+    assert cached.response_metadata["cache_hit"] is True
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_client_stream_does_not_cache_reply_failing_schema():
+    """Тест: потоковый ответ, не прошедший проверку схемой, не кэшируется."""
+    llm_cache.clear()
+    replies = ['{"is_duplicate": "maybe"}', '{"is_duplicate": true}']
+    calls = []
+    
+    class StreamingLLM:
+        async def astream(self, messages, **kwargs):
+            calls.append(messages)
+            yield SimpleNamespace(content=replies[min(len(calls), 2) - 1])
+    
+    async def stream():
+        parts = []
+        async for text in client.astream(MESSAGES, cache=True, prompt_version="spec@1", schema=DuplicateAnalysis):
+            parts.append(text)
+        return "".join(parts)
+    
+    client = LLMClient(dict(CONFIG), StreamingLLM())
+    
+    assert await stream() == replies[0]
+    assert await stream() == replies[1]
+    assert await stream() == replies[1]
+    assert len(calls) == 2
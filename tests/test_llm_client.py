@@ -0,0 +1,69 @@
+"""Тесты реестра LLM клиентов."""
+import asyncio
+import pytest
+from types import SimpleNamespace
+from shared.ai_config import ModelProvider
+from shared.llm_client import LLMClient, LLMRegistry
+
+
+OLLAMA_CONFIG = {
+    "provider": ModelProvider.OLLAMA,
+    "model": "llama2",
+    "temperature": 0.2,
+    "api_key": None,
+    "base_url": "http://localhost:11434",
+}
+
+
+def test_registry_reuses_client_for_same_config():
+    """Тест переиспользования клиента для одинаковой конфигурации."""
+    registry = LLMRegistry()
+    
+    first = registry.get(dict(OLLAMA_CONFIG))
+    second = registry.get(dict(OLLAMA_CONFIG))
+    other = registry.get({**OLLAMA_CONFIG, "temperature": 0.9})
+    
+    assert first is second
+    assert other is not first
+    assert registry.stats()["clients"] == 2
+
+
+def test_openai_client_gets_pooled_http_clients():
+    """Тест общего HTTP пула для OpenAI-совместимых провайдеров."""
+    registry = LLMRegistry()
+    
+    client = registry.get({
+        "provider": ModelProvider.OPENAI,
+        "model": "gpt-4",
+        "temperature": 0.0,
+        "api_key": "test-key",
+    })
+    
+    assert len(client.http_clients) == 2
+    assert client.llm.http_async_client is client.http_clients[1]
+    asyncio.run(registry.aclose())
+
+
+@pytest.mark.asyncio
+async def test_client_tracks_in_flight_calls():
+    """Тест учета одновременных вызовов."""
+    release = asyncio.Event()
+    
+    class SlowLLM:
+        async def ainvoke(self, messages, **kwargs):
+            await release.wait()
+            return SimpleNamespace(content="ok")
+    
+    client = LLMClient(dict(OLLAMA_CONFIG), SlowLLM())
+    tasks = [asyncio.create_task(client.ainvoke([])) for _ in range(3)]
+    await asyncio.sleep(0)
+    
+    assert client.stats()["in_flight"] == 3
+    
+    release.set()
+    await asyncio.gather(*tasks)
+    
+    stats = client.stats()
+    assert stats["in_flight"] == 0
+    assert stats["peak_in_flight"] == 3
+    assert stats["total_calls"] == 3
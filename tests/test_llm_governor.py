@@ -0,0 +1,77 @@
+"""Тесты ограничителя вызовов LLM."""
+import asyncio
+import pytest
+from types import SimpleNamespace
+from shared.ai_config import AISettings, ModelProvider
+from shared.llm_client import LLMClient
+from shared.llm_governor import GovernorRegistry, ProviderGovernor, TokenBucket
+
+
+def test_token_bucket_delay_and_refill():
+    """Тест ожидания и пополнения ведра."""
+    bucket = TokenBucket(60)
+    now = bucket.updated_at
+    
+    assert bucket.delay(60, now) == 0
+    bucket.consume(60)
+    assert bucket.delay(1, now) == pytest.approx(1.0)
+    assert bucket.delay(1, now + 1.0) == 0
+    assert TokenBucket(0).delay(10 ** 6, now) == 0
+
+
+def test_registry_shares_governor_per_provider_and_model():
+    """Тест общего ограничителя для пары провайдер/модель и провайдер-специфичных лимитов."""
+    registry = GovernorRegistry(AISettings(AI_GOVERNOR_RPM=100, AI_ANTHROPIC_RPM=10))
+    config = {"provider": ModelProvider.ANTHROPIC, "model": "claude-3-opus-20240229"}
+    
+    governor = registry.get({**config, "temperature": 0.1})
+    
+    assert governor is registry.get({**config, "temperature": 0.9})
+    assert governor.stats()["rpm"] == 10
+    assert registry.get({"provider": ModelProvider.OPENAI, "model": "gpt-4"}).stats()["rpm"] == 100
+
+
+@pytest.mark.asyncio
+async def test_calls_queue_instead_of_exceeding_concurrency():
+    """Тест очереди: вызовы сверх лимита ждут, а не падают."""
+    governor = ProviderGovernor("openai", "gpt-4", max_concurrency=2)
+    release = asyncio.Event()
+    running = []
+    
+    class SlowLLM:
+        async def ainvoke(self, messages, **kwargs):
+            running.append(1)
+            await release.wait()
+            return SimpleNamespace(content="ok")
+    
+    client = LLMClient({"provider": ModelProvider.OPENAI, "model": "gpt-4"}, SlowLLM(), governor=governor)
+    tasks = [asyncio.create_task(client.ainvoke([])) for _ in range(5)]
+    await asyncio.sleep(0.01)
+    
+    stats = governor.stats()
+    assert len(running) == 2
+    assert stats["active"] == 2
+    assert stats["queue_depth"] == 3
+    
+    release.set()
+    results = await asyncio.gather(*tasks)
+    
+    assert all(r.content == "ok" for r in results)
+    assert governor.stats()["acquired"] == 5
+    assert governor.stats()["throttled"] >= 3
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    """Тест отмены ожидающего вызова."""
+    governor = ProviderGovernor("openai", "gpt-4", max_concurrency=1)
+    
+    async with governor.aslot():
+        waiter = asyncio.create_task(governor.aslot().__aenter__())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+    
+    assert governor.stats()["queue_depth"] == 0
+    assert governor.stats()["active"] == 0
@@ -0,0 +1,98 @@
+"""Тесты хеджирования и переключения LLM провайдеров."""
+import asyncio
+import pytest
+from types import SimpleNamespace
+from shared.ai_config import AISettings, ModelProvider
+from shared.llm_client import AgentLLM, LLMClient
+from shared.llm_hedging import HedgePolicy, LatencyTracker, is_failover_error
+
+
+class ProviderLLM:
+    """LLM-заглушка с задержкой и опциональной ошибкой."""
+    
+    def __init__(self, content: str, delay: float = 0.0, error: Exception = None):
+        self.content = content
+        self.delay = delay
+        self.error = error
+        self.cancelled = False
+    
+    async def ainvoke(self, messages, **kwargs):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return SimpleNamespace(content=self.content)
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+def make_client(provider: ModelProvider, llm) -> LLMClient:
+    """Клиент без HTTP пула и ограничителя."""
+    return LLMClient({"provider": provider, "model": "m"}, llm)
+
+
+def test_failover_error_classification():
+    """Тест распознавания ошибок для переключения."""
+    assert is_failover_error(ServerError())
+    assert is_failover_error(asyncio.TimeoutError())
+    assert not is_failover_error(ValueError("bad request"))
+
+
+def test_deadline_uses_latency_percentile():
+    """Тест срока хеджирования по перцентилю задержки."""
+    policy = HedgePolicy(hedge=True, percentile=0.9, min_delay=0.5, default_delay=7.0, min_samples=10)
+    latency = LatencyTracker()
+    
+    assert policy.deadline(latency) == 7.0
+    for i in range(1, 11):
+        latency.record(float(i))
+    assert policy.deadline(latency) == 9.0
+
+
+def test_fallback_config_for_agent():
+    """Тест конфигурации резервного провайдера агента."""
+    settings = AISettings(AI_KNOWLEDGE_BASE_FALLBACK_PROVIDER="anthropic", ANTHROPIC_API_KEY="key")
+    
+    config = settings.get_fallback_config_for_agent("knowledge_base")
+    
+    assert config["provider"] == ModelProvider.ANTHROPIC
+    assert config["api_key"] == "key"
+    assert settings.get_fallback_config_for_agent("spec_generator") is None
+
+
+@pytest.mark.asyncio
+async def test_hedge_takes_faster_provider_and_cancels_loser():
+    """Тест хеджирования: побеждает быстрый резерв, основной запрос отменяется."""
+    slow = ProviderLLM("primary", delay=1.0)
+    fast = ProviderLLM("secondary", delay=0.0)
+    policy = HedgePolicy(hedge=True, default_delay=0.02)
+    agent_llm = AgentLLM(
+        make_client(ModelProvider.OPENAI, slow), "knowledge_base",
+        fallback=make_client(ModelProvider.ANTHROPIC, fast), policy=policy
+    )
+    
+    response = await agent_llm.ainvoke([])
+    await asyncio.sleep(0)
+    
+    assert response.content == "secondary"
+    assert slow.cancelled
+    assert policy.stats()["hedges"] == 1
+    assert policy.stats()["hedge_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failover_on_server_error():
+    """Тест переключения на резерв при 5xx и проброса прочих ошибок."""
+    fallback = make_client(ModelProvider.ANTHROPIC, ProviderLLM("secondary"))
+    failing = AgentLLM(make_client(ModelProvider.OPENAI, ProviderLLM("", error=ServerError())), "kb", fallback=fallback)
+    invalid = AgentLLM(make_client(ModelProvider.OPENAI, ProviderLLM("", error=ValueError("bad"))), "kb", fallback=fallback)
+    
+    assert (await failing.ainvoke([])).content == "secondary"
+    assert failing.policy.stats()["failovers"] == 1
+    with pytest.raises(ValueError):
+        await invalid.ainvoke([])
@@ -0,0 +1,100 @@
+"""Тесты провайдера воспроизведения записанных ответов LLM."""
+import json
+import random
+import statistics
+import time
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+from services.knowledge_base.ai_agent import KnowledgeBaseAgent
+from shared.ai_config import AISettings, ModelProvider
+from shared.llm_client import AgentLLM, LLMClient, create_llm
+from shared.llm_replay import (
+    RECORD, CassetteMissError, CassetteStore, ReplayChatModel, lognormal, prompt_hash
+)
+
+
+def test_record_then_replay(tmp_path):
+    """Тест записи реального ответа и его воспроизведения по хэшу промпта."""
+    recorder = FakeListChatModel(responses=['{"answer": 42}'])
+    recording = ReplayChatModel(store=CassetteStore(str(tmp_path)), mode=RECORD, recorder=recorder)
+    messages = [HumanMessage(content="What is the answer?")]
+    
+    assert recording.invoke(messages).content == '{"answer": 42}'
+    assert (tmp_path / f"{prompt_hash(messages)}.json").exists()
+    
+    replay = ReplayChatModel(store=CassetteStore(str(tmp_path)), latency="none")
+    response = replay.invoke(messages)
+    
+    assert response.content == '{"answer": 42}'
+    assert response.response_metadata["token_usage"]["completion_tokens"] > 0
+    assert replay.stats()["hits"] == 1
+    assert replay.stats()["cassettes"] == 1
+
+
+def test_miss_policies(tmp_path):
+    """Тест промпта без записи: ошибка или синтетический ответ заданного размера."""
+    strict = ReplayChatModel(store=CassetteStore(str(tmp_path)), latency="none", on_miss="error")
+    with pytest.raises(CassetteMissError):
+        strict.invoke("unknown prompt")
+    
+    synthetic = ReplayChatModel(
+        store=CassetteStore(str(tmp_path)), latency="none",
+        completion_tokens_mean=50, completion_tokens_stddev=0, seed=1
+    )
+    response = synthetic.invoke("unknown prompt")
+    
+    assert json.loads(response.content)["synthetic"] is True
+    assert response.response_metadata["token_usage"]["completion_tokens"] == 50
+    assert synthetic.stats()["misses"] == 1
+
+
+def test_lognormal_distribution():
+    """Тест синтетической задержки: среднее и отклонение совпадают с настройкой."""
+    rng = random.Random(7)
+    samples = [lognormal(rng, 1.0, 0.3) for _ in range(5000)]
+    
+    assert statistics.mean(samples) == pytest.approx(1.0, abs=0.05)
+    assert statistics.stdev(samples) == pytest.approx(0.3, abs=0.05)
+    assert min(samples) > 0
+
+
+@pytest.mark.asyncio
+async def test_recorded_latency_is_replayed(tmp_path):
+    """Тест воспроизведения записанной задержки."""
+    store = CassetteStore(str(tmp_path))
+    messages = [HumanMessage(content="slow prompt")]
+    store.append(prompt_hash(messages), messages, {"content": "ok", "latency": 0.1})
+    replay = ReplayChatModel(store=CassetteStore(str(tmp_path)), latency="recorded")
+    
+    started = time.monotonic()
+    response = await replay.ainvoke(messages)
+    
+    assert response.content == "ok"
+    assert time.monotonic() - started >= 0.1
+
+
+@pytest.mark.asyncio
+async def test_agent_parses_replayed_response(tmp_path):
+    """Тест: агент разбирает записанный ответ, а не уходит в значение по умолчанию."""
+    agent = KnowledgeBaseAgent.__new__(KnowledgeBaseAgent)
+    new_requirement, existing = {"name": "Login"}, [{"name": "Sign in"}]
+    messages, _ = agent._duplicates_messages(new_requirement, existing)
+    payload = {"is_duplicate": True, "duplicate_of": ["REQ-1"], "similarity_score": 0.9, "reason": "same"}
+    CassetteStore(str(tmp_path)).append(prompt_hash(messages), messages, {"content": json.dumps(payload)})
+    
+    llm = create_llm(
+        {"provider": ModelProvider.REPLAY, "model": "replay", "temperature": 0.0},
+        AISettings(AI_REPLAY_CASSETTE_DIR=str(tmp_path), AI_REPLAY_LATENCY="none")
+    )[0]
+    agent.llm = AgentLLM(LLMClient({"provider": ModelProvider.REPLAY, "model": "replay"}, llm), "knowledge_base")
+    
+    assert await agent.aanalyze_duplicates(new_requirement, existing) == payload
+    assert agent.llm.client.stats()["replay"]["hits"] == 1
+
+
+def test_record_mode_requires_real_provider(tmp_path):
+    """Тест: режим записи без реального провайдера не создается."""
+    settings = AISettings(AI_REPLAY_CASSETTE_DIR=str(tmp_path), AI_REPLAY_MODE="record")
+    with pytest.raises(ValueError):
+        create_llm({"provider": ModelProvider.REPLAY, "model": "replay", "temperature": 0.0}, settings)
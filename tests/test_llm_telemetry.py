@@ -0,0 +1,143 @@
+"""Тесты телеметрии вызовов LLM."""
+import asyncio
+import json
+import pytest
+from types import SimpleNamespace
+from langchain_core.messages import AIMessage, HumanMessage
+from pydantic import BaseModel
+from shared.ai_config import ModelProvider
+from shared.llm_client import AgentLLM, LLMClient
+from shared.llm_telemetry import LLMTelemetry, llm_telemetry, response_usage, traced
+from shared.structured_output import StructuredOutputError, ainvoke_structured
+
+
+class FakeAgent:
+    """Агент с методом, который повторяет запрос и возвращает fallback, и методом с параллельными запросами."""
+    
+    def __init__(self, llm):
+        self.llm = llm
+    
+    @traced
+    async def aanalyze(self):
+        await self.llm.ainvoke([HumanMessage(content="first")])
+        llm_telemetry.record_retry("repair")
+        await self.llm.ainvoke([HumanMessage(content="repair")])
+        llm_telemetry.record_fallback(ValueError("invalid"))
+        return {}
+    
+    @traced
+    async def aanalyze_batch(self):
+        # Параллельные запросы одного метода - не повторы
+        await asyncio.gather(*[self.llm.ainvoke([HumanMessage(content=f"batch {i}")]) for i in range(3)])
+
+
+def test_response_usage_from_provider_metadata():
+    """Тест извлечения токенов из метаданных OpenAI, Anthropic и Ollama."""
+    openai = AIMessage(content="", response_metadata={"token_usage": {"prompt_tokens": 10, "completion_tokens": 5}})
+    anthropic = AIMessage(content="", response_metadata={"usage": {"input_tokens": 7, "output_tokens": 3}})
+    ollama = AIMessage(content="", response_metadata={"prompt_eval_count": 4, "eval_count": 2})
+    
+    assert response_usage(openai) == (10, 5)
+    assert response_usage(anthropic) == (7, 3)
+    assert response_usage(ollama) == (4, 2)
+    assert response_usage(AIMessage(content="")) is None
+
+
+def test_cost_and_prometheus_output():
+    """Тест расчета стоимости по проекту и формата Prometheus."""
+    telemetry = LLMTelemetry(prices={"test-model": [1.0, 2.0]})
+    response = AIMessage(content="", response_metadata={"token_usage": {"prompt_tokens": 1000, "completion_tokens": 500}})
+    
+    with telemetry.project_scope("project-1"):
+        telemetry.record_call("openai", "test-model", [], response, latency=0.3, agent="kb")
+        telemetry.record_call("openai", "test-model", [], None, agent="kb", cache_hit=True)
+    
+    stats = telemetry.stats()
+    assert stats["cost_by_project"] == {"project-1": 2.0}
+    assert stats["methods"]["kb.unknown"]["cache_hits"] == 1
+    
+    text = telemetry.prometheus()
+    assert 'llm_project_cost_usd_total{project_id="project-1"} 2.0' in text
+    assert 'llm_call_latency_seconds_bucket{agent="kb",method="unknown",provider="openai",model="test-model",le="0.5"} 1' in text
+
+
+@pytest.mark.asyncio
+async def test_traced_method_records_retries_fallback_and_sink(tmp_path, monkeypatch):
+    """Тест учета метода агента, повторов, fallback и записи в JSONL."""
+    sink = tmp_path / "llm.jsonl"
+    telemetry = LLMTelemetry(sink_path=str(sink))
+    monkeypatch.setattr("shared.llm_client.llm_telemetry", telemetry)
+    
+    class EchoLLM:
+        async def ainvoke(self, messages, **kwargs):
+            return AIMessage(content="ok")
+    
+    client = LLMClient({"provider": ModelProvider.OPENAI, "model": "gpt-4"}, EchoLLM())
+    agent = FakeAgent(AgentLLM(client, "knowledge_base"))
+    monkeypatch.setattr("tests.test_llm_telemetry.llm_telemetry", telemetry)
+    
+    await agent.aanalyze()
+    
+    method = telemetry.stats()["methods"]["knowledge_base.analyze"]
+    assert method["calls"] == 2
+    assert method["retries"] == 1
+    assert method["fallbacks"] == 1
+    assert method["prompt_tokens"] > 0
+    
+    events = [json.loads(line) for line in sink.read_text().splitlines()]
+    assert [e["event"] for e in events] == ["llm_call", "llm_retry", "llm_call", "llm_fallback"]
+    assert events[1]["reason"] == "repair"
+    assert events[2]["retry"] == 1
+    assert events[0]["tokens_estimated"] is True
+    
+    await agent.aanalyze_batch()
+    
+    batch = telemetry.stats()["methods"]["knowledge_base.analyze_batch"]
+    assert batch["calls"] == 3
+    assert batch["retries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_prompt_version_stats_compare_versions(monkeypatch):
+    """Тест метрик по версиям промпта: задержка, токены, ошибки разбора, fallback и сравнение версий."""
+    telemetry = LLMTelemetry()
+    monkeypatch.setattr("shared.llm_client.llm_telemetry", telemetry)
+    monkeypatch.setattr("shared.structured_output.llm_telemetry", telemetry)
+    monkeypatch.setattr("tests.test_llm_telemetry.llm_telemetry", telemetry)
+    
+    replies = iter(["not json", "still not json", '{"value": 1}'])
+    
+    class ScriptedLLM:
+        async def ainvoke(self, messages, **kwargs):
+            return AIMessage(content=next(replies), usage_metadata={"input_tokens": 100, "output_tokens": 10, "total_tokens": 110})
+    
+    class Result(BaseModel):
+        value: int
+    
+    class Agent:
+        def __init__(self, llm):
+            self.llm = llm
+        
+        @traced
+        async def arun(self, prompt):
+            try:
+                return await ainvoke_structured(self.llm, [HumanMessage(content="JSON please")], Result, prompt=prompt)
+            except StructuredOutputError as e:
+                llm_telemetry.record_fallback(e)
+                return None
+    
+    client = LLMClient({"provider": ModelProvider.OPENAI, "model": "gpt-4"}, ScriptedLLM())
+    agent = Agent(AgentLLM(client, "knowledge_base"))
+    
+    assert await agent.arun(SimpleNamespace(id="kb_conflicts", version=6)) is None
+    assert await agent.arun(SimpleNamespace(id="kb_conflicts", version=7)) == {"value": 1}
+    
+    stats = telemetry.prompt_stats("kb_conflicts")
+    v7, v6 = stats["versions"]
+    assert (v7["version"], v6["version"]) == (7, 6)
+    assert v6["calls"] == 2 and v6["operations"] == 1
+    assert v6["parse_failure_rate"] == 1.0 and v6["fallback_rate"] == 1.0
+    assert v7["parse_failure_rate"] == 0.0 and v7["fallback_rate"] == 0.0
+    assert v7["avg_prompt_tokens"] == 100 and v7["p95_latency"] is not None
+    assert stats["comparison"]["candidate"] == 7
+    assert stats["comparison"]["delta"]["fallback_rate"] == -1.0
@@ -0,0 +1,117 @@
+"""Тесты конвейера шагов с зависимостями."""
+import asyncio
+import time
+import pytest
+from shared.orchestration import FAILED, OK, SKIPPED, TIMEOUT, Pipeline, PipelineError
+
+
+@pytest.mark.asyncio
+async def test_independent_steps_run_concurrently():
+    """Тест: независимые шаги занимают max(шаг), а не сумму."""
+    async def slow(value):
+        await asyncio.sleep(0.2)
+        return value
+    
+    pipeline = Pipeline("test")
+    pipeline.step("a", lambda: slow(1))
+    pipeline.step("b", lambda: time.sleep(0.2) or 2)
+    pipeline.step("c", lambda: slow(3))
+    
+    started = time.monotonic()
+    result = await pipeline.run()
+    
+    assert time.monotonic() - started < 0.5
+    assert (result["a"], result["b"], result["c"]) == (1, 2, 3)
+    assert not result.partial
+
+
+@pytest.mark.asyncio
+async def test_dependencies_receive_results():
+    """Тест передачи результатов зависимостей."""
+    order = []
+    
+    async def first():
+        order.append("first")
+        return 10
+    
+    async def second(first):
+        order.append("second")
+        return first + 1
+    
+    pipeline = Pipeline("test")
+    pipeline.step("second", second, depends_on=("first",))
+    pipeline.step("first", first)
+    
+    result = await pipeline.run()
+    
+    assert result["second"] == 11
+    assert order == ["first", "second"]
+    assert list(result.steps) == ["second", "first"]
+
+
+@pytest.mark.asyncio
+async def test_optional_failures_give_partial_result():
+    """Тест частичного результата: ошибка и таймаут необязательных шагов, пропуск зависимого шага."""
+    async def hang():
+        await asyncio.sleep(10)
+    
+    def broken():
+        raise RuntimeError("graph down")
+    
+    pipeline = Pipeline("test")
+    pipeline.step("main", lambda: "ok")
+    pipeline.step("slow", hang, timeout=0.05, required=False, default=[])
+    pipeline.step("broken", broken, required=False, default=[])
+    pipeline.step("after_broken", lambda broken: broken, depends_on=("broken",), required=False, default=[])
+    
+    result = await pipeline.run()
+    
+    assert result["main"] == "ok"
+    assert result.steps["main"].status == OK
+    assert result.steps["slow"].status == TIMEOUT
+    assert result.steps["broken"].status == FAILED
+    assert result.steps["after_broken"].status == SKIPPED
+    assert result["slow"] == []
+    assert result.failed == ["slow", "broken", "after_broken"]
+
+
+@pytest.mark.asyncio
+async def test_required_failure_raises_and_cancels():
+    """Тест ошибки обязательного шага: конвейер прерывается, остальные шаги отменяются."""
+    cancelled = asyncio.Event()
+    
+    async def long_step():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+    
+    def broken():
+        raise RuntimeError("boom")
+    
+    pipeline = Pipeline("test")
+    pipeline.step("long", long_step, required=False)
+    pipeline.step("broken", broken)
+    
+    with pytest.raises(PipelineError) as error:
+        await pipeline.run()
+    
+    assert error.value.step.name == "broken"
+    await asyncio.sleep(0)
+    assert cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_invalid_dependencies():
+    """Тест проверки неизвестных зависимостей и циклов."""
+    pipeline = Pipeline("test")
+    pipeline.step("a", lambda missing: None, depends_on=("missing",))
+    with pytest.raises(ValueError):
+        await pipeline.run()
+    
+    pipeline = Pipeline("test")
+    pipeline.step("a", lambda b: None, depends_on=("b",))
+    pipeline.step("b", lambda a: None, depends_on=("a",))
+    with pytest.raises(ValueError):
+        await pipeline.run()
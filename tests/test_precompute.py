@@ -0,0 +1,184 @@
+"""Тесты фонового предрасчета анализов требования."""
+import asyncio
+import pytest
+from shared.precompute import AnalysisPrecomputer, requirement_version
+
+
+def _requirement(**changes):
+    requirement = {"id": "req-1", "identifier": "REQ-1", "name": "Login", "shall": "The system shall log in", "version": 1}
+    requirement.update(changes)
+    return requirement
+
+
+def _counting(calls, delay=0.0, error=None):
+    async def analysis(requirement):
+        calls.append(requirement["shall"])
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return {"shall": requirement["shall"]}
+    return analysis
+
+
+def test_version_changes_with_content():
+    """Тест версии: меняется при изменении полей, одинакова для строки и модели."""
+    class Model:
+        id, identifier, name, shall, version = "req-1", "REQ-1", "Login", "The system shall log in", 1
+        rationale = category = priority = acceptance_criteria = None
+    
+    assert requirement_version(_requirement()) == requirement_version(Model())
+    assert requirement_version(_requirement()) != requirement_version(_requirement(shall="changed"))
+    assert requirement_version(_requirement()) != requirement_version(_requirement(version=2))
+
+
+@pytest.mark.asyncio
+async def test_scheduled_result_is_served_for_version():
+    """Тест: результат фонового расчета отдается без вызова модели только для своей версии."""
+    calls = []
+    precompute = AnalysisPrecomputer(enabled=True)
+    precompute.register("duplicates", _counting(calls))
+    requirement = _requirement()
+    
+    assert precompute.schedule(requirement) == 1
+    await asyncio.sleep(0.01)
+    
+    version = requirement_version(requirement)
+    assert precompute.get("req-1", "duplicates", version) == {"shall": "The system shall log in"}
+    assert precompute.get("req-1", "duplicates", requirement_version(_requirement(shall="changed"))) is None
+    assert precompute.schedule(requirement) == 0
+    assert calls == ["The system shall log in"]
+
+
+@pytest.mark.asyncio
+async def test_request_waits_for_running_precompute():
+    """Тест: запрос во время фонового расчета той же версии ждет его, а не считает заново."""
+    calls = []
+    precompute = AnalysisPrecomputer(enabled=True)
+    precompute.register("conflicts", _counting(calls, delay=0.05))
+    requirement = _requirement()
+    precompute.schedule(requirement)
+    
+    async def compute():
+        calls.append("inline")
+        return {"shall": "inline"}
+    
+    result = await precompute.get_or_compute("req-1", "conflicts", requirement_version(requirement), compute)
+    
+    assert result == {"shall": "The system shall log in"}
+    assert calls == ["The system shall log in"]
+
+
+@pytest.mark.asyncio
+async def test_stale_entries_are_recomputed_lazily():
+    """Тест ленивого пересчета: устаревшая версия и истекший возраст считаются при запросе."""
+    precompute = AnalysisPrecomputer(enabled=True, max_age=0.05)
+    old, new = _requirement(), _requirement(shall="changed", version=2)
+    precompute.store("req-1", "duplicates", requirement_version(old), {"shall": "old"})
+    
+    async def compute():
+        return {"shall": "fresh"}
+    
+    assert await precompute.get_or_compute("req-1", "duplicates", requirement_version(new), compute) == {"shall": "fresh"}
+    assert precompute.get("req-1", "duplicates", requirement_version(new)) == {"shall": "fresh"}
+    
+    await asyncio.sleep(0.06)
+    assert precompute.get("req-1", "duplicates", requirement_version(new)) is None
+    assert precompute.stats()["stale"] == 2
+
+
+@pytest.mark.asyncio
+async def test_new_version_cancels_running_precompute():
+    """Тест: изменение требования отменяет расчет предыдущей версии."""
+    calls = []
+    precompute = AnalysisPrecomputer(enabled=True)
+    precompute.register("recommendations", _counting(calls, delay=0.05))
+    
+    precompute.schedule(_requirement())
+    await asyncio.sleep(0)
+    precompute.schedule(_requirement(shall="changed"))
+    await asyncio.sleep(0.1)
+    
+    assert precompute.get("req-1", "recommendations", requirement_version(_requirement())) is None
+    assert precompute.get("req-1", "recommendations", requirement_version(_requirement(shall="changed"))) == {"shall": "changed"}
+    assert precompute.stats()["computed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_precompute_falls_back_to_inline():
+    """Тест: ошибка фонового расчета не ломает запрос, результат считается заново."""
+    precompute = AnalysisPrecomputer(enabled=True)
+    precompute.register("duplicates", _counting([], delay=0.01, error=RuntimeError("provider down")))
+    requirement = _requirement()
+    precompute.schedule(requirement)
+    
+    async def compute():
+        return {"shall": "inline"}
+    
+    result = await precompute.get_or_compute("req-1", "duplicates", requirement_version(requirement), compute)
+    
+    assert result == {"shall": "inline"}
+    assert precompute.stats()["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_disabled_precompute_and_invalidate():
+    """Тест: выключенный предрасчет ничего не запускает, удаление требования очищает результаты."""
+    precompute = AnalysisPrecomputer(enabled=False)
+    precompute.register("duplicates", _counting([]))
+    assert precompute.schedule(_requirement()) == 0
+    
+    version = requirement_version(_requirement())
+    precompute.store("req-1", "duplicates", version, {"shall": "x"})
+    precompute.invalidate("req-1")
+    assert precompute.get("req-1", "duplicates", version) is None
+
+
+@pytest.mark.asyncio
+async def test_schedule_ids_uses_registered_loader():
+    """Тест: предрасчет по id берет требования из загрузчика (источника эндпоинтов анализов)."""
+    calls = []
+    loaded = []
+    precompute = AnalysisPrecomputer(enabled=True)
+    precompute.register("duplicates", _counting(calls))
+    
+    assert await precompute.schedule_ids(["req-1"]) == 0
+    
+    def loader(requirement_ids):
+        loaded.append(requirement_ids)
+        return [_requirement(shall="from database")]
+    
+    precompute.register_loader(loader)
+    assert await precompute.schedule_ids(["req-1"]) == 1
+    await asyncio.sleep(0.01)
+    
+    assert loaded == [["req-1"]]
+    assert calls == ["from database"]
+    version = requirement_version(_requirement(shall="from database"))
+    assert precompute.get("req-1", "duplicates", version) == {"shall": "from database"}
+
+
+@pytest.mark.asyncio
+async def test_graph_sync_invalidates_project_graph_analyses():
+    """Тест: синхронизация проекта с графом сбрасывает дубликаты требований проекта, но не анализы без графа."""
+    calls = []
+    precompute = AnalysisPrecomputer(enabled=True)
+    precompute.register("duplicates", _counting(calls), graph=True)
+    precompute.register("recommendations", _counting(calls))
+    requirement = _requirement(project_id="p1")
+    version = requirement_version(requirement)
+    
+    precompute.schedule(requirement)
+    await asyncio.sleep(0.01)
+    
+    assert precompute.invalidate_project("p2") == 0
+    assert precompute.invalidate_project("p1") == 1
+    assert precompute.get("req-1", "duplicates", version) is None
+    assert precompute.get("req-1", "recommendations", version) is not None
+    
+    # Результат расчета, начатого до синхронизации, не сохраняется
+    precompute.register("duplicates", _counting(calls, delay=0.05), graph=True)
+    precompute.schedule(requirement)
+    await asyncio.sleep(0.01)
+    precompute.invalidate_project("p1")
+    await asyncio.sleep(0.06)
+    assert precompute.get("req-1", "duplicates", version) is None
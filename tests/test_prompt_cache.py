@@ -0,0 +1,74 @@
+"""Тесты разделения промптов на кэшируемый префикс и кэшированных токенов."""
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+import shared.prompt_cache as prompt_cache
+from shared.ai_config import ModelProvider
+from shared.llm_telemetry import LLMTelemetry, cached_prompt_tokens
+from shared.prompt_store import prompt_store
+from shared.prompt_templates import render_parts, split_template
+
+
+def test_split_template_prefix_is_static():
+    """Тест: префикс - абзацы до первой переменной, экранированные скобки не считаются переменными."""
+    template = "Return JSON: {{\"ok\": true}}\n\nRules.\n\nData: {data}\n\nAnswer."
+    
+    prefix, suffix = split_template(template)
+    
+    assert prefix == "Return JSON: {{\"ok\": true}}\n\nRules."
+    assert suffix == "Data: {data}\n\nAnswer."
+    assert render_parts(template, {"data": 1}) == ("Return JSON: {\"ok\": true}\n\nRules.", "Data: 1\n\nAnswer.")
+
+
+def test_split_template_without_static_part():
+    """Тест шаблонов без статической части и без переменных."""
+    assert split_template("Analyze {data}") == ("", "Analyze {data}")
+    assert split_template("Static only") == ("Static only", "")
+    with pytest.raises(ValueError):
+        render_parts("Intro\n\n{data}", {})
+
+
+def test_stored_prompt_prefix_is_shared_between_calls():
+    """Тест: префикс промпта дубликатов одинаков для разных данных."""
+    first = prompt_store.render_parts("knowledge_base_duplicates", {"new_requirement": "A", "existing_requirements": "B"})
+    second = prompt_store.render_parts("knowledge_base_duplicates", {"new_requirement": "C", "existing_requirements": "D"})
+    
+    assert first[0] and first[0] == second[0]
+    assert first[1] != second[1]
+
+
+def test_mark_cacheable_prefix(monkeypatch):
+    """Тест пометки системного сообщения только для Anthropic с поддержкой cache_control."""
+    messages = [SystemMessage(content="Static instructions"), HumanMessage(content="data")]
+    monkeypatch.setattr(prompt_cache, "anthropic_supports_cache_control", lambda: True)
+    
+    marked = prompt_cache.mark_cacheable_prefix(ModelProvider.ANTHROPIC, messages)
+    
+    assert marked[0].content == [{"type": "text", "text": "Static instructions", "cache_control": prompt_cache.CACHE_CONTROL}]
+    assert marked[1] is messages[1]
+    assert prompt_cache.mark_cacheable_prefix(ModelProvider.OPENAI, messages) is messages
+    
+    monkeypatch.setattr(prompt_cache, "anthropic_supports_cache_control", lambda: False)
+    assert prompt_cache.mark_cacheable_prefix(ModelProvider.ANTHROPIC, messages) is messages
+
+
+def test_cached_tokens_are_discounted():
+    """Тест учета кэшированных токенов OpenAI и Anthropic в стоимости."""
+    openai = AIMessage(content="ok", response_metadata={"token_usage": {
+        "prompt_tokens": 1000, "completion_tokens": 0, "prompt_tokens_details": {"cached_tokens": 800}
+    }})
+    anthropic = AIMessage(content="ok", response_metadata={"usage": {
+        "input_tokens": 200, "output_tokens": 0, "cache_read_input_tokens": 800
+    }})
+    
+    assert cached_prompt_tokens(openai) == 800
+    assert cached_prompt_tokens(anthropic) == 800
+    
+    telemetry = LLMTelemetry(prices={"openai-model": [1.0, 0.0], "anthropic-model": [1.0, 0.0]})
+    telemetry.record_call("openai", "openai-model", [], openai, latency=0.1, agent="kb")
+    telemetry.record_call("anthropic", "anthropic-model", [], anthropic, latency=0.1, agent="kb")
+    
+    stats = telemetry.stats()["methods"]["kb.unknown"]
+    assert stats["prompt_tokens"] == 2000
+    assert stats["cached_prompt_tokens"] == 1600
+    # OpenAI: 200 + 800 * 0.5, Anthropic: 200 + 800 * 0.1
+    assert stats["cost_usd"] == pytest.approx(0.6 + 0.28)
@@ -0,0 +1,207 @@
+"""Тесты хранилища и шаблонов промптов."""
+from datetime import datetime
+import pytest
+import shared.prompt_store_supabase as prompt_store_supabase
+from shared.prompt_store import PromptStore
+from shared.prompt_store_supabase import SupabasePromptStore
+from shared.prompt_templates import TemplateError, compile_template, validate_template
+
+
+class FakeResult:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """Запрос PostgREST к таблице в памяти."""
+    
+    def __init__(self, client, columns="*", count=None):
+        self.client = client
+        self.columns = columns
+        self.count = count
+        self.filters = []
+        self.order_by = None
+        self.limit_to = None
+        self.row = None
+    
+    def select(self, columns="*", count=None):
+        self.columns, self.count = columns, count
+        return self
+    
+    def eq(self, column, value):
+        self.filters.append((column, value))
+        return self
+    
+    def order(self, column, desc=False):
+        self.order_by = (column, desc)
+        return self
+    
+    def limit(self, value):
+        self.limit_to = value
+        return self
+    
+    def insert(self, row):
+        self.row = row
+        return self
+    
+    def execute(self):
+        self.client.calls += 1
+        if self.row is not None:
+            self.client.rows.append(dict(self.row))
+            return FakeResult([self.row])
+        rows = [r for r in self.client.rows if all(r.get(c) == v for c, v in self.filters)]
+        if self.order_by:
+            rows.sort(key=lambda r: r[self.order_by[0]], reverse=self.order_by[1])
+        total = len(rows)
+        if self.limit_to is not None:
+            rows = rows[:self.limit_to]
+        return FakeResult([dict(r) for r in rows], total if self.count else None)
+
+
+class FakeSupabase:
+    """Клиент Supabase с подсчетом сетевых запросов."""
+    
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = 0
+    
+    def table(self, name):
+        return FakeQuery(self)
+    
+    def rpc(self, name, params):
+        raise RuntimeError("rpc is not available")
+
+
+def _rows():
+    now = datetime.utcnow().isoformat()
+    return [
+        {**prompt, "created_at": now, "updated_at": now}
+        for prompt in PromptStore()._get_default_prompts()
+    ]
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    client = FakeSupabase(_rows())
+    monkeypatch.setattr(prompt_store_supabase.SupabaseClient, "get_service_client", staticmethod(lambda: client))
+    return client
+
+
+def test_cached_render_path_makes_no_network_calls(supabase):
+    """Тест: после загрузки кэша выбор промпта и рендер не ходят в Supabase."""
+    store = SupabasePromptStore(cache_ttl=60, realtime=False)
+    prompt = store.get_prompt("knowledge_base_duplicates")
+    calls = supabase.calls
+    
+    for _ in range(5):
+        active = store.get_active_prompt(prompt.agent_type, prompt.prompt_type)
+        store.render_parts(active.id, {"new_requirement": "A", "existing_requirements": "B"})
+        store.render_prompt(active.id, {"new_requirement": "A", "existing_requirements": "B"})
+    
+    assert active.id == prompt.id
+    assert supabase.calls == calls
+    assert store.cache_stats()["loads"] == 1
+
+
+def test_expired_cache_polls_marker_and_reloads_on_change(supabase):
+    """Тест: по истечении TTL проверяется метка изменений, полная загрузка только при изменении."""
+    store = SupabasePromptStore(cache_ttl=0, realtime=False)
+    store.get_prompt("knowledge_base_duplicates")
+    store.get_prompt("knowledge_base_duplicates")
+    assert store.cache_stats()["loads"] == 1
+    assert store.cache_stats()["polls"] == 2
+    
+    # Новая версия, записанная другим процессом
+    row = dict(next(r for r in supabase.rows if r["id"] == "knowledge_base_duplicates"))
+    row.update(version=row["version"] + 1, template="Updated {new_requirement} {existing_requirements}",
+               updated_at=datetime.utcnow().isoformat() + "Z")
+    supabase.rows.append(row)
+    
+    assert store.get_prompt("knowledge_base_duplicates").version == row["version"]
+    assert store.cache_stats()["loads"] == 2
+
+
+def test_writes_and_realtime_events_invalidate_cache(supabase):
+    """Тест: изменение через хранилище и событие Realtime сбрасывают кэш."""
+    store = SupabasePromptStore(cache_ttl=3600, realtime=False)
+    current = store.get_prompt("knowledge_base_duplicates")
+    
+    updated = store.update_prompt("knowledge_base_duplicates", {"description": "v2"})
+    
+    assert store.get_prompt("knowledge_base_duplicates").version == updated.version == current.version + 1
+    assert store.get_active_prompt(current.agent_type, current.prompt_type).description == "v2"
+    
+    store.invalidate_cache({"eventType": "UPDATE"})
+    store.get_prompt("knowledge_base_duplicates")
+    assert store.cache_stats()["invalidations"] == 2
+
+
+def test_default_templates_compile_and_match_variables():
+    """Тест: шаблоны по умолчанию разбираются и объявляют ровно свои переменные."""
+    for prompt in PromptStore()._get_default_prompts():
+        compiled = validate_template(prompt["template"], prompt["variables"])
+        assert set(compiled.variables) == set(prompt["variables"])
+
+
+def test_compiled_template_matches_format_and_keeps_literal_json():
+    """Тест рендера: экранированные скобки как в str.format, неэкранированный JSON остается текстом."""
+    escaped = "Return JSON: {{\"ok\": true}}\n\nData: {data} {{{data}}}"
+    compiled = compile_template(escaped)
+    
+    assert compiled.render({"data": 1}) == escaped.format(data=1)
+    assert compiled.render_parts({"data": 1}) == ("Return JSON: {\"ok\": true}", "Data: 1 {1}")
+    assert compile_template('Example: {"is_duplicate": true}\n\n{data}').render({"data": "x"}) == 'Example: {"is_duplicate": true}\n\nx'
+    assert compile_template(escaped) is compiled
+    
+    with pytest.raises(ValueError, match="Missing variable"):
+        compiled.render({})
+
+
+def test_bad_templates_rejected_on_create_and_update():
+    """Тест: шаблон с необъявленной или лишней переменной не сохраняется."""
+    store = PromptStore()
+    prompt = store.get_prompt("knowledge_base_duplicates")
+    
+    with pytest.raises(TemplateError, match="undeclared"):
+        store.update_prompt(prompt.id, {"template": prompt.template + " {extra}"})
+    with pytest.raises(TemplateError, match="not used"):
+        store.add_prompt(prompt.copy(update={"id": "new", "variables": prompt.variables + ["extra"]}))
+    
+    assert store.get_prompt(prompt.id).version == prompt.version
+    assert store.get_prompt("new") is None
+
+
+def test_snapshot_is_copy_on_write_and_round_trips(tmp_path):
+    """Тест: запись подменяет снимок, старый снимок не меняется; экспорт и импорт сохраняют промпты."""
+    store = PromptStore(snapshot_path="")
+    before = store.snapshot()
+    prompt = store.get_prompt("knowledge_base_duplicates")
+    
+    updated = store.update_prompt(prompt.id, {"description": "v2"})
+    
+    assert before.get(prompt.id).description == prompt.description
+    assert before.get_active(prompt.agent_type, prompt.prompt_type) is prompt
+    assert store.get_active_prompt(prompt.agent_type, prompt.prompt_type) is updated
+    
+    path = tmp_path / "prompts.json"
+    store.export_snapshot(str(path))
+    restored = PromptStore(snapshot_path=str(path))
+    
+    assert restored.get_prompt(prompt.id).description == "v2"
+    assert restored.get_prompt(prompt.id).version == updated.version
+    assert len(restored.list_prompts()) == len(store.list_prompts())
+
+
+def test_supabase_store_serves_file_snapshot_when_unavailable(supabase, tmp_path, monkeypatch):
+    """Тест: при ошибке Supabase промпты отдаются из снимка, загруженного из файла."""
+    path = tmp_path / "prompts.json"
+    PromptStore(snapshot_path="").export_snapshot(str(path))
+    monkeypatch.setattr(prompt_store_supabase.ai_settings, "prompt_snapshot_path", str(path))
+    supabase.table = lambda name: (_ for _ in ()).throw(ConnectionError("offline"))
+    
+    store = SupabasePromptStore(cache_ttl=60, realtime=False)
+    prompt = store.get_active_prompt("knowledge_base", "duplicate_analysis")
+    
+    assert prompt is not None and prompt.id == "knowledge_base_duplicates"
+    assert store.cache_stats()["prompts"] == len(store.list_prompts()) > 0
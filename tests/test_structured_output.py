@@ -0,0 +1,87 @@
+"""Тесты разбора структурированных ответов LLM."""
+import pytest
+from types import SimpleNamespace
+from shared.ai_config import ModelProvider
+from shared.llm_client import AgentLLM, LLMClient
+from shared.structured_output import (
+    StructuredOutputError, ainvoke_structured, extract_json, native_json_kwargs, parse_structured
+)
+from services.knowledge_base.schemas import DuplicateAnalysis, RecommendationList
+
+
+def test_extract_json_tolerates_prose_fences_and_trailing_commas():
+    """Тест устойчивого извлечения JSON."""
+    assert extract_json('Here it is:\n```json\n{"a": [1, 2,],}\n```\nThanks') == {"a": [1, 2]}
+    assert extract_json('Result [draft]: ["x", "y"] - done') == ["x", "y"]
+    with pytest.raises(StructuredOutputError):
+        extract_json("no json here")
+
+
+def test_parse_structured_validates_and_normalizes():
+    """Тест проверки схемой и заполнения значений по умолчанию."""
+    result = parse_structured('{"is_duplicate": false}', DuplicateAnalysis)
+    
+    assert result == {"is_duplicate": False, "duplicate_of": [], "similarity_score": 0.0, "reason": ""}
+    with pytest.raises(StructuredOutputError):
+        parse_structured('{"is_duplicate": true, "similarity_score": 7}', DuplicateAnalysis)
+
+
+def test_native_json_mode_only_for_object_schemas():
+    """Тест JSON режима провайдера."""
+    messages = [SimpleNamespace(content="Return JSON")]
+    
+    assert native_json_kwargs(ModelProvider.OPENAI, messages, DuplicateAnalysis) == {"response_format": {"type": "json_object"}}
+    assert native_json_kwargs(ModelProvider.OPENAI, messages, RecommendationList) == {}
+    assert native_json_kwargs(ModelProvider.OLLAMA, messages, RecommendationList) == {"format": "json"}
+    assert native_json_kwargs(ModelProvider.ANTHROPIC, messages, DuplicateAnalysis) == {}
+
+
+@pytest.mark.asyncio
+async def test_single_targeted_repair_attempt():
+    """Тест одной попытки исправления вместо повторной генерации."""
+    replies = ['{"is_duplicate": "maybe"}', '{"is_duplicate": true, "reason": "same"}']
+    calls = []
+    
+    class RepairLLM:
+        async def ainvoke(self, messages, **kwargs):
+            calls.append(messages)
+            return SimpleNamespace(content=replies[len(calls) - 1])
+    
+    result = await ainvoke_structured(RepairLLM(), [SimpleNamespace(content="Analyze")], DuplicateAnalysis)
+    
+    assert result["is_duplicate"] is True
+    assert len(calls) == 2
+    assert calls[1][-2].content == replies[0]
+    assert "is_duplicate" in calls[1][-1].content
+
+
+@pytest.mark.asyncio
+async def test_fallback_provider_gets_its_own_json_mode():
+    """Тест: при переключении OpenAI -> Anthropic параметры JSON режима OpenAI не передаются резерву."""
+    class ServerError(Exception):
+        status_code = 503
+    
+    class OpenAILLM:
+        def __init__(self):
+            self.kwargs = None
+        
+        async def ainvoke(self, messages, **kwargs):
+            self.kwargs = kwargs
+            raise ServerError()
+    
+    class AnthropicLLM:
+        async def ainvoke(self, messages, max_tokens=None, stop=None):
+            # Как Messages.create(): неизвестные параметры - TypeError
+            return SimpleNamespace(content='{"is_duplicate": true}')
+    
+    openai = OpenAILLM()
+    agent_llm = AgentLLM(
+        LLMClient({"provider": ModelProvider.OPENAI, "model": "gpt"}, openai),
+        "knowledge_base",
+        fallback=LLMClient({"provider": ModelProvider.ANTHROPIC, "model": "claude"}, AnthropicLLM())
+    )
+    
+    result = await ainvoke_structured(agent_llm, [SimpleNamespace(content="Return JSON")], DuplicateAnalysis)
+    
+    assert result["is_duplicate"] is True
+    assert openai.kwargs == {"response_format": {"type": "json_object"}}
@@ -0,0 +1,295 @@
+"""Тесты массовой синхронизации Supabase -> Neo4j."""
+import re
+import pytest
+from types import SimpleNamespace
+import shared.sync_manager as sync_module
+from shared.sync_manager import COMPLETED, FAILED, INCREMENTAL, SyncManager
+
+
+class FakeResult:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """Запрос PostgREST к таблице в памяти (select с фильтрами eq/gt, upsert)."""
+    
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.filters = []
+        self.order_by = []
+        self.limit_to = None
+        self.count = None
+        self.upsert_rows = None
+        self.conflict = None
+        self.deleting = False
+    
+    def select(self, columns="*", count=None):
+        self.count = count
+        return self
+    
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+    
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) > value)
+        return self
+    
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) >= value)
+        return self
+    
+    def or_(self, condition):
+        # Только keyset условие вида updated_at.gt."T",and(updated_at.eq."T",id.gt."ID")
+        updated_at, _, req_id = re.findall(r'"([^"]*)"', condition)
+        self.filters.append(lambda row: (row["updated_at"], row["id"]) > (updated_at, req_id))
+        return self
+    
+    def order(self, column, desc=False):
+        self.order_by.append(column)
+        return self
+    
+    def limit(self, value):
+        self.limit_to = value
+        return self
+    
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+    
+    def delete(self):
+        self.deleting = True
+        return self
+    
+    def upsert(self, rows, on_conflict=None):
+        self.upsert_rows = rows if isinstance(rows, list) else [rows]
+        self.conflict = on_conflict
+        return self
+    
+    def execute(self):
+        self.client.requests.append((self.name, "upsert" if self.upsert_rows is not None else "select"))
+        table = self.client.tables.setdefault(self.name, [])
+        if self.upsert_rows is not None:
+            for row in self.upsert_rows:
+                existing = next((r for r in table if r[self.conflict] == row[self.conflict]), None)
+                if existing is None:
+                    table.append(dict(row))
+                else:
+                    existing.update(row)
+            return FakeResult(self.upsert_rows)
+        rows = [r for r in table if all(f(r) for f in self.filters)]
+        if self.deleting:
+            table[:] = [r for r in table if r not in rows]
+            return FakeResult(rows)
+        if self.order_by:
+            rows.sort(key=lambda r: tuple(r[column] for column in self.order_by))
+        total = len(rows)
+        if self.limit_to is not None:
+            rows = rows[:self.limit_to]
+        return FakeResult([dict(r) for r in rows], total if self.count else None)
+
+
+class FakeSupabase:
+    def __init__(self, requirements):
+        self.tables = {"requirements": requirements}
+        self.requests = []
+        self.fail_after_pages = None
+    
+    def rpc(self, name, params):
+        return SimpleNamespace(execute=lambda: self._call(name, params))
+    
+    def _call(self, name, params):
+        """Функции очереди graph_sync_outbox."""
+        outbox = self.tables.setdefault("graph_sync_outbox", [])
+        if name == "claim_graph_sync_outbox":
+            free = [e for e in outbox if not e.get("claimed_by") and e.get("attempts", 0) < params["max_attempts"]]
+            claimed = free[:params["batch_size"]]
+            for entry in claimed:
+                entry["claimed_by"] = params["worker"]
+            return FakeResult([dict(e) for e in claimed])
+        for entry in outbox:
+            if entry["id"] in params["ids"]:
+                entry.update(claimed_by=None, attempts=entry.get("attempts", 0) + 1, last_error=params["error"])
+        return FakeResult(None)
+    
+    def table(self, name):
+        if name == "requirements" and self.fail_after_pages is not None:
+            pages = sum(1 for n, kind in self.requests if n == "requirements" and kind == "select")
+            # Запросы к requirements (подсчет и страницы) до сбоя
+            if pages > self.fail_after_pages:
+                raise ConnectionError("connection lost")
+        return FakeQuery(self, name)
+
+
+class FakeGraph:
+    available = True
+    
+    def __init__(self):
+        self.batches = []
+        self.deleted = []
+        self.error = None
+    
+    def import_requirements(self, requirements, project_id=None, batch_size=None):
+        if self.error:
+            raise self.error
+        self.batches.append([r["id"] for r in requirements])
+        return len(requirements)
+    
+    def delete_requirements(self, requirement_ids):
+        self.deleted.extend(requirement_ids)
+        return len(requirement_ids)
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    requirements = [
+        {"id": f"req-{i:04d}", "project_id": "p1", "name": f"R{i}", "updated_at": "2024-01-01T00:00:00+00:00"}
+        for i in range(250)
+    ]
+    requirements.append({"id": "req-other", "project_id": "p2", "name": "Other", "updated_at": "2024-01-01T00:00:00+00:00"})
+    client = FakeSupabase(requirements)
+    monkeypatch.setattr(sync_module.SupabaseClient, "get_service_client", staticmethod(lambda: client))
+    monkeypatch.setattr(sync_module, "KnowledgeBaseGraph", FakeGraph)
+    return SyncManager()
+
+
+def test_bulk_sync_pages_and_upserts_status_in_bulk(manager):
+    """Тест: требования читаются страницами, пишутся пачками, статус обновляется одним запросом на страницу."""
+    result = manager.bulk_sync_project("p1", page_size=100, workers=2)
+    
+    assert result["success"] is True
+    assert (result["total"], result["synced"], result["failed"]) == (250, 250, 0)
+    assert [len(batch) for batch in manager.graph.batches] == [100, 100, 50]
+    assert len(manager.supabase.tables["requirement_sync_status"]) == 250
+    status_requests = [r for r in manager.supabase.requests if r == ("requirement_sync_status", "upsert")]
+    assert len(status_requests) == 3
+    assert manager.sync_progress("p1")["status"] == COMPLETED
+    assert manager.supabase.tables["graph_sync_checkpoints"][0]["status"] == COMPLETED
+
+
+def test_bulk_sync_resumes_from_checkpoint(manager):
+    """Тест: после сбоя синхронизация продолжается с последней записанной страницы."""
+    # Подсчет и две страницы проходят, чтение третьей страницы падает
+    manager.supabase.fail_after_pages = 2
+    failed = manager.bulk_sync_project("p1", page_size=100, workers=1)
+    
+    assert failed["success"] is False and failed["status"] == FAILED
+    assert (failed["last_id"], failed["synced"]) == ("req-0199", 200)
+    
+    manager.supabase.fail_after_pages = None
+    manager.graph.batches.clear()
+    resumed = manager.bulk_sync_project("p1", page_size=100, workers=1)
+    
+    assert resumed["success"] is True
+    assert resumed["resumed_from"] == "req-0199"
+    assert manager.graph.batches == [[f"req-{i:04d}" for i in range(200, 250)]]
+    assert (resumed["total"], resumed["synced"]) == (50, 50)
+
+
+def test_bulk_sync_checkpoint_stops_before_failed_page(manager):
+    """Тест: неудачная запись страницы не сдвигает точку возобновления, синхронизация завершается с ошибкой."""
+    import_requirements = manager.graph.import_requirements
+    
+    def fail_second_page(requirements, project_id=None, batch_size=None):
+        if requirements[0]["id"] == "req-0100":
+            raise ConnectionError("neo4j down")
+        return import_requirements(requirements, project_id, batch_size)
+    
+    manager.graph.import_requirements = fail_second_page
+    failed = manager.bulk_sync_project("p1", page_size=100, workers=2)
+    
+    assert failed["success"] is False and failed["status"] == FAILED
+    assert (failed["synced"], failed["failed"], failed["last_id"]) == (150, 100, "req-0099")
+    assert manager.supabase.tables["graph_sync_checkpoints"][0]["status"] == FAILED
+    
+    manager.graph.import_requirements = import_requirements
+    manager.graph.batches.clear()
+    resumed = manager.bulk_sync_project("p1", page_size=100, workers=2)
+    
+    assert resumed["success"] is True
+    assert manager.graph.batches == [
+        [f"req-{i:04d}" for i in range(100, 200)], [f"req-{i:04d}" for i in range(200, 250)]
+    ]
+
+
+def test_incremental_sync_pushes_only_changes_after_watermark(manager, monkeypatch):
+    """Тест: инкрементальная синхронизация пишет только изменения после водяного знака и удаляет удаленные."""
+    monkeypatch.setattr(sync_module.neo4j_settings, "graph_sync_overlap_seconds", 0.0)
+    first = manager.incremental_sync_project("p1", page_size=100)
+    assert first["success"] is True and first["mode"] == INCREMENTAL
+    assert first["synced"] == 250
+    # Все требования с одинаковым updated_at прочитаны keyset пагинацией без пропусков
+    assert len({req_id for batch in manager.graph.batches for req_id in batch}) == 250
+    
+    requirements = manager.supabase.tables["requirements"]
+    for req in requirements[10:13]:
+        req["updated_at"] = "2024-01-02T00:00:00+00:00"
+    manager.supabase.tables["change_history"] = [
+        {"entity_type": "requirement", "entity_id": "req-0005", "action": "deleted",
+         "old_values->>project_id": "p1", "changed_at": "2024-01-02T00:00:01+00:00"},
+        {"entity_type": "requirement", "entity_id": "req-other", "action": "deleted",
+         "old_values->>project_id": "p2", "changed_at": "2024-01-02T00:00:01+00:00"},
+    ]
+    manager.graph.batches.clear()
+    
+    second = manager.incremental_sync_project("p1", page_size=100)
+    
+    assert second["success"] is True
+    assert manager.graph.batches == [["req-0010", "req-0011", "req-0012"]]
+    assert manager.graph.deleted == ["req-0005"]
+    watermark = manager.supabase.tables["graph_sync_watermarks"][0]
+    assert watermark["changed_at"] == "2024-01-02T00:00:00+00:00"
+    assert watermark["deleted_at"] == "2024-01-02T00:00:01+00:00"
+    
+    manager.graph.batches.clear()
+    manager.graph.deleted.clear()
+    third = manager.incremental_sync_project("p1", page_size=100)
+    assert manager.graph.batches == [] and manager.graph.deleted == []
+    assert (third["synced"], third["deleted"]) == (0, 0)
+    
+    # С перекрытием окна последние изменения перечитываются (запись идемпотентна)
+    monkeypatch.setattr(sync_module.neo4j_settings, "graph_sync_overlap_seconds", 5.0)
+    manager.incremental_sync_project("p1", page_size=100)
+    assert manager.graph.batches == [["req-0010", "req-0011", "req-0012"]]
+
+
+def test_outbox_worker_coalesces_updates_and_retries_failures(manager):
+    """Тест: записи очереди одного требования сливаются в одну запись графа, ошибка возвращает записи в очередь."""
+    operations = [("req-0001", "upsert"), ("req-0002", "upsert"), ("req-0001", "upsert"),
+                  ("req-0001", "upsert"), ("req-0003", "upsert"), ("req-0003", "delete")]
+    manager.supabase.tables["graph_sync_outbox"] = [
+        {"id": i, "requirement_id": req_id, "project_id": "p1", "operation": op}
+        for i, (req_id, op) in enumerate(operations, start=1)
+    ]
+    manager.graph.error = ConnectionError("neo4j down")
+    
+    failed = manager.drain_outbox(batch_size=100)
+    
+    assert failed["written"] == 0
+    outbox = manager.supabase.tables["graph_sync_outbox"]
+    assert len(outbox) == 6 and all(e["attempts"] == 1 and e["claimed_by"] is None for e in outbox)
+    
+    manager.graph.error = None
+    result = manager.drain_outbox(batch_size=100)
+    
+    assert result == {"claimed": 6, "written": 2, "deleted": 1, "requirement_ids": ["req-0001", "req-0002"]}
+    assert manager.graph.batches == [["req-0001", "req-0002"]]
+    assert manager.graph.deleted == ["req-0003"]
+    assert manager.supabase.tables["graph_sync_outbox"] == []
+    assert manager.outbox_counters["coalesced"] == 3
+    assert manager.outbox_counters["failures"] == 1
+
+
+def test_check_outbox_fails_loudly_without_migration(manager, monkeypatch):
+    """Тест: включенная очередь без миграции останавливает запуск, а не синхронизацию молча."""
+    manager.check_outbox()
+    
+    def missing(name, params):
+        raise Exception("function claim_graph_sync_outbox does not exist")
+    
+    monkeypatch.setattr(manager.supabase, "rpc", missing)
+    with pytest.raises(RuntimeError, match="create_graph_sync_outbox.sql"):
+        manager.check_outbox()
@@ -0,0 +1,109 @@
+"""Тесты бюджета входных токенов агентов."""
+import json
+import pytest
+from types import SimpleNamespace
+from langchain_core.messages import HumanMessage
+from services.knowledge_base.ai_agent import KnowledgeBaseAgent
+from shared import token_budget as token_budget_module
+from shared.ai_config import AISettings, ModelProvider
+from shared.llm_client import AgentLLM, LLMClient
+from shared.token_budget import PromptTooLargeError, TokenBudget, relevance
+from shared.tokens import count_messages_tokens, count_tokens
+
+
+class SummaryLLM:
+    """LLM-заглушка: резюмирует часть списка одной строкой, анализ полноты возвращает JSON."""
+    
+    def __init__(self):
+        self.prompts = []
+    
+    async def ainvoke(self, messages, **kwargs):
+        self.prompts.append(messages)
+        if "compress lists" in messages[0].content:
+            return SimpleNamespace(content=f"- area covered by {len(messages[1].content.splitlines())} requirements")
+        return SimpleNamespace(content=json.dumps({"completeness_score": 0.8, "missing_areas": [], "recommendations": []}))
+
+
+def test_count_tokens():
+    """Тест подсчета токенов."""
+    assert count_tokens("") == 0
+    assert count_tokens("The system shall authenticate users") > 0
+    assert count_messages_tokens([HumanMessage(content="hello world")]) > count_tokens("hello world")
+
+
+def test_rank_by_relevance_and_priority():
+    """Тест упорядочивания по релевантности и приоритету."""
+    items = [
+        {"name": "Reports", "shall": "export monthly reports", "priority": 1},
+        {"name": "Login", "shall": "authenticate users by password", "priority": 5},
+        {"name": "Audit", "shall": "store audit log", "priority": 3},
+    ]
+    text_of = lambda r: f"{r['name']} {r['shall']}"
+    
+    ranked = TokenBudget.rank(items, text_of, "users authenticate with password")
+    assert ranked[0]["name"] == "Login"
+    # Без запроса порядок задает приоритет
+    assert [r["name"] for r in TokenBudget.rank(items, text_of)] == ["Reports", "Audit", "Login"]
+    assert relevance("", "anything") == 0.0
+
+
+def test_fit_keeps_largest_prefix_within_budget():
+    """Тест урезания списка до бюджета."""
+    budget = TokenBudget(AISettings(AI_MAX_INPUT_TOKENS=100))
+    lines = [f"REQ-{i}: requirement number {i}" for i in range(100)]
+    build = lambda items: [HumanMessage(content="\n".join(items))]
+    
+    messages, kept = budget.fit("knowledge_base", lines, build)
+    
+    assert 0 < kept < len(lines)
+    assert count_messages_tokens(messages) <= budget.target("knowledge_base")
+    assert count_messages_tokens(build(lines[:kept + 1])) > budget.target("knowledge_base")
+    assert budget.stats()["knowledge_base"]["trimmed_items"] == len(lines) - kept
+
+
+def test_per_agent_budget_and_rejection():
+    """Тест бюджета агента и отказа от слишком большого промпта."""
+    budget = TokenBudget(AISettings(AI_MAX_INPUT_TOKENS=1000, AI_SPEC_GENERATOR_MAX_INPUT_TOKENS=10))
+    assert budget.limit("knowledge_base") == 1000
+    assert budget.limit("spec_generator") == 10
+    
+    with pytest.raises(PromptTooLargeError):
+        budget.check("spec_generator", [HumanMessage(content="word " * 100)])
+    assert budget.stats()["spec_generator"]["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_agent_llm_never_sends_oversized_prompt(monkeypatch):
+    """Тест: промпт сверх бюджета не отправляется провайдеру."""
+    monkeypatch.setattr(token_budget_module.token_budget, "settings", AISettings(AI_MAX_INPUT_TOKENS=10))
+    
+    class FailingLLM:
+        async def ainvoke(self, messages, **kwargs):
+            raise AssertionError("Oversized prompt must not be sent")
+    
+    agent_llm = AgentLLM(LLMClient({"provider": ModelProvider.OPENAI, "model": "m"}, FailingLLM()), "knowledge_base")
+    with pytest.raises(PromptTooLargeError):
+        await agent_llm.ainvoke([HumanMessage(content="word " * 100)])
+
+
+@pytest.mark.asyncio
+async def test_hierarchical_summarization_for_large_completeness(monkeypatch):
+    """Тест иерархического резюмирования большого набора требований."""
+    settings = AISettings(AI_MAX_INPUT_TOKENS=600, AI_SUMMARY_CHUNK_TOKENS=200)
+    monkeypatch.setattr(token_budget_module.token_budget, "settings", settings)
+    llm = SummaryLLM()
+    agent = KnowledgeBaseAgent.__new__(KnowledgeBaseAgent)
+    agent.llm = llm
+    requirements = [
+        {"identifier": f"REQ-{i}", "name": f"Requirement {i} about feature {i}", "category": "functional"}
+        for i in range(300)
+    ]
+    
+    result = await agent.aanalyze_completeness(requirements, {"name": "Project"})
+    
+    assert result["completeness_score"] == 0.8
+    summaries = [p for p in llm.prompts if "compress lists" in p[0].content]
+    assert len(summaries) > 1
+    final = llm.prompts[-1]
+    assert "area covered by" in final[1].content
+    assert count_messages_tokens(final) <= settings.max_input_tokens